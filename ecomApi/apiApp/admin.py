@@ -4,6 +4,8 @@ from .models import (
     ProductReview, Cart, CartProduct, Wishlist, Order, OrderProduct,
     Wallet, WalletTransaction, ProductOffer, FlashSale
 )
+from .caching import invalidate
+from .ratings import refresh_ratings
 
 # Brand Model Admin
 class BrandAdmin(admin.ModelAdmin):
@@ -58,6 +60,15 @@ class ProductReviewAdmin(admin.ModelAdmin):
     list_display = ('product', 'user', 'rating', 'approved')
     list_filter = ('approved', 'rating')
     search_fields = ('product__title', 'user__username', 'review')
+    actions = ('approve',)
+
+    # One UPDATE, then one recompute of the touched products' ratings.
+    @admin.action(description="Approve selected reviews")
+    def approve(self, request, queryset):
+        rows = list(queryset.values_list('pk', 'product_id'))
+        queryset.update(approved=True)
+        refresh_ratings({product_id for _, product_id in rows})
+        invalidate('productreview', *[pk for pk, _ in rows])
 
 admin.site.register(ProductReview, ProductReviewAdmin)
 
@@ -101,6 +112,7 @@ admin.site.register(Order, OrderAdmin)
 class WalletAdmin(admin.ModelAdmin):
     list_display = ('user', 'balance')
     search_fields = ('user__username',)
+    readonly_fields = ('balance',)  # moved only by ledger postings
 
 admin.site.register(Wallet, WalletAdmin)
 
@@ -0,0 +1,167 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import caching
+from .compiled import compile_serializer
+from .pricing import refresh_expired_prices
+from .views import (
+    BrandViewSet, CategoryViewSet, ProductViewSet, ProductOfferViewSet,
+    PricedMixin, ResponseCacheMixin, cached_response,
+)
+
+# ===========================
+# Async (ASGI) read path
+# ===========================
+#
+# /api/async/{products,categories,brands,product-offers}/[<id>/] serve the
+# same JSON as the DRF list/retrieve endpoints from native async views.
+# Under ASGI a request waiting on the database or the cache then doesn't
+# tie up a worker thread for its whole lifetime. Each view borrows its DRF
+# viewset for everything that doesn't touch the database: queryset and
+# eager loading, filters, ordering, serializer and ETag versions. The I/O
+# runs through the async ORM and cache API. Conditional GET, the rendered
+# response cache and keyset pagination behave as on the sync endpoints.
+#
+# Detail pages fan out. The row query and each of its reverse foreign key
+# prefetches (a product's variant tree) are awaited together with
+# asyncio.gather instead of the prefetches waiting for the row. Django
+# 5.1 still runs one request's ORM calls one after another on that
+# request's thread, so today this saves round trips through the event loop
+# rather than overlapping the queries. The queries will overlap once the
+# ORM is natively async.
+#
+# Writes and every other endpoint stay on the DRF viewsets.
+# `manage.py loadtest` compares the two paths under concurrency.
+
+JSON = JSONRenderer()
+
+
+def _json(data, status=200):
+    return HttpResponse(JSON.render(data), status=status, content_type=JSONRenderer.media_type)
+
+
+def _error(exc):
+    # Same bodies as DRF's exception handler.
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return _json(data, exc.status_code)
+
+
+def _reverse_foreign_key(model, lookup):
+    # Top-level Prefetch over a reverse ForeignKey, which can be filtered on
+    # the parent's pk without waiting for the parent row.
+    if not isinstance(lookup, Prefetch) or lookup.to_attr or '__' in lookup.prefetch_through:
+        return None
+    for relation in model._meta.related_objects:
+        if relation.one_to_many and relation.get_accessor_name() == lookup.prefetch_through:
+            return relation
+    return None
+
+
+async def aget_fanned_out(queryset, pk):
+    """`queryset.aget(pk=pk)` with its reverse foreign key prefetches queried alongside the row."""
+    model = queryset.model
+    fanned, rest = [], []
+    for lookup in queryset._prefetch_related_lookups:
+        relation = _reverse_foreign_key(model, lookup)
+        if relation is None:
+            rest.append(lookup)
+        else:
+            fanned.append((lookup, relation))
+
+    async def related_rows(lookup, relation):
+        rows = lookup.queryset if lookup.queryset is not None else relation.related_model._default_manager.all()
+        return [row async for row in rows.filter(**{relation.field.attname: pk})]
+
+    try:
+        instance, *groups = await asyncio.gather(
+            queryset.prefetch_related(None).prefetch_related(*rest).aget(pk=pk),
+            *[related_rows(lookup, relation) for lookup, relation in fanned],
+        )
+    except (model.DoesNotExist, ValueError, TypeError):
+        raise Http404(f'No {model._meta.object_name} matches the given query.')
+
+    # What prefetch_related would have stored.
+    cache = instance.__dict__.setdefault('_prefetched_objects_cache', {})
+    for (lookup, relation), rows in zip(fanned, groups):
+        for row in rows:
+            # Rows that select_related their parent (with its own relations) keep that copy.
+            if not relation.field.is_cached(row):
+                relation.field.set_cached_value(row, instance)
+        related = getattr(instance, relation.get_accessor_name()).all()
+        related._result_cache, related._prefetch_done = rows, True
+        cache[relation.get_accessor_name()] = related
+    return instance
+
+
+class AsyncReadView:
+    """Async list/retrieve for the read side of a DRF viewset."""
+
+    def __init__(self, viewset_class):
+        self.viewset_class = viewset_class
+
+    def viewset(self, request, action, kwargs):
+        request = Request(request)
+        request.accepted_renderer, request.accepted_media_type = JSON, JSONRenderer.media_type
+        view = self.viewset_class(request=request, args=(), kwargs=kwargs, action=action, format_kwarg=None)
+        return view, request
+
+    async def list(self, request):
+        return await self.respond(request, 'list', {}, self.render_list)
+
+    async def retrieve(self, request, pk):
+        return await self.respond(request, 'retrieve', {'pk': str(pk)}, self.render_detail)
+
+    async def respond(self, request, action, kwargs, render):
+        view, request = self.viewset(request, action, kwargs)
+        try:
+            if not all(isinstance(permission, AllowAny) for permission in view.get_permissions()):
+                await sync_to_async(view.check_permissions)(request)
+            if isinstance(view, PricedMixin):
+                await sync_to_async(refresh_expired_prices)()
+
+            versions = await caching.aget_versions(view.etag_versions())
+            etag = caching.version_etag(request, JSON.format, versions)
+            if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+                response = HttpResponseNotModified()
+            elif isinstance(view, ResponseCacheMixin):
+                entry = await caching.aget_response(etag)
+                if entry is not None:
+                    response = cached_response(request, entry, 'HIT')
+                else:
+                    response = await render(view, request)
+                    if response.status_code == 200:
+                        response = cached_response(request, await caching.astore_response(etag, response), 'MISS')
+            else:
+                response = await render(view, request)
+        except Http404 as exc:
+            return _error(NotFound(*exc.args))
+        except APIException as exc:
+            return _error(exc)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+        return response
+
+    async def render_list(self, view, request):
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        page = await paginator.apaginate_queryset(queryset, request, view) if paginator is not None else None
+        if page is None:
+            return _json(view.render_many([row async for row in queryset.aiterator(chunk_size=2000)]))
+        return _json(paginator.get_paginated_response(view.render_many(page)).data)
+
+    async def render_detail(self, view, request):
+        instance = await aget_fanned_out(view.filter_queryset(view.get_queryset()), view.kwargs['pk'])
+        return _json(compile_serializer(view.get_serializer())(instance))
+
+
+products = AsyncReadView(ProductViewSet)
+categories = AsyncReadView(CategoryViewSet)
+brands = AsyncReadView(BrandViewSet)
+product_offers = AsyncReadView(ProductOfferViewSet)
@@ -0,0 +1,653 @@
+import math
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .models import Brand, Category, Subcategory, Product, ProductVariant, ProductImage
+from .querysets import eager_load
+
+# ===========================
+# Benchmarks (manage.py benchmark)
+# ===========================
+#
+# Each benchmark seeds its own synthetic data; the command runs it inside a
+# transaction that is rolled back afterwards.
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def best_of(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def seed_catalog(size, variants=2, images=2):
+    brand = Brand.objects.create(title='Benchmark brand', slug='benchmark-brand')
+    category = Category.objects.create(title='Benchmark category', slug='benchmark-category')
+    subcategory = Subcategory.objects.create(title='Benchmark subcategory', slug='benchmark-subcategory', category=category)
+    products = Product.objects.bulk_create([
+        Product(
+            title=f'Benchmark product {n}', slug=f'benchmark-product-{n}', sku=f'bench-{n}',
+            description='Lorem ipsum dolor sit amet ' * 8, mrp=120, price=100, cost_price=60,
+            brand=brand, category=category, subcategory=subcategory, total_stock=variants * 10,
+        )
+        for n in range(size)
+    ])
+    product_variants = ProductVariant.objects.bulk_create([
+        ProductVariant(product=product, color=f'color-{v}', size=f'size-{v}', stock=10)
+        for product in products for v in range(variants)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product_variant=variant, image=f'product_variant_images/{variant.pk}-{i}.png')
+        for variant in product_variants for i in range(images)
+    ])
+    return products
+
+
+def in_thread(func):
+    """Start `func` on a thread with its own connection, which commits outside the benchmark's transaction."""
+    def target():
+        try:
+            func()
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def retry_locked(func, retries):
+    # SQLite serialises writers; other backends never get here.
+    while True:
+        try:
+            return func()
+        except OperationalError:
+            retries[0] += 1
+            time.sleep(0.001)
+
+
+def api_request(path):
+    # Absolute media URLs need a host this deployment accepts.
+    host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.')
+    return Request(APIRequestFactory().get(path, HTTP_HOST=host))
+
+
+def render(serializer_class, path, queryset):
+    request = api_request(path)
+    serializer = serializer_class(context={'request': request})
+    rows = list(eager_load(queryset, serializer))
+    return JSONRenderer().render(serializer_class(rows, many=True, context={'request': request}).data)
+
+
+@benchmark('product-payloads')
+def product_payloads(stdout, size):
+    from .serializers import ProductSerializer, ProductCardSerializer
+
+    seed_catalog(size)
+    queryset = Product.objects.all()
+    cases = [
+        ('full ProductSerializer', ProductSerializer, '/api/products/'),
+        ('card', ProductCardSerializer, '/api/products/'),
+        ('card ?fields=id,title,effective_price', ProductCardSerializer, '/api/products/?fields=id,title,effective_price'),
+    ]
+    baseline = None
+    for label, serializer_class, path in cases:
+        seconds, body = best_of(lambda: render(serializer_class, path, queryset))
+        baseline = baseline or (seconds, len(body))
+        stdout.write(
+            f'{label:<40} {seconds * 1000:9.1f} ms {len(body):>10} bytes '
+            f'({baseline[0] / seconds:4.1f}x faster, {baseline[1] / len(body):4.1f}x smaller)'
+        )
+
+
+@benchmark('compiled-serializers')
+def compiled_serializers(stdout, size):
+    from .compiled import compile_serializer
+    from .serializers import ProductSerializer, ProductCardSerializer
+
+    seed_catalog(size)
+    request = api_request('/api/products/')
+    for serializer_class in (ProductSerializer, ProductCardSerializer):
+        rows = list(eager_load(Product.objects.all(), serializer_class(context={'request': request})))
+        drf_seconds, drf_body = best_of(
+            lambda: JSONRenderer().render(serializer_class(rows, many=True, context={'request': request}).data)
+        )
+        compiled_seconds, compiled_body = best_of(
+            lambda: JSONRenderer().render(compile_serializer(serializer_class(many=True, context={'request': request}))(rows))
+        )
+        assert compiled_body == drf_body, 'compiled output differs from DRF'
+        stdout.write(
+            f'{serializer_class.__name__:<24} DRF {drf_seconds * 1000:8.1f} ms  '
+            f'compiled {compiled_seconds * 1000:8.1f} ms  ({drf_seconds / compiled_seconds:4.1f}x)'
+        )
+
+
+@benchmark('stock-reservations')
+def stock_reservations(stdout, size):
+    from . import inventory
+
+    variant_ids = [variant.pk for product in seed_catalog(max(size // 10, 1), variants=1, images=0)
+                   for variant in product.variants.all()]
+    ProductVariant.objects.filter(pk__in=variant_ids).update(stock=size)
+
+    start = time.perf_counter()
+    reservations = [inventory.reserve(variant_ids[n % len(variant_ids)], 1) for n in range(size)]
+    reserve_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    released = inventory.release([reservation.pk for reservation in reservations])
+    release_seconds = time.perf_counter() - start
+    assert released == size
+    stdout.write(
+        f'reserve  {size / reserve_seconds:10.0f} holds/s\n'
+        f'release  {size / release_seconds:10.0f} holds/s (batched)'
+    )
+
+
+@benchmark('reservation-contention')
+def reservation_contention(stdout, size, hot=4):
+    # Buyers commit on their own connections, outside the benchmark's
+    # rolled-back transaction, so the variants they fight over are created
+    # and deleted by a thread as well.
+    from . import inventory
+
+    holds = size * 2
+    tag = uuid.uuid4().hex[:8]
+    variant_ids = []
+
+    def seed():
+        brand = Brand.objects.create(title=f'Contention {tag}')
+        category = Category.objects.create(title=f'Contention {tag}')
+        subcategory = Subcategory.objects.create(title=f'Contention {tag}', category=category)
+        for n in range(hot):
+            product = Product.objects.create(
+                title=f'Contention {tag} {n}', mrp=120, price=100, cost_price=60,
+                brand=brand, category=category, subcategory=subcategory,
+            )
+            variant_ids.append(ProductVariant.objects.create(product=product, color='c', size='s', stock=holds).pk)
+
+    def cleanup():
+        Brand.objects.filter(title=f'Contention {tag}').delete()
+        Category.objects.filter(title=f'Contention {tag}').delete()
+
+    in_thread(seed).join()
+    try:
+        lines = []
+        for threads in (1, 4, 16):
+            taken, retries = [], [0]
+
+            def buyer(offset):
+                for n in range(offset, holds, threads):
+                    variant_id = variant_ids[n % hot]
+                    taken.append(retry_locked(lambda: inventory.reserve(variant_id, 1).pk, retries))
+
+            start = time.perf_counter()
+            for worker in [in_thread(lambda offset=offset: buyer(offset)) for offset in range(threads)]:
+                worker.join()
+            seconds = time.perf_counter() - start
+            assert len(taken) == holds
+            released = []
+            in_thread(lambda: released.append(inventory.release(taken))).join()
+            assert released == [holds]
+            lines.append(
+                f'{threads:>2} buyer(s) on {hot} variants  {holds / seconds:8.0f} holds/s  '
+                f'({retries[0]} lock retries)'
+            )
+        stdout.write('\n'.join(lines))
+    finally:
+        in_thread(cleanup).join()
+
+
+@benchmark('checkout')
+def checkout_carts(stdout, size):
+    from .checkout import checkout
+    from .models import Cart, CartProduct, Wallet
+
+    products = seed_catalog(500, variants=1, images=0)
+    variants = list(ProductVariant.objects.filter(product__in=products).order_by('pk'))
+    ProductVariant.objects.filter(pk__in=[variant.pk for variant in variants]).update(stock=size)
+    user = get_user_model().objects.create_user(username='benchmark-shopper')
+    Wallet.objects.create(user=user, balance=10 ** 7)
+    for lines in (1, 10, 100, 500):
+        cart = Cart.objects.create(user=user)
+        CartProduct.objects.bulk_create([
+            CartProduct(cart=cart, product_id=variant.product_id, variant=variant, quantity=1)
+            for variant in variants[:lines]
+        ])
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            checkout(cart)
+            seconds = time.perf_counter() - start
+        stdout.write(f'{lines:>4} lines  {seconds * 1000:8.1f} ms  {len(ctx.captured_queries):>3} queries')
+
+
+@benchmark('wallet-ledger')
+def wallet_ledger(stdout, size):
+    from datetime import timedelta
+    from django.utils.timezone import now
+    from . import ledger
+    from .models import Wallet, WalletTransaction
+
+    # `size` days of 1000 transactions each: 1M rows at the default size.
+    per_day = 1000
+    user = get_user_model().objects.create_user(username='benchmark-ledger')
+    wallet = Wallet.objects.create(user=user)
+    start = now() - timedelta(days=size + 1)
+    for day in range(size):
+        first = WalletTransaction.objects.bulk_create([
+            WalletTransaction(wallet=wallet, amount=10, transaction_type='Withdrawal' if n % 3 == 2 else 'Deposit')
+            for n in range(per_day)
+        ])[0]
+        WalletTransaction.objects.filter(pk__gte=first.pk).update(created_at=start + timedelta(days=day))
+    at = start + timedelta(days=size - 1, hours=12)
+
+    full_seconds, full = best_of(lambda: ledger.balance_at(wallet.pk, at), repeat=3)
+    snapshot_start = time.perf_counter()
+    for day in range(size):
+        ledger.take_snapshot(wallet.pk, start + timedelta(days=day, hours=1))
+    snapshot_seconds = time.perf_counter() - snapshot_start
+    tail_seconds, tail = best_of(lambda: ledger.balance_at(wallet.pk, at), repeat=3)
+    assert full == tail, 'snapshot balance differs from the full history sum'
+
+    post_start = time.perf_counter()
+    for _ in range(1000):
+        ledger.post_transaction(wallet.pk, 10, 'Deposit')
+    post_seconds = time.perf_counter() - post_start
+
+    stdout.write(
+        f'{size * per_day} transactions\n'
+        f'balance_at, full history    {full_seconds * 1000:9.1f} ms\n'
+        f'balance_at, snapshot + tail {tail_seconds * 1000:9.1f} ms  ({full_seconds / tail_seconds:.0f}x)\n'
+        f'daily snapshots ({size})     {snapshot_seconds * 1000:9.1f} ms\n'
+        f'post_transaction            {1000 / post_seconds:9.0f} /s'
+    )
+
+
+@benchmark('catalog-ingest')
+def catalog_ingest(stdout, size):
+    from .ingest import ingest_products
+
+    brand = Brand.objects.create(title='Ingest brand', slug='ingest-brand')
+    category = Category.objects.create(title='Ingest category', slug='ingest-category')
+    subcategory = Subcategory.objects.create(title='Ingest subcategory', slug='ingest-subcategory', category=category)
+
+    def rows(prefix, count):
+        return [
+            {
+                'title': f'{prefix} product {n}', 'sku': f'{prefix}-{n}', 'mrp': '120.00', 'price': '100.00', 'cost_price': '60.00',
+                'brand': 'ingest-brand', 'category': 'ingest-category', 'subcategory': 'ingest-subcategory',
+                'variants': [
+                    {'color': f'color-{v}', 'size': 'M', 'stock': 5, 'images': [f'product_variant_images/{prefix}-{n}-{v}.png']}
+                    for v in range(2)
+                ],
+            }
+            for n in range(count)
+        ]
+
+    # One row at a time through the models, as the per-object endpoints do.
+    sample = min(size, 200)
+    start = time.perf_counter()
+    for row in rows('single', sample):
+        product = Product.objects.create(
+            title=row['title'], sku=row['sku'], mrp=row['mrp'], price=row['price'], cost_price=row['cost_price'],
+            brand=brand, category=category, subcategory=subcategory,
+        )
+        for variant_row in row['variants']:
+            variant = ProductVariant.objects.create(product=product, color=variant_row['color'], size='M', stock=5)
+            ProductImage.objects.create(product_variant=variant, image=variant_row['images'][0])
+    single_rate = sample / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    result = ingest_products(rows('bulk', size))
+    bulk_rate = size / (time.perf_counter() - start)
+    assert result['created'] == size and not result['errors'], result['errors'][:3]
+
+    start = time.perf_counter()
+    result = ingest_products(rows('bulk', size))
+    upsert_rate = size / (time.perf_counter() - start)
+    assert result['updated'] == size
+
+    stdout.write(
+        f'one at a time  {single_rate:9.0f} products/s\n'
+        f'bulk create    {bulk_rate:9.0f} products/s  ({bulk_rate / single_rate:.0f}x)\n'
+        f'bulk upsert    {upsert_rate:9.0f} products/s'
+    )
+
+
+@benchmark('catalog-export-import')
+def catalog_export_import(stdout, size):
+    # seed_catalog gives 7 rows per product; --size 143000 is ~1M rows.
+    from .catalog_io import READERS, WRITERS, count_rows, export_records, import_records
+
+    seed_catalog(size)
+    directory = tempfile.mkdtemp()
+    lines = []
+    for name in ('ndjson', 'csv'):
+        path = os.path.join(directory, f'catalog.{name}')
+        start = time.perf_counter()
+        with open(path, 'w', newline='') as fh:
+            rows = sum(count_rows(record) for record in WRITERS[name](export_records(), fh))
+        seconds = time.perf_counter() - start
+        lines.append(f'export {name:6}  {rows / seconds:9.0f} rows/s  {os.path.getsize(path) / 2**20:7.1f} MiB')
+
+    # Peak Python allocations of an export, which shouldn't grow with size.
+    tracemalloc.start()
+    with open(os.devnull, 'w') as fh:
+        for _ in WRITERS['ndjson'](export_records(), fh):
+            pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    for name in ('ndjson', 'csv'):
+        start = time.perf_counter()
+        with open(os.path.join(directory, f'catalog.{name}'), newline='') as fh:
+            rows = updated = 0
+            for _, result in import_records(READERS[name](fh)):
+                rows += result['rows']
+                updated += result['updated']
+        seconds = time.perf_counter() - start
+        assert updated >= size, updated
+        lines.append(f'import {name:6}  {rows / seconds:9.0f} rows/s  (upsert)')
+
+    lines.append(f'export peak memory  {peak / 2**20:.1f} MiB for {rows} rows')
+    stdout.write('\n'.join(lines))
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark('streaming-lists')
+def streaming_lists(stdout, size):
+    from .serializers import ProductVariantSerializer
+    from .views import ProductVariantViewSet
+
+    seed_catalog(size)
+    view = ProductVariantViewSet.as_view({'get': 'list'})
+    host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.')
+
+    def stream(path):
+        response = view(APIRequestFactory().get(path, HTTP_HOST=host, HTTP_ACCEPT='application/x-ndjson'))
+        return sum(len(chunk) for chunk in response.streaming_content)
+
+    # Half the rows, then all of them: a whole-list render grows with the
+    # result, the stream shouldn't.
+    for label, query, queryset in (
+        ('half', '?color=color-0', ProductVariant.objects.filter(color='color-0')),
+        ('all', '', ProductVariant.objects.all()),
+    ):
+        rows = queryset.count()
+        whole_seconds, _ = best_of(lambda: render(ProductVariantSerializer, '/api/product-variants/', queryset), 3)
+        stream_seconds, _ = best_of(lambda: stream(f'/api/product-variants/{query}'), 3)
+        whole_peak = peak_memory(lambda: render(ProductVariantSerializer, '/api/product-variants/', queryset))
+        stream_peak = peak_memory(lambda: stream(f'/api/product-variants/{query}'))
+        stdout.write(
+            f'{label:<5} {rows:>8} rows  whole list {whole_seconds * 1000:8.1f} ms {whole_peak / 2**20:7.1f} MiB   '
+            f'stream {stream_seconds * 1000:8.1f} ms {stream_peak / 2**20:7.1f} MiB'
+        )
+
+
+@benchmark('sku-allocation')
+def sku_allocation(stdout, size, threads=8, block=100):
+    # Allocator threads commit on their own connections, outside the
+    # benchmark's rolled-back transaction, so they use a throwaway counter.
+    from .identifiers import unique_skus
+    from .models import Sequence
+
+    total = size * 100  # 100k SKUs at the default size
+    brand_id = f'bench{uuid.uuid4().hex[:6]}'
+    allocated, retries = [], [0]
+    run = in_thread
+
+    def allocator(blocks):
+        for _ in range(blocks):
+            allocated.extend(retry_locked(lambda: unique_skus([brand_id] * block), retries))
+
+    start = time.perf_counter()
+    workers = [run(lambda: allocator(total // block // threads)) for _ in range(threads)]
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+    assert len(allocated) == len(set(allocated)) == total // block // threads * block * threads
+
+    # One at a time, as Product.save() allocates.
+    singles = min(total, 2000)
+    start = time.perf_counter()
+    run(lambda: [unique_skus([brand_id]) for _ in range(singles)]).join()
+    single_seconds = time.perf_counter() - start
+    run(lambda: Sequence.objects.filter(name=f'sku:{brand_id}').delete()).join()
+
+    # The previous `brand-<8 hex chars>` scheme, for comparison.
+    legacy = [uuid.uuid4().hex[:8] for _ in range(len(allocated))]
+    collision_odds = 1 - math.exp(-len(legacy) ** 2 / (2 * 16 ** 8))
+    stdout.write(
+        f'{threads} threads, blocks of {block}  {len(allocated) / seconds:9.0f} SKUs/s  '
+        f'({len(allocated)} unique, {retries[0]} lock retries)\n'
+        f'one per call                {singles / single_seconds:9.0f} SKUs/s\n'
+        f'8-hex uuid slices           {len(legacy) - len(set(legacy)):9d} collisions '
+        f'(P(any) = {collision_odds:.0%})'
+    )
+
+
+@benchmark('product-ratings')
+def product_ratings(stdout, size, reviews=20):
+    from django.db.models import Avg, Count, Q
+
+    from .models import ProductRating, ProductReview
+    from .ratings import reconcile_ratings
+
+    products = seed_catalog(size, variants=0, images=0)
+    users = get_user_model().objects.bulk_create([
+        get_user_model()(username=f'benchmark-reviewer-{n}') for n in range(reviews)
+    ])
+    ProductReview.objects.bulk_create([
+        ProductReview(product=product, user=user, rating=(product.pk + n) % 5 + 1, approved=n % 4 != 0)
+        for product in products for n, user in enumerate(users)
+    ])
+    start = time.perf_counter()
+    reconcile_ratings()
+    reconcile_seconds = time.perf_counter() - start
+
+    approved = Q(reviews__approved=True)
+    cases = [
+        ('aggregate reviews per request', lambda: list(
+            Product.objects.annotate(average=Avg('reviews__rating', filter=approved), count=Count('reviews', filter=approved))
+            .order_by('-average', '-id').values_list('pk', 'average', 'count')[:50]
+        )),
+        ('precomputed ProductRating', lambda: list(
+            Product.objects.order_by('-rating__average', '-id').values_list('pk', 'rating__average', 'rating__count')[:50]
+        )),
+    ]
+    baseline = None
+    for label, query in cases:
+        seconds, _ = best_of(query)
+        baseline = baseline or seconds
+        stdout.write(f'top 50 by rating, {label:<30} {seconds * 1000:9.2f} ms ({baseline / seconds:6.1f}x)')
+
+    review = ProductReview.objects.filter(approved=False).first()
+    start = time.perf_counter()
+    for _ in range(200):
+        review.approved = not review.approved
+        review.save()
+    stdout.write(
+        f'review save incl. aggregate update  {(time.perf_counter() - start) / 200 * 1000:9.2f} ms\n'
+        f'reconcile_ratings ({size * reviews} reviews)  {reconcile_seconds * 1000:9.1f} ms'
+    )
+    assert ProductRating.objects.count() >= size
+
+
+@benchmark('navigation')
+def navigation_menu(stdout, size, categories=20, subcategories=10):
+    from django.test import Client
+
+    from .navigation import build_tree, get_navigation
+
+    seed_catalog(size, variants=0, images=0)
+    groups = Category.objects.bulk_create([
+        Category(title=f'Navigation category {n}', slug=f'navigation-category-{n}') for n in range(categories)
+    ])
+    children = Subcategory.objects.bulk_create([
+        Subcategory(title=f'Navigation subcategory {n}-{m}', slug=f'navigation-subcategory-{n}-{m}', category=group)
+        for n, group in enumerate(groups) for m in range(subcategories)
+    ])
+    for n, product_id in enumerate(Product.objects.values_list('pk', flat=True)):
+        child = children[n % len(children)]
+        Product.objects.filter(pk=product_id).update(category_id=child.category_id, subcategory_id=child.pk)
+
+    client = Client(HTTP_HOST=(settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.'))
+    build_seconds, _ = best_of(build_tree)
+    get_navigation()
+    cases = [
+        ('/api/categories/ + /api/subcategories/',
+         lambda: (client.get('/api/categories/?page_size=200'), client.get('/api/subcategories/?page_size=200'))),
+        ('/api/navigation/', lambda: client.get('/api/navigation/')),
+    ]
+    for label, func in cases:
+        func()  # warm the response cache / navigation tree
+        with CaptureQueriesContext(connection) as ctx:
+            seconds, _ = best_of(func, 20)
+        stdout.write(f'{label:<42} {seconds * 1000:8.2f} ms  {len(ctx.captured_queries) // 20:3d} queries/request')
+    stdout.write(f'tree rebuild ({size} products)            {build_seconds * 1000:8.2f} ms')
+
+
+def photo(width, height, seed):
+    # Gradients with some noise compress roughly like product photos.
+    from PIL import Image, ImageChops
+
+    red = Image.linear_gradient('L').resize((width, height))
+    green = Image.radial_gradient('L').resize((width, height)).rotate(seed * 37 % 360)
+    noise = Image.effect_noise((width, height), 24)
+    return Image.merge('RGB', (red, ImageChops.blend(green, noise, 0.3), noise))
+
+
+@benchmark('image-derivatives')
+def image_derivatives(stdout, size, page=50, workers=4):
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+
+    from django.core.files.base import ContentFile
+    from django.test import override_settings
+
+    from . import images
+    from .serializers import ProductCardSerializer
+
+    count = min(size, page)
+    # Plain files: blob bookkeeping would need the database from the worker threads.
+    storages = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'}}
+    with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media, STORAGES=storages):
+        products = seed_catalog(count, variants=0, images=0)
+        for n, product in enumerate(products):
+            buffer = io.BytesIO()
+            photo(1600, 1200, n).save(buffer, 'JPEG', quality=90)
+            product.thumb.save(f'bench-{n}.jpg', ContentFile(buffer.getvalue()), save=False)
+            Product.objects.filter(pk=product.pk).update(thumb=product.thumb.name)
+
+        # Worker threads can't see this benchmark's uncommitted rows, so the
+        # pool is measured on render(), the part it runs in parallel.
+        files = [product.thumb for product in products]
+        lines, baseline = [], None
+        for threads in (1, workers):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                entries = list(pool.map(images.render, files))
+            seconds = time.perf_counter() - start
+            baseline = baseline or seconds
+            lines.append(f'render {count} uploads, {threads} worker(s)  {count / seconds:7.1f} images/s ({baseline / seconds:4.1f}x)')
+        for product, entry in zip(products, entries):
+            Product.objects.filter(pk=product.pk).update(renditions={'thumb': entry})
+
+        originals = sum(product.thumb.size for product in products)
+        lines.append(f'{count}-card page image bytes, originals        {originals / 1024:9.0f} KiB')
+        for width in (320, 640):
+            for fmt in images.FORMATS:
+                derived = sum(item['bytes'] for entry in entries for item in entry['derivatives']
+                              if item['format'] == fmt and item['width'] == width)
+                lines.append(f'{count}-card page image bytes, {fmt:4} {width}w         {derived / 1024:9.0f} KiB'
+                             f' ({originals / derived:5.1f}x smaller)')
+        queryset = Product.objects.filter(pk__in=[product.pk for product in products]).order_by('pk')
+        payload = render(ProductCardSerializer, '/api/products/', queryset)
+        assert payload.count(b' 160w') == 2 * count
+        lines.append(f'JSON page with srcsets                          {len(payload) / 1024:9.1f} KiB')
+    stdout.write('\n'.join(lines))
+
+
+@benchmark('media-dedup')
+def media_dedup(stdout, size, sizes=4, shots=2):
+    import io
+
+    from django.core.files.base import ContentFile
+    from django.test import Client, override_settings
+
+    from .models import MediaBlob
+
+    count = min(size, 200)
+    photos = []
+    for n in range(count * shots):
+        buffer = io.BytesIO()
+        photo(400, 300, n).save(buffer, 'JPEG', quality=85)
+        photos.append(buffer.getvalue())
+    # Every size of a product shows the same shots.
+    products = seed_catalog(count, variants=sizes, images=0)
+    variants = list(ProductVariant.objects.filter(product__in=products).order_by('product_id', 'pk'))
+
+    lines = []
+    backends = [
+        ('plain FileSystemStorage', 'django.core.files.storage.FileSystemStorage'),
+        ('content-addressed', 'apiApp.storage.ContentAddressedStorage'),
+    ]
+    for label, backend in backends:
+        with tempfile.TemporaryDirectory() as media, override_settings(
+            MEDIA_ROOT=media, STORAGES={**settings.STORAGES, 'default': {'BACKEND': backend}},
+        ):
+            start = time.perf_counter()
+            for index, variant in enumerate(variants):
+                product = index // sizes
+                for shot in range(shots):
+                    ProductImage.objects.create(product_variant=variant, image=ContentFile(
+                        photos[product * shots + shot], name=f'{variant.product_id}-{shot}.jpg',
+                    ))
+            seconds = time.perf_counter() - start
+            used = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(media) for name in names)
+            uploads = len(variants) * shots
+            lines.append(f'{label:<24} {uploads} uploads  {used / 2**20:7.1f} MiB on disk  '
+                         f'{seconds / uploads * 1000:6.2f} ms/upload')
+
+            if backend.endswith('ContentAddressedStorage'):
+                assert MediaBlob.objects.count() >= count * shots
+                name = ProductImage.objects.filter(product_variant=variants[0]).values_list('image', flat=True).first()
+                client = Client(HTTP_HOST=(settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.'))
+                etag = client.get(f'/media/{name}')['ETag']
+                full, _ = best_of(lambda: b''.join(client.get(f'/media/{name}').streaming_content), 50)
+                revalidate, response = best_of(lambda: client.get(f'/media/{name}', HTTP_IF_NONE_MATCH=etag), 50)
+                assert response.status_code == 304
+                lines.append(f'GET blob 200 {full * 1000:6.3f} ms, revalidated 304 {revalidate * 1000:6.3f} ms, '
+                             f'Cache-Control: {response["Cache-Control"]}')
+            ProductImage.objects.filter(product_variant__in=variants).delete()
+    stdout.write('\n'.join(lines))
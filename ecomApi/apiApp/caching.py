@@ -0,0 +1,161 @@
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+# ===========================
+# Cross-process version keys
+# ===========================
+#
+# In-process structures (facet index, navigation tree, ...) remember the
+# version they were built from. Writers bump the shared version in the
+# configured cache backend and every worker rebuilds on its next read.
+
+
+# Bumps may record what changed so a worker can patch its structure
+# instead of rebuilding it; a record that has expired means a rebuild.
+CHANGES_TIMEOUT = 3600
+
+
+def _key(name):
+    return f'apiApp:version:{name}'
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        # A fresh, time-based seed so a cleared cache never reuses a version
+        # some worker already built from.
+        cache.add(_key(name), time.time_ns(), timeout=None)
+        version = cache.get(_key(name))
+    return version
+
+
+def _after_commit(func):
+    # A reader running between a write and its commit can cache pre-commit
+    # rows under the version bumped so far, so the bump that counts is the
+    # one on commit. Bumping right away as well keeps the writing
+    # transaction's own later reads off the old version.
+    func()
+    if connection.in_atomic_block:
+        transaction.on_commit(func)
+
+
+def _changes_key(name, version):
+    return f'apiApp:changes:{name}:{version}'
+
+
+def _bump(name, changes=None):
+    try:
+        version = cache.incr(_key(name))
+    except ValueError:
+        version = time.time_ns()
+        cache.set(_key(name), version, timeout=None)
+    # incr() is a read then a write on the database and file backends, so
+    # two bumps can land on one version. The second record would overwrite
+    # the first: jump to a fresh version instead, which readers rebuild from.
+    if changes is not None and not cache.add(_changes_key(name, version), changes, timeout=CHANGES_TIMEOUT):
+        cache.set(_key(name), time.time_ns(), timeout=None)
+
+
+def bump_version(name, changes=None):
+    """Bump `name`, recording `changes` (a list) against the new version for version_changes()."""
+    _after_commit(lambda: _bump(name, changes))
+
+
+def version_changes(name, since, version, limit=100):
+    """
+    The `changes` recorded by every bump after `since` up to `version`,
+    concatenated, or None when a bump recorded none (or has expired) or
+    there are more than `limit` of them.
+    """
+    if not isinstance(since, int) or not isinstance(version, int) or not 0 <= version - since <= limit:
+        return None
+    keys = [_changes_key(name, bumped) for bumped in range(since + 1, version + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return None
+    return [change for key in keys for change in found[key]]
+
+
+def get_versions(names):
+    return [get_version(name) for name in names]
+
+
+async def aget_versions(names):
+    # One round trip when every version is already seeded (the usual case).
+    keys = [_key(name) for name in names]
+    found = await cache.aget_many(keys)
+    if len(found) == len(keys):
+        return [found[key] for key in keys]
+    return await sync_to_async(get_versions)(names)
+
+
+def invalidate(model_name, *pks):
+    """Bump the collection version of `model_name` and the row versions of `pks`."""
+    _after_commit(lambda: _invalidate(model_name, pks))
+
+
+def _invalidate(model_name, pks):
+    _bump(model_name)
+    if len(pks) == 1:
+        _bump(f'{model_name}:{pks[0]}')
+    elif pks:
+        # Row versions only need to change, so a batch gets a fresh stamp in
+        # a single round trip instead of one increment per row.
+        stamp = time.time_ns()
+        cache.set_many({_key(f'{model_name}:{pk}'): stamp for pk in pks}, timeout=None)
+
+
+# ===========================
+# Version ETags and rendered response cache
+# ===========================
+#
+# A response's ETag is derived from the request (absolute path, sorted
+# query, renderer) and the versions of the rows it is built from, so it is
+# known before anything is queried or serialized. Rendered bytes are cached
+# under that ETag: a write bumps a version, dependent entries simply stop
+# being addressed and age out, and nothing has to be found and deleted.
+
+RESPONSE_TIMEOUT = getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 600)
+
+
+def version_etag(request, renderer_format, versions):
+    query = '&'.join(sorted(request.META.get('QUERY_STRING', '').split('&')))
+    raw = f'{request.build_absolute_uri(request.path)}?{query}|{renderer_format}|{versions}'
+    return f'"{hashlib.sha1(raw.encode()).hexdigest()}"'
+
+
+def _response_key(etag):
+    return f'apiApp:response:{etag.strip(chr(34))}'
+
+
+def get_response(etag):
+    return cache.get(_response_key(etag))
+
+
+async def aget_response(etag):
+    return await cache.aget(_response_key(etag))
+
+
+def _entry(response):
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'last_modified': int(time.time()),
+    }
+
+
+def store_response(etag, response):
+    entry = _entry(response)
+    cache.set(_response_key(etag), entry, RESPONSE_TIMEOUT)
+    return entry
+
+
+async def astore_response(etag, response):
+    entry = _entry(response)
+    await cache.aset(_response_key(etag), entry, RESPONSE_TIMEOUT)
+    return entry
@@ -0,0 +1,166 @@
+import csv
+import json
+from itertools import groupby, islice
+
+from .ingest import PRODUCT_FIELDS, ingest_products
+from .models import Product, ProductVariant, ProductImage
+
+# ===========================
+# Streaming catalog export / import
+# ===========================
+#
+# The catalog is streamed one product record at a time (product fields,
+# brand/category/subcategory slugs, variants with their image paths), the
+# same shape the bulk ingestion API accepts. Exports walk products with
+# .iterator(chunk_size=...) and fetch variants and images once per chunk;
+# imports read the stream lazily and upsert it batch by batch through
+# apiApp.ingest, so memory stays bounded by the chunk size either way.
+#
+# NDJSON carries one product per line. CSV carries one row per variant
+# (product columns repeated, images joined by "|"), and a product's rows
+# are consecutive.
+
+CHUNK_SIZE = 2000
+FORMATS = ('ndjson', 'csv')
+
+REFERENCE_FIELDS = ('brand', 'category', 'subcategory')
+VARIANT_FIELDS = ('color', 'size', 'additional_price', 'stock')
+CSV_COLUMNS = (
+    'sku', 'slug', *PRODUCT_FIELDS, *REFERENCE_FIELDS,
+    *[f'variant_{field}' for field in VARIANT_FIELDS], 'variant_images',
+)
+IMAGE_SEPARATOR = '|'
+
+
+def _plain(value):
+    return value if value is None or isinstance(value, (str, int, bool)) else str(value)
+
+
+def _with_variants(chunk):
+    variants = {}
+    rows = ProductVariant.objects.filter(product_id__in=[row['pk'] for row in chunk]).order_by('pk')
+    for variant in rows.values('pk', 'product_id', *VARIANT_FIELDS):
+        variants.setdefault(variant['product_id'], []).append(variant)
+    images = {}
+    for variant_id, image in (
+        ProductImage.objects.filter(product_variant__product_id__in=[row['pk'] for row in chunk])
+        .order_by('pk').values_list('product_variant_id', 'image')
+    ):
+        images.setdefault(variant_id, []).append(image)
+
+    for row in chunk:
+        record = {'sku': row['sku'], 'slug': row['slug']}
+        record.update((field, _plain(row[field])) for field in PRODUCT_FIELDS)
+        record.update((field, row[f'{field}__slug']) for field in REFERENCE_FIELDS)
+        record['variants'] = [
+            {**{field: _plain(variant[field]) for field in VARIANT_FIELDS}, 'images': images.get(variant['pk'], [])}
+            for variant in variants.get(row['pk'], [])
+        ]
+        yield record
+
+
+def export_records(chunk_size=CHUNK_SIZE):
+    """Yield every product as an ingestion record, in primary-key order."""
+    products = Product.objects.order_by('pk').values(
+        'pk', 'sku', 'slug', *PRODUCT_FIELDS, *[f'{field}__slug' for field in REFERENCE_FIELDS],
+    )
+    rows = products.iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield from _with_variants(chunk)
+
+
+def count_rows(record):
+    """Database rows a record stands for (product, variants, images)."""
+    return 1 + sum(1 + len(variant['images']) for variant in record.get('variants', ()))
+
+
+# ---- NDJSON ----
+
+def write_ndjson(records, stream):
+    for record in records:
+        stream.write(json.dumps(record, separators=(',', ':')))
+        stream.write('\n')
+        yield record
+
+
+def read_ndjson(stream):
+    for number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield {'__error__': f'line {number}: {exc}'}
+
+
+# ---- CSV ----
+
+def write_csv(records, stream):
+    writer = csv.writer(stream)
+    writer.writerow(CSV_COLUMNS)
+    for record in records:
+        product = [record[column] for column in CSV_COLUMNS[:-len(VARIANT_FIELDS) - 1]]
+        for variant in record['variants'] or [None]:
+            if variant is None:
+                writer.writerow(product + [''] * (len(VARIANT_FIELDS) + 1))
+            else:
+                writer.writerow(product + [variant[field] for field in VARIANT_FIELDS]
+                                + [IMAGE_SEPARATOR.join(variant['images'])])
+        yield record
+
+
+def read_csv(stream):
+    # A product's rows are consecutive and share its identifying columns.
+    rows = csv.DictReader(stream)
+    for _, group in groupby(rows, key=lambda row: (row['sku'], row['slug'], row['title'])):
+        group = list(group)
+        record = {column: value for column, value in group[0].items() if not column.startswith('variant_')}
+        for field in ('description', 'color', 'size', 'meta_title', 'meta_keywords', 'meta_description'):
+            record[field] = record.get(field) or None
+        for field in ('sku', 'slug'):
+            if not record[field]:
+                del record[field]
+        record['variants'] = [
+            {
+                **{field: row[f'variant_{field}'] for field in VARIANT_FIELDS},
+                'images': [image for image in row['variant_images'].split(IMAGE_SEPARATOR) if image],
+            }
+            for row in group if row['variant_color'] or row['variant_size']
+        ]
+        yield record
+
+
+READERS = {'ndjson': read_ndjson, 'csv': read_csv}
+WRITERS = {'ndjson': write_ndjson, 'csv': write_csv}
+
+
+def guess_format(path, given=None):
+    if given:
+        return given
+    return 'csv' if str(path).lower().endswith('.csv') else 'ndjson'
+
+
+def import_records(records, batch_size=CHUNK_SIZE, skip=0):
+    """
+    Upsert `records` a batch at a time, skipping the first `skip` (already
+    imported) records. Yields `(records_done, result)` after each batch has
+    been committed, so callers can checkpoint; `result['rows']` counts the
+    database rows the batch carried.
+    """
+    done = skip
+    records = islice(records, skip, None)
+    while batch := list(islice(records, batch_size)):
+        unreadable = [(index, record) for index, record in enumerate(batch) if '__error__' in record]
+        result = ingest_products([record for record in batch if '__error__' not in record], batch_size)
+        # Report row indexes as positions in the whole stream.
+        kept = [index for index, record in enumerate(batch) if '__error__' not in record]
+        for error in result['errors']:
+            error['index'] = done + kept[error['index']]
+        for row in result['results']:
+            row['index'] = done + kept[row['index']]
+        result['errors'].extend(
+            {'index': done + index, 'errors': {'non_field_errors': [record['__error__']]}}
+            for index, record in unreadable
+        )
+        result['rows'] = sum(count_rows(record) for record in batch if '__error__' not in record)
+        done += len(batch)
+        yield done, result
@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models import F
+
+from .caching import invalidate
+from .inventory import InsufficientStock, add_total_stock, per_row
+from .ledger import InsufficientFunds, post_transaction
+from .models import CartProduct, Order, OrderProduct, ProductVariant, Wallet
+from .pricing import apply_discount, refresh_expired_prices
+
+# ===========================
+# Cart checkout
+# ===========================
+#
+# A cart becomes an order in one transaction with a fixed number of
+# statements however many lines it has: one read of the lines with their
+# variants and prices, one conditional CASE UPDATE taking all variant
+# stock, one for the products' total_stock, a wallet lookup and ledger
+# debit (apiApp.ledger), two inserts (order, lines) and one delete of the
+# cart lines. Any shortfall rolls the whole checkout back.
+
+ORDER_STATUS = 'Placed'
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def line_price(line):
+    """Current unit price of a cart line (its variant's, when one is chosen)."""
+    pricing = getattr(line.product, 'pricing', None)
+    discount = pricing.discount_percentage if pricing else 0
+    additional = line.variant.additional_price if line.variant_id else 0
+    return apply_discount(line.product.price + additional, discount)
+
+
+def _take_stock(quantities):
+    needed = per_row(quantities)
+    taken = (
+        ProductVariant.objects
+        .filter(pk__in=quantities, stock__gte=needed)
+        .update(stock=F('stock') - needed)
+    )
+    if taken != len(quantities):
+        # Roll back and report the first variant that fell short.
+        short = (
+            ProductVariant.objects.filter(pk__in=quantities)
+            .exclude(stock__gte=needed).values_list('pk', flat=True).first()
+        )
+        raise InsufficientStock(short, quantities.get(short))
+
+
+def checkout(cart):
+    """Turn `cart` into an Order, paid from the owner's wallet. Returns the Order."""
+    refresh_expired_prices()
+    with transaction.atomic():
+        lines = list(
+            CartProduct.objects.filter(cart=cart)
+            .select_related('product__pricing', 'variant').order_by('pk')
+        )
+        if not lines:
+            raise CheckoutError("Cart is empty")
+        missing = [line.pk for line in lines if line.variant_id is None or line.variant.product_id != line.product_id]
+        if missing:
+            raise CheckoutError(f"Cart lines {missing} need a variant of their product")
+
+        quantities, product_deltas, total = {}, {}, 0
+        prices = [line_price(line) for line in lines]
+        for line, price in zip(lines, prices):
+            quantities[line.variant_id] = quantities.get(line.variant_id, 0) + line.quantity
+            product_deltas[line.product_id] = product_deltas.get(line.product_id, 0) - line.quantity
+            total += price * line.quantity
+
+        _take_stock(quantities)
+        add_total_stock(product_deltas)
+
+        if total < 0:
+            raise CheckoutError("Order total is negative")
+        if total:  # free orders have nothing to debit
+            wallet_id = Wallet.objects.filter(user_id=cart.user_id).values_list('pk', flat=True).first()
+            if wallet_id is None:
+                raise InsufficientFunds(total)
+            post_transaction(wallet_id, total, 'Purchase')
+
+        order = Order.objects.create(user_id=cart.user_id, status=ORDER_STATUS, total=total)
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=order, product_id=line.product_id, variant_id=line.variant_id,
+                         quantity=line.quantity, unit_price=price)
+            for line, price in zip(lines, prices)
+        ])
+        # Nothing references cart lines, so skip the collector's per-row
+        # fetch, batches of 100 and signals: one DELETE.
+        line_ids = [line.pk for line in lines]
+        CartProduct.objects.filter(pk__in=line_ids)._raw_delete(CartProduct.objects.db)
+
+        # Bulk writes skip model signals; bump what they would have.
+        invalidate('productvariant', *quantities)
+        invalidate('product', *product_deltas)
+        invalidate('orderproduct')
+        invalidate('cartproduct', *line_ids)
+        invalidate('cart', cart.pk)
+    return order
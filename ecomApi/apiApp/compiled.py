@@ -0,0 +1,172 @@
+import re
+from decimal import Decimal
+
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.settings import api_settings
+
+# ===========================
+# Compiled read-only serializers
+# ===========================
+#
+# DRF renders each row by walking `_readable_fields`, resolving every
+# field's source through the generic `get_attribute` machinery and
+# dispatching `to_representation`. For read-only list responses the field
+# tree is fixed per request, so it is resolved once into a flat list of
+# per-field callables: plain column reads become a getattr plus a builtin
+# conversion, PK-only relations read `<field>_id` directly, and nested
+# serializers are compiled recursively. Everything else goes through the
+# field's own DRF code, so output is identical to `serializer.data`.
+
+# Fields whose to_representation is exactly a builtin conversion.
+_CONVERTERS = {
+    serializers.IntegerField: int,
+    serializers.CharField: str,
+    serializers.SlugField: str,
+    serializers.EmailField: str,
+    serializers.URLField: str,
+    serializers.BooleanField: bool,
+}
+
+
+def _plain_getter(attr, convert):
+    def render(instance):
+        value = getattr(instance, attr)
+        return None if value is None else convert(value)
+    return render
+
+
+def _decimal(field):
+    # Database decimals already carry the field's scale, so the
+    # quantize-then-format DRF performs reduces to formatting.
+    exponent = -field.decimal_places
+    fallback = _generic(field)
+
+    def render(instance):
+        value = getattr(instance, field.source_attrs[0])
+        if type(value) is Decimal and value.as_tuple().exponent == exponent:
+            return f'{value:f}'
+        return fallback(instance)
+    return render
+
+
+_SAFE_FILE_NAME = re.compile(r'[A-Za-z0-9_][A-Za-z0-9_.\-/]*')
+
+
+def _file(field, model_field):
+    # FileSystemStorage URLs of plain names are `MEDIA_URL + name`, so the
+    # absolute prefix is built once instead of url-joining every row. Any
+    # other storage or name goes through DRF.
+    fallback = _generic(field)
+    storage = model_field.storage
+    base_url = getattr(storage, 'base_url', None)
+    if (
+        getattr(storage.url, '__func__', None) is not FileSystemStorage.url
+        or not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        or not base_url or not base_url.startswith('/') or not base_url.endswith('/')
+        or '//' in base_url or not _SAFE_FILE_NAME.fullmatch(base_url.strip('/') or 'x')
+    ):
+        return fallback
+    request = field.context.get('request')
+    prefix = request.build_absolute_uri(base_url) if request is not None else base_url
+    attname = model_field.attname
+
+    def render(instance):
+        name = instance.__dict__.get(attname)
+        if not isinstance(name, str):
+            name = getattr(instance, attname).name
+        if not name:
+            return None
+        if _SAFE_FILE_NAME.fullmatch(name) and '..' not in name and '/./' not in name and '//' not in name:
+            return prefix + name
+        return fallback(instance)
+    return render
+
+
+def _generic(field):
+    def render(instance):
+        attribute = field.get_attribute(instance)
+        check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        return None if check_for_none is None else field.to_representation(attribute)
+    return render
+
+
+def _model_field(field):
+    model = getattr(getattr(field.parent, 'Meta', None), 'model', None)
+    if model is None or len(field.source_attrs) != 1:
+        return None
+    try:
+        return model._meta.get_field(field.source_attrs[0])
+    except Exception:
+        return None
+
+
+def _compile_field(field):
+    if isinstance(field, serializers.BaseSerializer):
+        nested = compile_serializer(field)
+
+        def render(instance):
+            attribute = field.get_attribute(instance)
+            return None if attribute is None else nested(attribute)
+        return render
+
+    if isinstance(field, serializers.SerializerMethodField):
+        return getattr(field.parent, field.method_name)
+
+    model_field = _model_field(field)
+    if (
+        isinstance(field, serializers.PrimaryKeyRelatedField)
+        and field.use_pk_only_optimization()
+        and model_field is not None
+        and model_field.many_to_one
+    ):
+        attname = model_field.attname
+        return lambda instance: getattr(instance, attname)
+
+    if model_field is not None and model_field.concrete:
+        convert = _CONVERTERS.get(type(field))
+        if convert is not None:
+            return _plain_getter(field.source_attrs[0], convert)
+        if isinstance(field, serializers.FileField) and isinstance(model_field, models.FileField):
+            return _file(field, model_field)
+        if (
+            type(field) is serializers.DecimalField
+            and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+            and not field.localize and not field.normalize_output and field.decimal_places is not None
+        ):
+            return _decimal(field)
+
+    return _generic(field)
+
+
+def compile_serializer(serializer):
+    """
+    Return a function rendering instances the way `serializer` would
+    (a list for `many=True` serializers, a dict otherwise).
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        child = compile_serializer(serializer.child)
+
+        def render_many(data):
+            iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+            return [child(item) for item in iterable]
+        return render_many
+
+    # Custom representations are honoured as-is.
+    if type(serializer).to_representation is not serializers.Serializer.to_representation:
+        return serializer.to_representation
+
+    steps = [(field.field_name, _compile_field(field)) for field in serializer._readable_fields]
+
+    def render(instance):
+        ret = {}
+        for name, step in steps:
+            try:
+                ret[name] = step(instance)
+            except SkipField:
+                continue
+        return ret
+    return render
@@ -0,0 +1,273 @@
+import copy
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from decimal import Decimal
+from operator import itemgetter
+
+from .caching import bump_version, get_version, version_changes
+from .models import Product, ProductVariant
+
+# ===========================
+# Bitmap facet index
+# ===========================
+#
+# Every active product gets a bit position, oldest first, and every facet
+# value keeps a bitmap (a Python int) of the positions of the products
+# carrying it. A combined filter is a handful of ANDs/ORs over those bitmaps
+# and each facet count is a popcount, so browsing never issues per-request
+# GROUP BYs. The index is built from two queries and held per process.
+#
+# Product writes bump the `facets` version with the ids they touched (see
+# touch()), and a worker behind by a few bumps re-reads only those products
+# and patches their bits. Anything else (a brand renamed, a change record
+# expired, a product that can't take the next position) rebuilds it.
+
+VERSION = 'facets'
+FACETS = ('brand', 'category', 'subcategory', 'color', 'size')
+TITLED_FACETS = ('brand', 'category', 'subcategory')
+
+# Upper bounds of the price buckets counted for the price facet.
+PRICE_BUCKETS = (Decimal(500), Decimal(1000), Decimal(2500), Decimal(5000), Decimal(10000))
+
+# Patching more products than this costs about as much as a rebuild.
+MAX_PATCHED = 1000
+
+_price = itemgetter(0)
+
+
+def _mask(positions, size):
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _entries(products, variants):
+    # {product id: ({facet: values}, price)} plus the titles of the titled facets.
+    entries, titles = {}, {facet: {} for facet in TITLED_FACETS}
+    for row in products:
+        values = {facet: set() for facet in FACETS}
+        for facet in TITLED_FACETS:
+            values[facet].add(row[f'{facet}_id'])
+            titles[facet][row[f'{facet}_id']] = row[f'{facet}__title']
+        for facet in ('color', 'size'):
+            if row[facet]:
+                values[facet].add(row[facet])
+        entries[row['id']] = (values, row['price'])
+    for product_id, color, size in variants:
+        entry = entries.get(product_id)
+        if entry is not None:
+            entry[0]['color'].add(color)
+            entry[0]['size'].add(size)
+    return entries, titles
+
+
+class FacetIndex:
+    def __init__(self, entries, titles):
+        self.ids = sorted(entries)
+        self.size = len(self.ids)
+        self.position = {pk: i for i, pk in enumerate(self.ids)}
+        # Per position; None once the product has dropped out.
+        self.entries = [entries[pk] for pk in self.ids]
+        self.titles = titles
+        self.all = (1 << self.size) - 1
+
+        positions = {facet: defaultdict(list) for facet in FACETS}
+        for i, (values, _) in enumerate(self.entries):
+            for facet, members in values.items():
+                for value in members:
+                    positions[facet][value].append(i)
+        self.bitmaps = {
+            facet: {value: _mask(members, self.size) for value, members in values.items()}
+            for facet, values in positions.items()
+        }
+
+        self._by_price = sorted((price, i) for i, (_, price) in enumerate(self.entries))
+        self.price_buckets = []
+        lower = Decimal(0)
+        for upper in PRICE_BUCKETS + (None,):
+            self.price_buckets.append(((lower, upper), self._price_mask(lower, upper, inclusive=False)))
+            lower = upper
+
+    def patched(self, product_ids, entries, titles):
+        """
+        A copy with `product_ids` re-indexed from `entries` (ids missing from
+        it have been deleted or deactivated), or None when a product new to
+        the index is older than its newest product.
+        """
+        index = copy.copy(self)
+        index.ids = list(self.ids)
+        index.position = dict(self.position)
+        index.entries = list(self.entries)
+        index.titles = {facet: {**self.titles[facet], **titles[facet]} for facet in TITLED_FACETS}
+        index.bitmaps = {facet: dict(values) for facet, values in self.bitmaps.items()}
+        index._by_price = list(self._by_price)
+        index.price_buckets = list(self.price_buckets)
+        for pk in sorted(set(product_ids)):
+            i = index.position.get(pk)
+            if i is None:
+                if pk not in entries:
+                    continue
+                if index.ids and pk < index.ids[-1]:
+                    return None
+                i = index._append(pk)
+            index._clear(i)
+            if pk in entries:
+                index._set(i, entries[pk])
+        return index
+
+    def _append(self, pk):
+        i = self.size
+        self.ids.append(pk)
+        self.position[pk] = i
+        self.entries.append(None)
+        self.size += 1
+        return i
+
+    def _clear(self, i):
+        if self.entries[i] is None:
+            return
+        values, price = self.entries[i]
+        bit = 1 << i
+        for facet, members in values.items():
+            for value in members:
+                self.bitmaps[facet][value] &= ~bit
+        del self._by_price[bisect_left(self._by_price, (price, i))]
+        self.price_buckets = [(bounds, bitmap & ~bit) for bounds, bitmap in self.price_buckets]
+        self.all &= ~bit
+        self.entries[i] = None
+
+    def _set(self, i, entry):
+        values, price = entry
+        bit = 1 << i
+        for facet, members in values.items():
+            bitmaps = self.bitmaps[facet]
+            for value in members:
+                bitmaps[value] = bitmaps.get(value, 0) | bit
+        insort(self._by_price, (price, i))
+        self.price_buckets = [
+            ((low, high), bitmap | bit if low <= price and (high is None or price < high) else bitmap)
+            for (low, high), bitmap in self.price_buckets
+        ]
+        self.all |= bit
+        self.entries[i] = entry
+
+    def _price_mask(self, low=None, high=None, inclusive=True):
+        start = 0 if low is None else bisect_left(self._by_price, low, key=_price)
+        if high is None:
+            end = len(self._by_price)
+        else:
+            end = (bisect_right if inclusive else bisect_left)(self._by_price, high, key=_price)
+        return _mask((i for _, i in self._by_price[start:end]), self.size)
+
+    def _facet_mask(self, facet, values):
+        bitmaps = self.bitmaps[facet]
+        mask = 0
+        for value in values:
+            mask |= bitmaps.get(value, 0)
+        return mask
+
+    def filter_masks(self, filters, price_min=None, price_max=None):
+        masks = {facet: self._facet_mask(facet, values) for facet, values in filters.items() if values}
+        if price_min is not None or price_max is not None:
+            masks['price'] = self._price_mask(price_min, price_max)
+        return masks
+
+    def match(self, masks, exclude=None):
+        result = self.all
+        for facet, mask in masks.items():
+            if facet != exclude:
+                result &= mask
+        return result
+
+    def counts(self, masks):
+        # Disjunctive counts: a facet's own selection does not narrow its
+        # counts, so clients can still offer the sibling values.
+        counts = {}
+        for facet in FACETS:
+            base = self.match(masks, exclude=facet)
+            buckets = []
+            for value, bitmap in self.bitmaps[facet].items():
+                count = (bitmap & base).bit_count()
+                if count:
+                    bucket = {'id': value, 'title': self.titles[facet][value]} if facet in self.titles else {'value': value}
+                    bucket['count'] = count
+                    buckets.append(bucket)
+            buckets.sort(key=lambda bucket: (-bucket['count'], str(bucket.get('title', bucket.get('value')))))
+            counts[facet] = buckets
+
+        base = self.match(masks, exclude='price')
+        counts['price'] = [
+            {'min': str(low), 'max': None if high is None else str(high), 'count': (bitmap & base).bit_count()}
+            for (low, high), bitmap in self.price_buckets
+        ]
+        return counts
+
+    def ids_after(self, mask, after=None, limit=None):
+        """Ids (newest first) of products in `mask`, strictly older than `after`."""
+        end = self.size if after is None else bisect_left(self.ids, after)
+        mask &= (1 << end) - 1
+        data = mask.to_bytes((self.size + 7) // 8, 'little')
+        ids = []
+        for byte_index in range((end - 1) >> 3, -1, -1):
+            byte = data[byte_index]
+            while byte:
+                high = byte.bit_length() - 1
+                byte ^= 1 << high
+                ids.append(self.ids[(byte_index << 3) + high])
+                if limit is not None and len(ids) == limit:
+                    return ids
+        return ids
+
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+
+
+def load(product_ids=None):
+    """Entries and titles of the active products (of `product_ids` only, when given)."""
+    products = Product.objects.filter(active=True)
+    variants = ProductVariant.objects.filter(product__active=True)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        variants = variants.filter(product_id__in=product_ids)
+    rows = []
+    for row in products.values(
+        'id', 'brand_id', 'brand__title', 'category_id', 'category__title',
+        'subcategory_id', 'subcategory__title', 'color', 'size', 'price', 'pricing__effective_price',
+    ):
+        # Filter on what the customer pays when a promotion is running.
+        if row['pricing__effective_price'] is not None:
+            row['price'] = row['pricing__effective_price']
+        rows.append(row)
+    return _entries(rows, variants.values_list('product_id', 'color', 'size'))
+
+
+def build_index():
+    return FacetIndex(*load())
+
+
+def touch(product_ids):
+    """Bump the facets version for writes to `product_ids` (or their variants/prices)."""
+    bump_version(VERSION, sorted(set(product_ids)))
+
+
+def _refreshed(index, built, version):
+    changed = None if index is None else version_changes(VERSION, built, version)
+    if changed is not None and len(set(changed)) <= MAX_PATCHED:
+        patched = index.patched(changed, *load(set(changed)))
+        if patched is not None:
+            return patched
+    return build_index()
+
+
+def get_index():
+    global _index, _index_version
+    version = get_version(VERSION)
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index, _index_version = _refreshed(_index, _index_version, version), version
+    return _index
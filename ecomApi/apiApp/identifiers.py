@@ -0,0 +1,88 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.text import slugify
+
+from .inventory import per_row
+from .models import Product, Sequence
+
+# ===========================
+# Slug and SKU allocation
+# ===========================
+#
+# Generated identifiers come from named counters in the Sequence table.
+# A batch reserves its numbers in one transaction: missing counters are
+# inserted (ON CONFLICT DO NOTHING), every counter is advanced by its
+# batch count with a single CASE UPDATE, which row-locks them, and the
+# new values are read back. Two allocators can therefore never hand out
+# the same number. The only check against the target table is one
+# `IN (...)` query per batch. It skips values that were taken some other
+# way (explicit slugs and SKUs, rows from before the counters existed).
+#
+#   slugs:  one counter per model and base slug. The first product titled
+#           "Runner" gets `runner`, later ones `runner-2`, `runner-3`, ...
+#   SKUs:   one counter per brand: `<brand id>-000001`, `<brand id>-000002`, ...
+
+SLUG_LENGTH = 240  # leaves room for a numeric suffix within SlugField(255)
+
+
+def allocate_many(counts):
+    """Reserve `{name: count}` numbers; returns `{name: range}`."""
+    counts = {name: count for name, count in counts.items() if count}
+    if not counts:
+        return {}
+    with transaction.atomic():
+        Sequence.objects.bulk_create([Sequence(name=name) for name in counts], ignore_conflicts=True)
+        Sequence.objects.filter(name__in=counts).update(value=F('value') + per_row(counts))
+        ends = dict(Sequence.objects.filter(name__in=counts).values_list('name', 'value'))
+    return {name: range(ends[name] - count + 1, ends[name] + 1) for name, count in counts.items()}
+
+
+def allocate(name, count=1):
+    return allocate_many({name: count})[name]
+
+
+def _allocate(queryset, field, wanted, exclude=()):
+    # `wanted` holds one (counter name, format) pair per value; formats
+    # turn a reserved number into the value.
+    values = [None] * len(wanted)
+    exclude = set(exclude)
+    pending = list(range(len(wanted)))
+    while pending:
+        blocks = {name: iter(numbers) for name, numbers in
+                  allocate_many(Counter(wanted[index][0] for index in pending)).items()}
+        candidates = {index: wanted[index][1](next(blocks[wanted[index][0]])) for index in pending}
+        taken = exclude | set(
+            queryset.filter(**{f'{field}__in': candidates.values()}).values_list(field, flat=True)
+        )
+        for index, value in candidates.items():
+            if value not in taken:
+                values[index] = value
+        pending = [index for index, value in candidates.items() if value in taken]
+    return values
+
+
+def _slug_format(base):
+    return lambda number: base if number == 1 else f'{base}-{number}'
+
+
+def unique_slugs(model, titles, exclude=()):
+    """Free slugs for `titles` (in order) on `model.slug`, none equal to `exclude`."""
+    label = model._meta.label_lower
+    wanted = []
+    for title in titles:
+        base = slugify(title)[:SLUG_LENGTH].strip('-_') or model._meta.model_name
+        wanted.append((f'slug:{label}:{base}', _slug_format(base)))
+    return _allocate(model._default_manager, 'slug', wanted, exclude)
+
+
+def _sku_format(brand_id):
+    return lambda number: f'{brand_id}-{number:06d}'
+
+
+def unique_skus(brand_ids, exclude=()):
+    """Free Product SKUs for `brand_ids` (one per entry, in order)."""
+    return _allocate(
+        Product.objects, 'sku', [(f'sku:{brand_id}', _sku_format(brand_id)) for brand_id in brand_ids], exclude,
+    )
@@ -0,0 +1,198 @@
+import io
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .caching import invalidate
+from .models import ImageRenditionsMixin, ProductImage, ProductVariant
+from .storage import add_references, digest_of
+
+# ===========================
+# Image derivatives
+# ===========================
+#
+# Every upload into an IMAGE_FIELDS field is resized to the fixed WIDTHS
+# below its own width (never upscaled) and encoded as WebP and JPEG next to the original under
+# `derivatives/`. The result is recorded in the row's `renditions` column:
+#
+#     {"thumb": {"source": "product_thumbnails/a.png", "width": 2000, "height": 1500,
+#                "derivatives": [{"name": ..., "format": "webp", "width": 160, "height": 120, "bytes": 4211}, ...]}}
+#
+# Serializers turn it into srcsets (SrcsetField), so clients download a
+# derivative sized for the slot instead of the original.
+#
+# Work is scheduled after the upload's transaction commits and runs on a
+# per-process thread pool of IMAGE_DERIVATIVE_WORKERS threads. Pillow
+# releases the GIL while resampling and encoding. With 0 workers it runs
+# inline. With TASKS_EAGER off, uploads are queued for `manage.py
+# run_workers` instead (apiApp.tasks). A worker only records its result if
+# the row still holds the sources it rendered, so a newer upload is never
+# overwritten by an older one.
+
+WIDTHS = (160, 320, 640, 1280)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DIRECTORY = 'derivatives'
+
+
+def image_models():
+    return [model for model in apps.get_app_config('apiApp').get_models() if issubclass(model, ImageRenditionsMixin)]
+
+
+def needs_rendering(instance):
+    """True when an image field's upload differs from what `renditions` was built from."""
+    for field in instance.IMAGE_FIELDS:
+        name = getattr(instance, field).name or None
+        entry = instance.renditions.get(field)
+        if name != (entry and entry.get('source')):
+            return True
+    return False
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: composite transparent images onto white.
+    if image.mode in ('RGB', 'L'):
+        return image
+    rgba = image.convert('RGBA')
+    background = Image.new('RGB', rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+
+def render(field_file):
+    """Write the derivatives of one upload; returns its `renditions` entry."""
+    storage = field_file.storage
+    with storage.open(field_file.name, 'rb') as fh:
+        image = ImageOps.exif_transpose(Image.open(fh))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    width, height = image.size
+    stem = field_file.name.rsplit('.', 1)[0]
+
+    # Originals within the largest width are also re-encoded at full size.
+    targets = [w for w in WIDTHS if w < width] + ([width] if width <= WIDTHS[-1] else [])
+    derivatives = []
+    for target in targets:
+        size = (target, max(1, round(height * target / width)))
+        resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+        for fmt, (pil_format, extension, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            (_flatten(resized) if pil_format == 'JPEG' else resized).save(buffer, pil_format, **options)
+            name = f'{DIRECTORY}/{stem}-{target}w.{extension}'
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(buffer.getvalue()))
+            derivatives.append({'name': name, 'format': fmt, 'width': size[0], 'height': size[1], 'bytes': buffer.tell()})
+    return {'source': field_file.name, 'width': width, 'height': height, 'derivatives': derivatives}
+
+
+def derivative_names(renditions):
+    return Counter(item['name'] for entry in renditions.values() for item in entry.get('derivatives', ()))
+
+
+def _rendered_elsewhere(model, pk, field, name):
+    # Identical uploads share one reference-counted blob (apiApp.storage),
+    # so rows naming it share its derivatives too.
+    for renditions in model.objects.filter(**{field: name}).exclude(pk=pk).values_list('renditions', flat=True)[:5]:
+        entry = renditions.get(field)
+        if entry and entry.get('source') == name and 'derivatives' in entry:
+            return entry
+    return None
+
+
+def _unchanged(model, instance):
+    condition = Q(pk=instance.pk)
+    for field in model.IMAGE_FIELDS:
+        name = getattr(instance, field).name
+        condition &= Q(**{field: name}) if name else Q(**{f'{field}__isnull': True}) | Q(**{field: ''})
+    return condition
+
+
+def process(model_label, pk):
+    """Bring the renditions of one row up to date with its uploads."""
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_rendering(instance):
+        return False
+    renditions = {}
+    for field in model.IMAGE_FIELDS:
+        field_file = getattr(instance, field)
+        if not field_file.name:
+            continue
+        entry = instance.renditions.get(field)
+        if (not entry or entry.get('source') != field_file.name) and digest_of(field_file.name):
+            entry = _rendered_elsewhere(model, pk, field, field_file.name)
+        if entry and entry.get('source') == field_file.name:
+            renditions[field] = entry
+            continue
+        try:
+            renditions[field] = render(field_file)
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            # Recorded so a broken upload isn't retried on every save.
+            renditions[field] = {'source': field_file.name, 'error': str(exc)}
+
+    with transaction.atomic():
+        if not model.objects.filter(_unchanged(model, instance)).update(renditions=renditions):
+            return False
+        # Derivatives are blob references too (apiApp.storage).
+        kept, dropped = derivative_names(renditions), derivative_names(instance.renditions)
+        add_references({name: kept[name] - dropped[name] for name in kept | dropped})
+    # Derivatives of replaced or removed uploads.
+    for field, entry in instance.renditions.items():
+        for item in entry.get('derivatives', ()):
+            if item['name'] not in kept:
+                model._meta.get_field(field).storage.delete(item['name'])
+
+    # update() bypasses the signals that bump cached payload versions.
+    invalidate(model._meta.model_name, pk)
+    if model is ProductImage:
+        invalidate('productvariant', instance.product_variant_id)
+        product_id = ProductVariant.objects.filter(pk=instance.product_variant_id).values_list('product_id', flat=True).first()
+        if product_id is not None:
+            invalidate('product', product_id)
+    return True
+
+
+# ---- worker pool ----
+
+_lock = threading.Lock()
+_executor = None
+_pending = set()
+
+
+def _run(model_label, pk):
+    try:
+        return process(model_label, pk)
+    finally:
+        connection.close()  # pool threads outlive requests
+
+
+def schedule(model_label, pk):
+    workers = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+    if not workers:
+        process(model_label, pk)
+        return None
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-derivatives')
+        future = _executor.submit(_run, model_label, pk)
+        _pending.add(future)
+    future.add_done_callback(_pending.discard)
+    return future
+
+
+def wait():
+    """Block until every scheduled job has finished (tests, management commands)."""
+    for future in list(_pending):
+        future.result()
@@ -0,0 +1,301 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+from . import facets, search, tasks
+from .caching import bump_version, invalidate
+from .identifiers import unique_skus, unique_slugs
+from .inventory import sync_total_stock
+from .models import Brand, Category, Subcategory, Product, ProductVariant, ProductImage
+from .pricing import refresh_prices
+from .storage import add_references
+
+# ===========================
+# Bulk catalog ingestion
+# ===========================
+#
+# Rows are validated in Python (no per-row queries), then written a batch at
+# a time: brand/category/subcategory references are resolved with one
+# lookup per model, slugs and SKUs are allocated for the whole batch
+# (apiApp.identifiers), and products, variants and images are each written
+# with a single bulk_create(update_conflicts=True) keyed on Product.sku and
+# (product, color, size). The work model signals would do per row
+# (total_stock, prices, search, cache versions) runs once per batch.
+# Invalid rows are reported by index and don't stop the others.
+
+BATCH_SIZE = 1000
+
+PRODUCT_FIELDS = (
+    'title', 'description', 'mrp', 'price', 'cost_price', 'color', 'size',
+    'meta_title', 'meta_keywords', 'meta_description', 'active',
+)
+
+
+class VariantRowSerializer(serializers.Serializer):
+    color = serializers.CharField(max_length=50)
+    size = serializers.CharField(max_length=50)
+    additional_price = serializers.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    stock = serializers.IntegerField(min_value=0, default=0)
+    images = serializers.ListField(child=serializers.CharField(max_length=100), default=list)
+
+
+class VariantUpsertSerializer(VariantRowSerializer):
+    product = serializers.CharField()  # id or SKU
+
+
+def _optional(max_length=None):
+    return serializers.CharField(max_length=max_length, required=False, allow_null=True, allow_blank=True, default=None)
+
+
+class ProductRowSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=255)
+    slug = serializers.SlugField(max_length=255, required=False)
+    sku = serializers.CharField(max_length=100, required=False)
+    description = _optional()
+    mrp = serializers.DecimalField(max_digits=10, decimal_places=2)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    cost_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    color = _optional(100)
+    size = _optional(100)
+    meta_title = _optional(255)
+    meta_keywords = _optional(255)
+    meta_description = _optional()
+    active = serializers.BooleanField(default=True)
+    # References are ids or slugs.
+    brand = serializers.CharField()
+    category = serializers.CharField()
+    subcategory = serializers.CharField()
+    variants = VariantRowSerializer(many=True, required=False)
+
+
+class IngestResult:
+    def __init__(self):
+        self.created, self.updated, self.results, self.errors = 0, 0, [], []
+
+    def error(self, index, errors):
+        self.errors.append({'index': index, 'errors': errors})
+
+    def as_dict(self):
+        self.errors.sort(key=lambda error: error['index'])
+        return {'created': self.created, 'updated': self.updated, 'results': self.results, 'errors': self.errors}
+
+
+def _validate(serializer_class, rows, offset, result):
+    # One serializer validates every row: building its fields is most of
+    # DRF's per-instance cost.
+    serializer = serializer_class()
+    valid = []
+    for index, row in enumerate(rows, start=offset):
+        try:
+            valid.append((index, serializer.run_validation(row)))
+        except serializers.ValidationError as exc:
+            result.error(index, exc.detail)
+    return valid
+
+
+def _lookup(queryset, refs, key, *fields):
+    # {reference: (pk, *fields)} for references given as ids or as `key`.
+    ids = {int(ref) for ref in refs if ref.isdigit()}
+    rows = list(queryset.filter(Q(pk__in=ids) | Q(**{f'{key}__in': refs})).values_list('pk', key, *fields))
+    found = {}
+    for pk, value, *extra in rows:
+        found.setdefault(value, (pk, *extra))
+    for pk, value, *extra in rows:
+        found[str(pk)] = (pk, *extra)
+    return found
+
+
+def _allocate_slugs(explicit, titles):
+    """
+    Map row index -> slug for `{index: slug}` given explicitly (None when
+    taken) and `{index: title}` to generate from (see apiApp.identifiers).
+    """
+    taken = set(Product.objects.filter(slug__in=set(explicit.values())).values_list('slug', flat=True))
+    allocated = {}
+    for index, slug in explicit.items():
+        allocated[index] = None if slug in taken else slug
+        taken.add(slug)
+    generated = unique_slugs(Product, titles.values(), exclude=explicit.values())
+    allocated.update(zip(titles, generated))
+    return allocated
+
+
+def _upsert_variants(items):
+    """Upsert `[(product_id, variant row)]` and their images. Returns the variant ids."""
+    unique = {(product_id, row['color'], row['size']): row for product_id, row in items}
+    if not unique:
+        return []
+    ProductVariant.objects.bulk_create(
+        [
+            ProductVariant(product_id=product_id, color=color, size=size,
+                           additional_price=row['additional_price'], stock=row['stock'])
+            for (product_id, color, size), row in unique.items()
+        ],
+        update_conflicts=True, unique_fields=['product', 'color', 'size'], update_fields=['additional_price', 'stock'],
+    )
+    ids = {
+        (product_id, color, size): pk
+        for pk, product_id, color, size in ProductVariant.objects
+        .filter(product_id__in={key[0] for key in unique}).values_list('pk', 'product_id', 'color', 'size')
+    }
+    images = {(ids[key], name) for key, row in unique.items() for name in row['images']}
+    if images:
+        existing = set(
+            ProductImage.objects.filter(product_variant_id__in={variant_id for variant_id, _ in images})
+            .values_list('product_variant_id', 'image')
+        )
+        new = sorted(images - existing)
+        created = ProductImage.objects.bulk_create([ProductImage(product_variant_id=variant_id, image=name) for variant_id, name in new])
+        # bulk_create skips the signals counting blob references and queueing derivatives
+        add_references(Counter(name for _, name in new))
+        tasks.schedule_renders(ProductImage._meta.label, [image.pk for image in created if image.image])
+    return [ids[key] for key in unique]
+
+
+def _written(product_ids, variant_ids):
+    # What post_save receivers would have done row by row.
+    product_ids = list(product_ids)
+    sync_total_stock(product_ids)
+    refresh_prices(product_ids)
+    search.index_products(product_ids)
+    facets.touch(product_ids)
+    bump_version('navigation')
+    invalidate('product', *product_ids)
+    invalidate('productvariant', *variant_ids)
+    invalidate('productimage')
+
+
+def _write_batch(result, valid, write):
+    try:
+        with transaction.atomic():
+            write()
+    except IntegrityError as exc:
+        for index, _ in valid:
+            result.error(index, {'non_field_errors': [f'Batch rejected by the database: {exc}']})
+
+
+def _ingest_product_batch(result, valid):
+    brands = _lookup(Brand.objects, {row['brand'] for _, row in valid}, 'slug')
+    categories = _lookup(Category.objects, {row['category'] for _, row in valid}, 'slug')
+    subcategories = _lookup(Subcategory.objects, {row['subcategory'] for _, row in valid}, 'slug', 'category_id')
+
+    accepted, skus = [], set()
+    for index, row in valid:
+        errors = {}
+        brand, category, subcategory = (
+            brands.get(row['brand']), categories.get(row['category']), subcategories.get(row['subcategory'])
+        )
+        for name, found in (('brand', brand), ('category', category), ('subcategory', subcategory)):
+            if found is None:
+                errors[name] = [f'Unknown {name} {row[name]!r}.']
+        if category and subcategory and subcategory[1] != category[0]:
+            errors['subcategory'] = ['Does not belong to the given category.']
+        sku = row.get('sku')
+        if sku is not None and sku in skus:
+            errors['sku'] = ['Duplicate SKU in this request.']
+        if errors:
+            result.error(index, errors)
+            continue
+        skus.add(sku)
+        accepted.append([index, row, sku, brand[0], category[0], subcategory[0]])
+
+    # Rows without a SKU get the next ones in their brand's sequence.
+    unnamed = [item for item in accepted if item[2] is None]
+    for item, sku in zip(unnamed, unique_skus([item[3] for item in unnamed], exclude=skus)):
+        item[2] = sku
+    skus = {sku for _, _, sku, *_ in accepted}
+
+    existing = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'slug'))
+    new = [(index, row) for index, row, sku, *_ in accepted if sku not in existing]
+    slugs = _allocate_slugs(
+        {index: row['slug'] for index, row in new if 'slug' in row},
+        {index: row['title'] for index, row in new if 'slug' not in row},
+    )
+    products, variants, rows = [], [], []
+    for index, row, sku, brand_id, category_id, subcategory_id in accepted:
+        slug = existing[sku] if sku in existing else slugs[index]
+        if slug is None:
+            result.error(index, {'slug': ['A product with this slug already exists.']})
+            continue
+        rows.append((index, row, sku, slug))
+        products.append(Product(
+            sku=sku, slug=slug, brand_id=brand_id, category_id=category_id, subcategory_id=subcategory_id,
+            **{field: row[field] for field in PRODUCT_FIELDS},
+        ))
+
+    def write():
+        Product.objects.bulk_create(
+            products, update_conflicts=True, unique_fields=['sku'],
+            update_fields=[*PRODUCT_FIELDS, 'brand', 'category', 'subcategory'],
+        )
+        ids = dict(Product.objects.filter(sku__in=[sku for _, _, sku, _ in rows]).values_list('sku', 'pk'))
+        variant_ids = _upsert_variants([(ids[sku], variant) for _, row, sku, _ in rows for variant in row.get('variants', ())])
+        _written(ids.values(), variant_ids)
+        for index, row, sku, slug in rows:
+            created = sku not in existing
+            result.created += created
+            result.updated += not created
+            result.results.append({'index': index, 'id': ids[sku], 'sku': sku, 'slug': slug, 'created': created})
+
+    if rows:
+        _write_batch(result, [(index, row) for index, row, *_ in rows], write)
+
+
+def _ingest_variant_batch(result, valid):
+    refs = {row['product'] for _, row in valid}
+    products = {}
+    ids = {int(ref) for ref in refs if ref.isdigit()}
+    for pk, sku in Product.objects.filter(Q(pk__in=ids) | Q(sku__in=refs)).values_list('pk', 'sku'):
+        products.setdefault(sku, pk)
+        products[str(pk)] = pk
+
+    accepted = []
+    for index, row in valid:
+        product_id = products.get(row['product'])
+        if product_id is None:
+            result.error(index, {'product': [f"Unknown product {row['product']!r}."]})
+        else:
+            accepted.append((index, product_id, row))
+    existing = set(
+        ProductVariant.objects.filter(product_id__in={product_id for _, product_id, _ in accepted})
+        .values_list('product_id', 'color', 'size')
+    )
+
+    def write():
+        variant_ids = _upsert_variants([(product_id, row) for _, product_id, row in accepted])
+        _written({product_id for _, product_id, _ in accepted}, variant_ids)
+        keys = dict(
+            ((product_id, color, size), pk) for pk, product_id, color, size in
+            ProductVariant.objects.filter(pk__in=variant_ids).values_list('pk', 'product_id', 'color', 'size')
+        )
+        for index, product_id, row in accepted:
+            key = (product_id, row['color'], row['size'])
+            created = key not in existing
+            result.created += created
+            result.updated += not created
+            result.results.append({'index': index, 'id': keys[key], 'product': product_id, 'created': created})
+
+    if accepted:
+        _write_batch(result, [(index, row) for index, _, row in accepted], write)
+
+
+def _ingest(rows, serializer_class, write_batch, batch_size):
+    result = IngestResult()
+    for start in range(0, len(rows), batch_size):
+        valid = _validate(serializer_class, rows[start:start + batch_size], start, result)
+        if valid:
+            write_batch(result, valid)
+    return result.as_dict()
+
+
+def ingest_products(rows, batch_size=BATCH_SIZE):
+    """Create or update (by SKU) products with nested variants and images."""
+    return _ingest(rows, ProductRowSerializer, _ingest_product_batch, batch_size)
+
+
+def ingest_variants(rows, batch_size=BATCH_SIZE):
+    """Create or update (by product, color, size) variants and their images."""
+    return _ingest(rows, VariantUpsertSerializer, _ingest_variant_batch, batch_size)
@@ -0,0 +1,189 @@
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.timezone import now
+
+from .caching import invalidate
+from .models import Product, ProductVariant, StockReservation
+
+# ===========================
+# Stock reservations
+# ===========================
+#
+# Stock is taken with a single conditional UPDATE
+#     UPDATE variant SET stock = stock - n WHERE id = :id AND stock >= n
+# so concurrent buyers never oversell and never wait on a row lock held
+# across a read. Every taken quantity is recorded as a time-limited
+# StockReservation; expired or abandoned holds are released in batches,
+# each batch claiming its rows with a single UPDATE tagged by a batch id
+# and restocking all touched variants with a single CASE UPDATE.
+
+DEFAULT_HOLD = timedelta(minutes=15)
+BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+    def __init__(self, variant_id, quantity):
+        super().__init__(f"Variant {variant_id} does not have {quantity} units in stock")
+        self.variant_id = variant_id
+        self.quantity = quantity
+
+
+def per_row(values):
+    """
+    A CASE expression evaluating to `values[pk]` on each row. Rows sharing a
+    value share one WHEN pk IN (...) branch, so large batches of mostly
+    equal quantities stay a short expression.
+    """
+    groups = {}
+    for pk, value in values.items():
+        groups.setdefault(value, []).append(pk)
+    return Case(*[When(pk__in=pks, then=Value(value)) for value, pks in groups.items()],
+                output_field=IntegerField())
+
+
+def add_total_stock(deltas):
+    """Apply `{product_id: delta}` to Product.total_stock in one UPDATE."""
+    deltas = {pk: delta for pk, delta in deltas.items() if pk is not None and delta}
+    if deltas:
+        Product.objects.filter(pk__in=deltas).update(total_stock=Greatest(F('total_stock') + per_row(deltas), 0))
+
+
+def _stock_changed(variant_deltas):
+    # Conditional UPDATEs bypass model signals, so the products' total_stock
+    # and the cached payload versions are maintained here. Callers do this
+    # inside their transaction: an error either undoes the whole operation
+    # or none of it, so callers can always retry.
+    products = dict(ProductVariant.objects.filter(pk__in=list(variant_deltas)).values_list('pk', 'product_id'))
+    product_deltas = {}
+    for variant_id, delta in variant_deltas.items():
+        product_id = products.get(variant_id)
+        product_deltas[product_id] = product_deltas.get(product_id, 0) + delta
+    add_total_stock(product_deltas)
+    invalidate('productvariant', *variant_deltas)
+    invalidate('product', *products.values())
+
+
+def adjust_stock(variant_id, delta):
+    """Atomically add `delta` (may be negative) to a variant's stock."""
+    queryset = ProductVariant.objects.filter(pk=variant_id)
+    if delta < 0:
+        queryset = queryset.filter(stock__gte=-delta)
+    with transaction.atomic():
+        if not queryset.update(stock=F('stock') + delta):
+            raise InsufficientStock(variant_id, -delta)
+        _stock_changed({variant_id: delta})
+
+
+def reserve(variant_id, quantity, hold=DEFAULT_HOLD, at=None):
+    """Take `quantity` units of a variant and return the StockReservation."""
+    if quantity <= 0:
+        raise ValueError("quantity must be positive")
+    at = at or now()
+    for attempt in range(2):
+        with transaction.atomic():
+            taken = (
+                ProductVariant.objects
+                .filter(pk=variant_id, stock__gte=quantity)
+                .update(stock=F('stock') - quantity)
+            )
+            if taken:
+                reservation = StockReservation.objects.create(
+                    variant_id=variant_id, quantity=quantity, expires_at=at + hold,
+                )
+                _stock_changed({variant_id: -quantity})
+                return reservation
+        # Out of stock: put this variant's expired holds back and retry once.
+        if attempt or not release_expired(at, variant_ids=[variant_id]):
+            raise InsufficientStock(variant_id, quantity)
+
+
+def _settle(queryset, status):
+    batch = uuid.uuid4().hex
+    with transaction.atomic():
+        claimed = (
+            StockReservation.objects
+            .filter(pk__in=list(queryset.values_list('pk', flat=True)), status=StockReservation.HELD)
+            .update(status=status, settle_batch=batch)
+        )
+        if not claimed:
+            return 0
+        settled = StockReservation.objects.filter(settle_batch=batch)
+        totals = dict(
+            settled.values('variant_id').annotate(total=Sum('quantity')).values_list('variant_id', 'total')
+        )
+        # The status UPDATE bypasses the signals that bump reservation versions.
+        invalidate('stockreservation', *settled.values_list('pk', flat=True))
+        if status == StockReservation.RELEASED:
+            ProductVariant.objects.filter(pk__in=totals).update(stock=F('stock') + per_row(totals))
+        else:
+            totals = dict.fromkeys(totals, 0)
+        _stock_changed(totals)
+    return claimed
+
+
+def release(reservation_ids):
+    """Return held stock of `reservation_ids` to their variants."""
+    return _settle(StockReservation.objects.filter(pk__in=reservation_ids), StockReservation.RELEASED)
+
+
+def consume(reservation_ids):
+    """Make holds final; their stock stays taken."""
+    return _settle(StockReservation.objects.filter(pk__in=reservation_ids), StockReservation.CONSUMED)
+
+
+def release_expired(at=None, variant_ids=None, batch_size=BATCH_SIZE):
+    """Release every hold that expired by `at`, `batch_size` rows at a time."""
+    at = at or now()
+    queryset = StockReservation.objects.filter(status=StockReservation.HELD, expires_at__lte=at)
+    if variant_ids is not None:
+        queryset = queryset.filter(variant_id__in=variant_ids)
+    released = 0
+    while True:
+        count = _settle(queryset.order_by('expires_at')[:batch_size], StockReservation.RELEASED)
+        released += count
+        if count < batch_size:
+            return released
+
+
+# ===========================
+# Product.total_stock reconciliation
+# ===========================
+
+def _actual_total_stock():
+    return Coalesce(Subquery(
+        ProductVariant.objects.filter(product=OuterRef('pk'))
+        .values('product').annotate(total=Sum('stock')).values('total')
+    ), 0)
+
+
+def sync_total_stock(product_ids):
+    """Set total_stock of `product_ids` from their variants in one UPDATE (for bulk writes)."""
+    return Product.objects.filter(pk__in=list(product_ids)).update(total_stock=_actual_total_stock())
+
+
+def reconcile_total_stock(chunk_size=BATCH_SIZE, after=0):
+    """
+    Recompute Product.total_stock from variant stock, one primary-key range
+    of `chunk_size` products per transaction. Returns the number of
+    products that had drifted.
+    """
+    actual = _actual_total_stock()
+    fixed = 0
+    while True:
+        bounds = list(Product.objects.filter(pk__gt=after).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not bounds:
+            return fixed
+        with transaction.atomic():
+            drifted = list(
+                Product.objects.filter(pk__gt=after, pk__lte=bounds[-1])
+                .alias(actual=actual).exclude(total_stock=F('actual')).values_list('pk', flat=True)
+            )
+            if drifted:
+                Product.objects.filter(pk__in=drifted).update(total_stock=actual)
+                invalidate('product', *drifted)
+        fixed += len(drifted)
+        after = bounds[-1]
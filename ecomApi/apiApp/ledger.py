@@ -0,0 +1,117 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+from django.utils.timezone import now
+
+from .models import Wallet, WalletTransaction, WalletSnapshot
+
+# ===========================
+# Wallet ledger
+# ===========================
+#
+# WalletTransaction rows are append-only. Posting one moves Wallet.balance
+# with an F() UPDATE in the same transaction (debits only when the balance
+# covers them), so concurrent postings never lose an update.
+#
+# WalletSnapshot rows checkpoint the sum of a wallet's history: the balance
+# at any time T is the last snapshot taken as of T or earlier plus the short
+# tail of transactions after it. Snapshots only cover transactions older
+# than SNAPSHOT_LAG, so rows still being committed can't be missed.
+
+SNAPSHOT_LAG = timedelta(minutes=5)
+ZERO = Decimal('0.00')
+
+SIGNED_AMOUNT = Case(
+    When(transaction_type__in=WalletTransaction.DEBIT_TYPES, then=-F('amount')),
+    default=F('amount'),
+)
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, amount):
+        super().__init__(f"Wallet balance does not cover {amount}")
+        self.amount = amount
+
+
+def is_debit(transaction_type):
+    return transaction_type in WalletTransaction.DEBIT_TYPES
+
+
+def post_transaction(wallet_id, amount, transaction_type):
+    """Append a transaction and apply it to the wallet's balance. Returns it."""
+    amount = Decimal(amount)
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    if transaction_type not in WalletTransaction.CREDIT_TYPES + WalletTransaction.DEBIT_TYPES:
+        raise ValueError(f"unknown transaction type {transaction_type!r}")
+    wallets = Wallet.objects.filter(pk=wallet_id)
+    with transaction.atomic():
+        if is_debit(transaction_type):
+            moved = wallets.filter(balance__gte=amount).update(balance=F('balance') - amount)
+        else:
+            moved = wallets.update(balance=F('balance') + amount)
+        if not moved:
+            raise InsufficientFunds(amount)
+        # The insert fires the wallet's invalidation signal.
+        return WalletTransaction.objects.create(wallet_id=wallet_id, amount=amount, transaction_type=transaction_type)
+
+
+def _history_sum(queryset):
+    return queryset.aggregate(total=Sum(SIGNED_AMOUNT))['total'] or ZERO
+
+
+def balance_at(wallet_id, at=None):
+    """Sum of the wallet's transactions created before `at`."""
+    at = at or now()
+    snapshot = (
+        WalletSnapshot.objects.filter(wallet_id=wallet_id, as_of__lte=at)
+        .order_by('-as_of').values_list('as_of', 'balance').first()
+    )
+    tail = WalletTransaction.objects.filter(wallet_id=wallet_id, created_at__lt=at)
+    if snapshot is None:
+        return _history_sum(tail)
+    as_of, balance = snapshot
+    return balance + _history_sum(tail.filter(created_at__gte=as_of))
+
+
+def take_snapshot(wallet_id, as_of=None):
+    """Checkpoint the wallet as of `as_of` (at most now - SNAPSHOT_LAG)."""
+    as_of = min(as_of or now(), now() - SNAPSHOT_LAG)
+    previous = (
+        WalletSnapshot.objects.filter(wallet_id=wallet_id, as_of__lte=as_of)
+        .order_by('-as_of').first()
+    )
+    if previous is not None and previous.as_of == as_of:
+        return previous
+    balance = balance_at(wallet_id, as_of)
+    return WalletSnapshot.objects.create(wallet_id=wallet_id, as_of=as_of, balance=balance)
+
+
+def snapshot_wallets(as_of=None, min_tail=1):
+    """
+    Snapshot every wallet with at least `min_tail` transactions since its
+    last snapshot. Returns the number of snapshots taken.
+    """
+    as_of = min(as_of or now(), now() - SNAPSHOT_LAG)
+    taken = 0
+    wallet_ids = Wallet.objects.order_by('pk').values_list('pk', flat=True)
+    for wallet_id in wallet_ids.iterator():
+        last = (
+            WalletSnapshot.objects.filter(wallet_id=wallet_id, as_of__lte=as_of)
+            .order_by('-as_of').values_list('as_of', flat=True).first()
+        )
+        tail = WalletTransaction.objects.filter(wallet_id=wallet_id, created_at__lt=as_of)
+        if last is not None:
+            tail = tail.filter(created_at__gte=last)
+        if tail[:min_tail].count() >= min_tail:
+            take_snapshot(wallet_id, as_of)
+            taken += 1
+    return taken
+
+
+def verify_balance(wallet_id):
+    """True when Wallet.balance equals the sum of the wallet's whole ledger."""
+    balance = Wallet.objects.values_list('balance', flat=True).get(pk=wallet_id)
+    return balance == balance_at(wallet_id, now() + timedelta(days=1))
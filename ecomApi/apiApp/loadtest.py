@@ -0,0 +1,208 @@
+import asyncio
+import io
+import itertools
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+# ===========================
+# Load testing (manage.py loadtest)
+# ===========================
+#
+# Sends `total` GET requests for a path, keeping `concurrency` in flight,
+# and reports requests/s and latency percentiles.
+#
+# In-process runs call Django's own handlers: full middleware and URL
+# routing, but no sockets or server. That puts the sync and async paths on
+# the same footing.
+#   wsgi:  WSGIHandler, one thread per concurrent request, like a threaded
+#          WSGI server.
+#   asgi:  ASGIHandler, one task per concurrent request on one event loop,
+#          like a single uvicorn worker.
+#   http:  keep-alive HTTP/1.1 connections to a running server, e.g.
+#          gunicorn ecomApi.wsgi against uvicorn ecomApi.asgi.
+
+INTERFACES = ('wsgi', 'asgi')
+
+
+class Result:
+    def __init__(self, label, path):
+        self.label, self.path = label, path
+        self.latencies, self.errors, self.seconds = [], 0, 0.0
+
+    def record(self, seconds, status):
+        self.latencies.append(seconds)
+        if not (200 <= status < 300 or status == 304):
+            self.errors += 1
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+        return (
+            f'{self.label:<5} {self.path:<42} {len(latencies) / self.seconds:8.0f} req/s  '
+            f'p50 {percentile(0.5):7.2f} ms  p95 {percentile(0.95):7.2f} ms  p99 {percentile(0.99):7.2f} ms  '
+            f'mean {statistics.fmean(latencies) * 1000:7.2f} ms  errors {self.errors}'
+        )
+
+
+def _split(path):
+    path, _, query = path.partition('?')
+    return path, query
+
+
+# ---- in-process WSGI ----
+
+def run_wsgi(path, total, concurrency, host):
+    from django.core.handlers.wsgi import WSGIHandler
+
+    app = WSGIHandler()
+    result = Result('wsgi', path)
+    counter = itertools.count()
+    lock = threading.Lock()
+    path_info, query = _split(path)
+
+    def request():
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path_info, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': host,
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        status = []
+        start = time.perf_counter()
+        body = app(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+        try:
+            for _ in body:
+                pass
+        finally:
+            body.close()
+        return time.perf_counter() - start, status[0]
+
+    def worker():
+        while next(counter) < total:
+            seconds, status = request()
+            with lock:
+                result.record(seconds, status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+# ---- in-process ASGI ----
+
+async def _asgi_request(app, path, host):
+    path_info, query = _split(path)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path_info, 'raw_path': path_info.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', host.encode())], 'server': (host, 80), 'client': ('127.0.0.1', 0),
+    }
+    finished = asyncio.Event()
+    status, received = [], []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    finished.set()
+    return time.perf_counter() - start, status[0]
+
+
+def run_asgi(path, total, concurrency, host):
+    from django.core.asgi import get_asgi_application
+
+    app = get_asgi_application()
+    result = Result('asgi', path)
+    counter = itertools.count()
+
+    async def worker():
+        while next(counter) < total:
+            result.record(*await _asgi_request(app, path, host))
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        result.seconds = time.perf_counter() - start
+
+    asyncio.run(main())
+    return result
+
+
+# ---- running server over HTTP ----
+
+async def _read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while size := int((await reader.readline()).split(b';')[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    elif status not in (204, 304):
+        await reader.read()  # delimited by closing the connection
+        headers['connection'] = 'close'
+    return status, headers.get('connection', '').lower() == 'close'
+
+
+def run_http(url, path, total, concurrency):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    target = f"{parts.path.rstrip('/')}{path}"
+    request = f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: keep-alive\r\n\r\n'.encode()
+    result = Result('http', path)
+    counter = itertools.count()
+
+    async def worker():
+        reader = writer = None
+        while next(counter) < total:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, close = await _read_response(reader)
+            result.record(time.perf_counter() - start, status)
+            if close:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        result.seconds = time.perf_counter() - start
+
+    asyncio.run(main())
+    return result
+
+
+def run(interface, path, total, concurrency, host='localhost', url=None):
+    if url:
+        return run_http(url, path, total, concurrency)
+    runner = {'wsgi': run_wsgi, 'asgi': run_asgi}[interface]
+    runner(path, min(total, concurrency * 2), concurrency, host)  # warm up connections and caches
+    return runner(path, total, concurrency, host)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apiApp.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Run apiApp benchmarks against synthetic data (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"Benchmarks to run (default: all). Available: {', '.join(sorted(BENCHMARKS))}")
+        parser.add_argument('--size', type=int, default=1000, help="Number of synthetic rows to seed.")
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name} (size={options['size']})"))
+            with transaction.atomic():
+                BENCHMARKS[name](self.stdout, options['size'])
+                transaction.set_rollback(True)
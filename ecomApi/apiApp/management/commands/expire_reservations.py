@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apiApp.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = "Return the stock of expired reservations to their variants."
+
+    def handle(self, *args, **options):
+        count = release_expired()
+        self.stdout.write(self.style.SUCCESS(f"Released {count} expired reservations"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apiApp import images
+
+
+class Command(BaseCommand):
+    help = "Generate missing or stale image derivatives (uploads from before the pipeline, failed jobs)."
+
+    def handle(self, *args, **options):
+        scheduled = 0
+        for model in images.image_models():
+            for instance in model.objects.only('pk', 'renditions', *model.IMAGE_FIELDS).iterator(chunk_size=2000):
+                if images.needs_rendering(instance):
+                    images.schedule(model._meta.label, instance.pk)
+                    scheduled += 1
+        images.wait()
+        self.stdout.write(self.style.SUCCESS(f"Generated derivatives for {scheduled} rows"))
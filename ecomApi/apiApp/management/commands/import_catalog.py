@@ -0,0 +1,74 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apiApp.catalog_io import CHUNK_SIZE, FORMATS, READERS, guess_format, import_records
+
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a CSV or NDJSON catalog export into the database, upserting products by SKU. "
+        "Progress is checkpointed after every batch; rerunning resumes after the last committed one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File written by export_catalog (or in the same shape).")
+        parser.add_argument('--format', choices=FORMATS, help="Default: from the file extension, else ndjson.")
+        parser.add_argument('--batch-size', type=int, default=CHUNK_SIZE, help="Products per transaction.")
+        parser.add_argument('--checkpoint', help="Checkpoint file (default: <path>.checkpoint).")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint.")
+
+    def _load_checkpoint(self, checkpoint, size, restart):
+        if restart or not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as fh:
+            state = json.load(fh)
+        if state.get('size') != size:
+            raise CommandError(f"{checkpoint} was written for a different version of the file; pass --restart.")
+        return state['records']
+
+    def _save_checkpoint(self, checkpoint, size, records):
+        # Write-then-rename so a crash never leaves a torn checkpoint.
+        with open(f'{checkpoint}.tmp', 'w') as fh:
+            json.dump({'size': size, 'records': records}, fh)
+        os.replace(f'{checkpoint}.tmp', checkpoint)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        try:
+            size = os.path.getsize(path)
+        except OSError as exc:
+            raise CommandError(str(exc))
+        skip = self._load_checkpoint(checkpoint, size, options['restart'])
+        if skip:
+            self.stdout.write(f"Resuming after record {skip}")
+
+        read = READERS[guess_format(path, options['format'])]
+        created = updated = failed = rows = 0
+        start = time.perf_counter()
+        with open(path, newline='', encoding='utf-8') as source:
+            for done, result in import_records(read(source), options['batch_size'], skip):
+                created += result['created']
+                updated += result['updated']
+                for error in result['errors']:
+                    if failed < MAX_REPORTED_ERRORS:
+                        self.stderr.write(f"record {error['index']}: {json.dumps(error['errors'])}")
+                    failed += 1
+                self._save_checkpoint(checkpoint, size, done)
+                rows += result['rows']
+                if options['verbosity'] >= 2:
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"{done} records, {rows / max(elapsed, 1e-9):.0f} rows/s")
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created} new and {updated} updated products ({rows} rows) in {elapsed:.1f}s, "
+            f"{rows / max(elapsed, 1e-9):.0f} rows/s; {failed} rejected"
+        ))
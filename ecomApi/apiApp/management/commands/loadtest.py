@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apiApp import loadtest
+from apiApp.models import Brand, Category, Product, Subcategory
+
+
+class Command(BaseCommand):
+    help = "Compare requests/s of endpoints under concurrency, in-process over WSGI and ASGI or against a running server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="Paths to request (default: product list and detail, sync and async).")
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight.")
+        parser.add_argument('--requests', type=int, default=1000, help="Requests per path and interface.")
+        parser.add_argument('--interface', choices=loadtest.INTERFACES, nargs='+', default=list(loadtest.INTERFACES))
+        parser.add_argument('--url', help="Base URL of a running server to load instead of the in-process handlers.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed this many synthetic products first (deleted afterwards).")
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            from apiApp.benchmarks import seed_catalog
+
+            if Brand.objects.filter(slug='benchmark-brand').exists():
+                raise CommandError("Synthetic catalog already present; remove the 'benchmark-brand' brand first.")
+            seed_catalog(options['seed'])
+        try:
+            self.run(options)
+        finally:
+            if options['seed']:
+                self.unseed()
+
+    def run(self, options):
+        paths = options['paths']
+        if not paths:
+            pk = Product.objects.order_by('pk').values_list('pk', flat=True).first()
+            if pk is None:
+                raise CommandError("No products to request; pass --seed N.")
+            paths = ['/api/products/', '/api/async/products/', f'/api/products/{pk}/', f'/api/async/products/{pk}/']
+        interfaces = ['http'] if options['url'] else options['interface']
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{options['requests']} requests per path, concurrency {options['concurrency']}"
+        ))
+        for path in paths:
+            for interface in interfaces:
+                result = loadtest.run(interface, path, options['requests'], options['concurrency'], host, options['url'])
+                self.stdout.write(result.summary())
+
+    def unseed(self):
+        brand = Brand.objects.get(slug='benchmark-brand')
+        Product.objects.filter(brand=brand).delete()
+        brand.delete()
+        Subcategory.objects.filter(slug='benchmark-subcategory').delete()
+        Category.objects.filter(slug='benchmark-category').delete()
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apiApp import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index from the catalog tables."
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError("Product search requires SQLite FTS5.")
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
@@ -0,0 +1,17 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from apiApp.storage import reconcile_media
+
+
+class Command(BaseCommand):
+    help = "Recount media blob references; with --collect, delete unreferenced blobs past their grace period."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collect', action='store_true', help="Delete unreferenced blobs and stray files.")
+
+    def handle(self, *args, **options):
+        blobs, collected, freed = reconcile_media(default_storage, options['collect'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {blobs} blobs; collected {collected} files ({freed / 2**20:.1f} MiB)"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apiApp.ratings import reconcile_ratings, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Recompute product rating aggregates from approved reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Products per batch.")
+
+    def handle(self, *args, **options):
+        count = reconcile_ratings(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Reconciled ratings of {count} products"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apiApp.inventory import reconcile_total_stock, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.total_stock from variant stock, in primary-key chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BATCH_SIZE, help="Products per transaction.")
+        parser.add_argument('--after', type=int, default=0, help="Resume after this product id.")
+
+    def handle(self, *args, **options):
+        count = reconcile_total_stock(options['chunk_size'], options['after'])
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {count} products"))
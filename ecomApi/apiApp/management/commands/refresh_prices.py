@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from apiApp.models import Product
+from apiApp.pricing import refresh_prices, refresh_expired_prices, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Recompute precomputed product prices (all products, or only expired ones with --expired)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expired', action='store_true', help="Only refresh rows whose promotion window changed.")
+
+    def handle(self, *args, **options):
+        if options['expired']:
+            count = refresh_expired_prices()
+        else:
+            count = 0
+            ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+            batch = []
+            for pk in ids.iterator(chunk_size=CHUNK_SIZE):
+                batch.append(pk)
+                if len(batch) == CHUNK_SIZE:
+                    refresh_prices(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                refresh_prices(batch)
+                count += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {count} product prices"))
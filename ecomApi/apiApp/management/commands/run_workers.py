@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apiApp import tasks
+
+
+class Command(BaseCommand):
+    help = "Run background task workers (apiApp.tasks) until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes to run.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to wait when no task is due.")
+        parser.add_argument('--once', action='store_true', help="Run the tasks that are due, then exit.")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = tasks.run_worker(once=True)
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} tasks"))
+            return
+        self.stdout.write(f"Running {options['processes']} worker(s); Ctrl+C to stop")
+        tasks.serve(options['processes'], options['poll'])
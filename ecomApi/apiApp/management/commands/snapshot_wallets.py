@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apiApp.ledger import snapshot_wallets
+
+
+class Command(BaseCommand):
+    help = "Checkpoint wallet balances so point-in-time balances only sum a short tail."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-tail', type=int, default=1, help="Skip wallets with fewer new transactions than this.")
+
+    def handle(self, *args, **options):
+        count = snapshot_wallets(min_tail=options['min_tail'])
+        self.stdout.write(self.style.SUCCESS(f"Took {count} wallet snapshots"))
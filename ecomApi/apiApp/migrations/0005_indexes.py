@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiApp', '0004_remove_productstock_product_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flashsale',
+            index=models.Index(fields=['end_date', 'start_date'], name='flashsale_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flashsale',
+            index=models.Index(fields=['product', 'end_date', 'start_date'], name='flashsale_product_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-order_date', '-id'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-order_date', '-id'], name='order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('active', True)), fields=['category', 'id'], name='product_active_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('active', True)), fields=['subcategory', 'id'], name='product_active_subcat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('active', True)), fields=['brand', 'id'], name='product_active_brand_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productoffer',
+            index=models.Index(fields=['end_date', 'start_date'], name='offer_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productoffer',
+            index=models.Index(fields=['product', 'end_date', 'start_date'], name='offer_product_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['product', 'rating'], name='review_product_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wallettransaction',
+            index=models.Index(fields=['wallet', '-created_at', '-id'], name='wallettxn_wallet_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wallettransaction',
+            index=models.Index(fields=['-created_at', '-id'], name='wallettxn_created_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:17
+
+from decimal import Decimal, ROUND_HALF_UP
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, Min, Q
+from django.utils.timezone import now
+
+CHUNK_SIZE = 500
+
+
+def _promotions(model, product_ids, at):
+    active = Q(start_date__lte=at)
+    rows = (
+        model.objects
+        .filter(product_id__in=product_ids, end_date__gt=at)
+        .values('product_id')
+        .annotate(
+            best=Max('discount_percentage', filter=active),
+            next_end=Min('end_date', filter=active),
+            next_start=Min('start_date', filter=Q(start_date__gt=at)),
+        )
+    )
+    return {row['product_id']: row for row in rows}
+
+
+def backfill_prices(apps, schema_editor):
+    # Same computation as apiApp.pricing.refresh_prices at the time of
+    # writing, kept here so existing products get a row.
+    Product = apps.get_model('apiApp', 'Product')
+    ProductOffer = apps.get_model('apiApp', 'ProductOffer')
+    FlashSale = apps.get_model('apiApp', 'FlashSale')
+    ProductPrice = apps.get_model('apiApp', 'ProductPrice')
+    at = now()
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        chunk = product_ids[start:start + CHUNK_SIZE]
+        offers = _promotions(ProductOffer, chunk, at)
+        flash_sales = _promotions(FlashSale, chunk, at)
+        rows = []
+        for product_id, price in Product.objects.filter(pk__in=chunk).values_list('pk', 'price'):
+            promotions = [p for p in (offers.get(product_id), flash_sales.get(product_id)) if p]
+            discount = min(max([p['best'] or 0 for p in promotions], default=0), 100)
+            boundaries = [p[key] for p in promotions for key in ('next_end', 'next_start') if p[key] is not None]
+            effective = Decimal(price) * (100 - discount) / 100
+            rows.append(ProductPrice(
+                product_id=product_id,
+                discount_percentage=discount,
+                effective_price=effective.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+                computed_at=at,
+                valid_until=min(boundaries, default=None),
+            ))
+        ProductPrice.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiApp', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPrice',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pricing', serialize=False, to='apiApp.product')),
+                ('discount_percentage', models.PositiveIntegerField(default=0)),
+                ('effective_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('computed_at', models.DateTimeField()),
+                ('valid_until', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_prices, migrations.RunPython.noop),
+    ]
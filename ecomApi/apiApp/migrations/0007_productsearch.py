@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# Frozen copy of the apiApp.search schema as of this migration: later
+# changes to the app must not change what this migration does.
+CREATE_SQL = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS "apiApp_productsearch" USING fts5(
+    title, description, meta_keywords, brand, category, subcategory,
+    brand_id UNINDEXED, category_id UNINDEXED, subcategory_id UNINDEXED,
+    tokenize = "unicode61 remove_diacritics 2"
+)
+'''
+
+POPULATE_SQL = '''
+INSERT INTO "apiApp_productsearch" (
+    rowid, title, description, meta_keywords, brand, category, subcategory,
+    brand_id, category_id, subcategory_id
+)
+SELECT p.id, p.title, COALESCE(p.description, ''), COALESCE(p.meta_keywords, ''),
+       b.title, c.title, s.title, p.brand_id, p.category_id, p.subcategory_id
+FROM "apiApp_product" p
+JOIN "apiApp_brand" b ON b.id = p.brand_id
+JOIN "apiApp_category" c ON c.id = p.category_id
+JOIN "apiApp_subcategory" s ON s.id = p.subcategory_id
+WHERE p.active
+'''
+
+DROP_SQL = 'DROP TABLE IF EXISTS "apiApp_productsearch"'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiApp', '0006_productprice'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
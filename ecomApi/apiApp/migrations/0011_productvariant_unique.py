@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiApp', '0010_walletsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='productvariant',
+            constraint=models.UniqueConstraint(fields=('product', 'color', 'size'), name='productvariant_product_color_size_uniq'),
+        ),
+    ]
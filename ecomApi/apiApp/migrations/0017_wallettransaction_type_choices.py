@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiApp', '0016_queuedtask'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wallettransaction',
+            name='transaction_type',
+            field=models.CharField(choices=[('Deposit', 'Deposit'), ('Refund', 'Refund'), ('Withdrawal', 'Withdrawal'), ('Purchase', 'Purchase')], max_length=50),
+        ),
+    ]
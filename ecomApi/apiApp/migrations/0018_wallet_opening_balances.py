@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Case, F, Min, Sum, When
+
+DEBIT_TYPES = ('Withdrawal', 'Purchase')
+
+
+def post_opening_balances(apps, schema_editor):
+    # Balances from before the ledger aren't explained by any transaction.
+    # Post the difference as one opening transaction dated before the
+    # wallet's history, so balance_at/verify_balance add up.
+    Wallet = apps.get_model('apiApp', 'Wallet')
+    WalletTransaction = apps.get_model('apiApp', 'WalletTransaction')
+    WalletSnapshot = apps.get_model('apiApp', 'WalletSnapshot')
+    signed = Case(When(transaction_type__in=DEBIT_TYPES, then=-F('amount')), default=F('amount'))
+
+    for wallet in Wallet.objects.order_by('pk').iterator():
+        history = WalletTransaction.objects.filter(wallet=wallet).aggregate(total=Sum(signed), first=Min('created_at'))
+        opening = wallet.balance - (history['total'] or 0)
+        if not opening:
+            continue
+        posted = WalletTransaction.objects.create(
+            wallet=wallet, amount=abs(opening), transaction_type='Deposit' if opening > 0 else 'Withdrawal',
+        )
+        if history['first'] is not None:
+            WalletTransaction.objects.filter(pk=posted.pk).update(created_at=history['first'])
+        # Checkpoints taken without the opening transaction are wrong.
+        WalletSnapshot.objects.filter(wallet=wallet).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiApp', '0017_wallettransaction_type_choices'),
+    ]
+
+    operations = [
+        migrations.RunPython(post_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 07:45
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apiApp', '0018_wallet_opening_balances'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='flashsale',
+            name='discount_percentage',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AlterField(
+            model_name='productoffer',
+            name='discount_percentage',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MaxValueValidator(100)]),
+        ),
+    ]
@@ -1,16 +1,120 @@
+from django.core.validators import MaxValueValidator
 from django.db import models
-from django.utils.text import slugify
 from django.utils.timezone import now
 from django.contrib.auth import get_user_model
-import uuid
 
 User = get_user_model()
 
+# ===========================
+# Identifier sequences
+# ===========================
+
+class Sequence(models.Model):
+    """A named counter handing out blocks of numbers (see apiApp.identifiers)."""
+    name = models.CharField(max_length=300, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+# ===========================
+# Media blobs
+# ===========================
+
+class MediaBlob(models.Model):
+    """
+    One stored upload, keyed by the SHA-256 of its bytes (see apiApp.storage).
+    `refs` counts the rows (file fields and image derivatives) naming it.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+    size = models.PositiveBigIntegerField()
+    refs = models.IntegerField(default=0)
+    # Last upload of these bytes; unreferenced blobs are kept for a grace period after it.
+    uploaded_at = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [models.Index(fields=['refs', 'uploaded_at'], name='mediablob_refs_idx')]
+
+    def __str__(self):
+        return f"{self.name} ({self.refs} refs)"
+
+
+# ===========================
+# Background tasks
+# ===========================
+
+class QueuedTask(models.Model):
+    """A post-write side effect waiting for `manage.py run_workers` (see apiApp.tasks)."""
+    PENDING, RUNNING, FAILED = 'pending', 'running', 'failed'
+    STATES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField()
+    # At most one pending task per key; enqueueing it again is a no-op.
+    dedup_key = models.CharField(max_length=255, null=True, blank=True)
+    state = models.CharField(max_length=10, choices=STATES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=now)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['state', 'run_after'], name='queuedtask_due_idx')]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(state='pending'), name='queuedtask_pending_dedup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} {self.payload} ({self.state})"
+
+
+def unique_slug(instance):
+    from .identifiers import unique_slugs
+    return unique_slugs(type(instance), [instance.title])[0]
+
+
+# ===========================
+# Image renditions
+# ===========================
+
+class ImageRenditionsMixin(models.Model):
+    """
+    Resized derivatives of the `IMAGE_FIELDS` uploads are generated in the
+    background (see apiApp.images) and recorded in `renditions`.
+    """
+    IMAGE_FIELDS = ()
+    # Columns maintained outside of model saves.
+    DERIVED_FIELDS = ('renditions',)
+
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # A plain save of a stored row must not write back the copies of
+        # derived columns loaded with this instance.
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
 # ===========================
 # Core Models
 # ===========================
 
-class Brand(models.Model):
+class Brand(ImageRenditionsMixin):
+    IMAGE_FIELDS = ('thumb', 'banner')
+
     title = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     description = models.TextField(null=True, blank=True)
@@ -24,14 +128,16 @@ class Brand(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
+            self.slug = unique_slug(self)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
-class Category(models.Model):
+class Category(ImageRenditionsMixin):
+    IMAGE_FIELDS = ('thumb', 'banner')
+
     title = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     description = models.TextField(null=True, blank=True)
@@ -46,14 +152,16 @@ class Category(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
+            self.slug = unique_slug(self)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
-class Subcategory(models.Model):
+class Subcategory(ImageRenditionsMixin):
+    IMAGE_FIELDS = ('thumb', 'banner')
+
     title = models.CharField(max_length=255, unique=True)
     category = models.ForeignKey(Category, related_name='subcategories', on_delete=models.CASCADE)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
@@ -69,7 +177,7 @@ class Subcategory(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
+            self.slug = unique_slug(self)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -80,7 +188,10 @@ class Subcategory(models.Model):
 # Product and Inventory
 # ===========================
 
-class Product(models.Model):
+class Product(ImageRenditionsMixin):
+    IMAGE_FIELDS = ('thumb', 'banner')
+    DERIVED_FIELDS = ('renditions', 'total_stock')  # total_stock: see apiApp.signals
+
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     description = models.TextField(null=True, blank=True)
@@ -95,7 +206,7 @@ class Product(models.Model):
     # Stock and Variant options
     color = models.CharField(max_length=100, null=True, blank=True)
     size = models.CharField(max_length=100, null=True, blank=True)
-    total_stock = models.PositiveIntegerField(default=0)
+    total_stock = models.PositiveIntegerField(default=0)  # sum of variant stock, see apiApp.signals
 
     # Relationships
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
@@ -112,13 +223,22 @@ class Product(models.Model):
 
     active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Storefront listings only ever browse active products.
+            models.Index(fields=['category', 'id'], condition=models.Q(active=True), name='product_active_category_idx'),
+            models.Index(fields=['subcategory', 'id'], condition=models.Q(active=True), name='product_active_subcat_idx'),
+            models.Index(fields=['brand', 'id'], condition=models.Q(active=True), name='product_active_brand_idx'),
+        ]
+
     def generate_sku(self):
         if not self.sku:
-            self.sku = f"{self.brand.id}-{uuid.uuid4().hex[:8]}"  # SKU format: brand-id + unique identifier
+            from .identifiers import unique_skus
+            self.sku = unique_skus([self.brand_id])[0]  # SKU format: brand-id + per-brand sequence number
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
+            self.slug = unique_slug(self)
         self.generate_sku()
         super().save(*args, **kwargs)
 
@@ -133,11 +253,19 @@ class ProductVariant(models.Model):
     additional_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     stock = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            # Also the conflict target of bulk variant upserts (apiApp.ingest).
+            models.UniqueConstraint(fields=['product', 'color', 'size'], name='productvariant_product_color_size_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.product.title} - {self.color}/{self.size}"
 
 
-class ProductImage(models.Model):
+class ProductImage(ImageRenditionsMixin):
+    IMAGE_FIELDS = ('image',)
+
     product_variant = models.ForeignKey(ProductVariant, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='product_variant_images/')
 
@@ -145,30 +273,82 @@ class ProductImage(models.Model):
         return f"{self.product_variant.product.title} - {self.product_variant.color}/{self.product_variant.size}"
 
 
+class StockReservation(models.Model):
+    # Stock taken out of a variant for a limited time (checkout, flash sale).
+    # Held stock is already subtracted from ProductVariant.stock; releasing a
+    # hold puts it back, consuming it makes the sale final.
+    HELD = 'held'
+    RELEASED = 'released'
+    CONSUMED = 'consumed'
+    STATUS_CHOICES = [(HELD, 'Held'), (RELEASED, 'Released'), (CONSUMED, 'Consumed')]
+
+    variant = models.ForeignKey(ProductVariant, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Marks the rows claimed by one release/consume call (see apiApp.inventory).
+    settle_batch = models.CharField(max_length=32, null=True, blank=True, editable=False, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], condition=models.Q(status='held'), name='reservation_held_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x variant {self.variant_id} ({self.status})"
+
+
 # ===========================
 # Promotions
 # ===========================
 
 class ProductOffer(models.Model):
     product = models.ForeignKey(Product, related_name='offers', on_delete=models.CASCADE)
-    discount_percentage = models.PositiveIntegerField()
+    discount_percentage = models.PositiveIntegerField(validators=[MaxValueValidator(100)])
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['end_date', 'start_date'], name='offer_window_idx'),
+            models.Index(fields=['product', 'end_date', 'start_date'], name='offer_product_window_idx'),
+        ]
+
     def __str__(self):
         return f"Offer for {self.product.title} - {self.discount_percentage}% off"
 
 
 class FlashSale(models.Model):
     product = models.ForeignKey(Product, related_name='flash_sales', on_delete=models.CASCADE)
-    discount_percentage = models.PositiveIntegerField()
+    discount_percentage = models.PositiveIntegerField(validators=[MaxValueValidator(100)])
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['end_date', 'start_date'], name='flashsale_window_idx'),
+            models.Index(fields=['product', 'end_date', 'start_date'], name='flashsale_product_window_idx'),
+        ]
+
     def __str__(self):
         return f"Flash Sale for {self.product.title} - {self.discount_percentage}% off"
 
 
+class ProductPrice(models.Model):
+    # Precomputed effective price of a product under its best active promotion.
+    # Valid until `valid_until`, the next time an offer or flash sale for the
+    # product starts or ends (null when nothing is scheduled).
+    product = models.OneToOneField(Product, related_name='pricing', on_delete=models.CASCADE, primary_key=True)
+    discount_percentage = models.PositiveIntegerField(default=0)
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2)
+    computed_at = models.DateTimeField()
+    valid_until = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.product_id} at {self.effective_price}"
+
+
 # ===========================
 # Reviews and Feedback
 # ===========================
@@ -180,10 +360,40 @@ class ProductReview(models.Model):
     review = models.TextField(null=True, blank=True)
     approved = models.BooleanField(default=False)  # Moderation flag
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'rating'], condition=models.Q(approved=True), name='review_product_approved_idx'),
+        ]
+
     def __str__(self):
         return f"Review for {self.product.title} by {self.user.username}"
 
 
+class ProductRating(models.Model):
+    # Aggregates of a product's approved reviews, moved by deltas as reviews
+    # are written (see apiApp.ratings). `average` is stored so lists can sort
+    # by it.
+    product = models.OneToOneField(Product, related_name='rating', on_delete=models.CASCADE, primary_key=True)
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    one_star = models.PositiveIntegerField(default=0)
+    two_stars = models.PositiveIntegerField(default=0)
+    three_stars = models.PositiveIntegerField(default=0)
+    four_stars = models.PositiveIntegerField(default=0)
+    five_stars = models.PositiveIntegerField(default=0)
+
+    STAR_FIELDS = ('one_star', 'two_stars', 'three_stars', 'four_stars', 'five_stars')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['average', 'product'], name='productrating_average_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.average} from {self.count} reviews"
+
+
 # ===========================
 # Orders, Cart, Wishlist, Wallet
 # ===========================
@@ -199,6 +409,7 @@ class Cart(models.Model):
 class CartProduct(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    variant = models.ForeignKey('ProductVariant', null=True, blank=True, on_delete=models.CASCADE)  # required at checkout
     quantity = models.PositiveIntegerField()
 
     def __str__(self):
@@ -218,6 +429,13 @@ class Order(models.Model):
     products = models.ManyToManyField(Product, through='OrderProduct')
     order_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=100)
+    total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-order_date', '-id'], name='order_user_date_idx'),
+            models.Index(fields=['-order_date', '-id'], name='order_date_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
@@ -226,7 +444,9 @@ class Order(models.Model):
 class OrderProduct(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    variant = models.ForeignKey('ProductVariant', null=True, blank=True, on_delete=models.SET_NULL)
     quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # price paid, snapshotted at checkout
 
     def __str__(self):
         return f"{self.product.title} in Order {self.order.id}"
@@ -245,10 +465,40 @@ class Wallet(models.Model):
 
 
 class WalletTransaction(models.Model):
+    # Amounts are positive; the type decides the direction (see apiApp.ledger).
+    DEPOSIT = 'Deposit'
+    REFUND = 'Refund'
+    WITHDRAWAL = 'Withdrawal'
+    PURCHASE = 'Purchase'
+    TYPE_CHOICES = [(DEPOSIT, 'Deposit'), (REFUND, 'Refund'), (WITHDRAWAL, 'Withdrawal'), (PURCHASE, 'Purchase')]
+    CREDIT_TYPES = (DEPOSIT, REFUND)
+    DEBIT_TYPES = (WITHDRAWAL, PURCHASE)
+
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    transaction_type = models.CharField(max_length=50)  # Deposit, Withdrawal, etc.
+    transaction_type = models.CharField(max_length=50, choices=TYPE_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', '-created_at', '-id'], name='wallettxn_wallet_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='wallettxn_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} of {self.amount} for {self.wallet.user.username}"
+
+
+class WalletSnapshot(models.Model):
+    """Balance of a wallet over every transaction created before `as_of`."""
+    wallet = models.ForeignKey(Wallet, related_name='snapshots', on_delete=models.CASCADE)
+    as_of = models.DateTimeField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'as_of'], name='walletsnapshot_wallet_as_of_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.wallet} at {self.as_of}: {self.balance}"
@@ -0,0 +1,65 @@
+import threading
+
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+
+from .caching import get_version
+from .models import Category, Subcategory, Product
+
+# ===========================
+# Navigation tree
+# ===========================
+#
+# The storefront menu: active categories, their active subcategories and
+# how many active products each holds. It is built from three queries,
+# rendered to JSON once, and held per process. Workers rebuild on their
+# next read after the `navigation` version is bumped (see apiApp.signals),
+# so the endpoint itself never touches the database.
+
+VERSION = 'navigation'
+
+
+class Navigation:
+    def __init__(self, version, tree):
+        self.version = version
+        self.tree = tree
+        self.content = JSONRenderer().render(tree)
+        self.etag = f'"navigation-{version}"'
+
+
+def build_tree():
+    category_counts, subcategory_counts = {}, {}
+    for row in (
+        Product.objects.filter(active=True).order_by()
+        .values('category_id', 'subcategory_id').annotate(products=Count('pk'))
+    ):
+        category_counts[row['category_id']] = category_counts.get(row['category_id'], 0) + row['products']
+        subcategory_counts[row['subcategory_id']] = subcategory_counts.get(row['subcategory_id'], 0) + row['products']
+
+    children = {}
+    for subcategory in (
+        Subcategory.objects.filter(active=True, category__active=True)
+        .order_by('title').values('id', 'category_id', 'title', 'slug')
+    ):
+        category_id = subcategory.pop('category_id')
+        subcategory['product_count'] = subcategory_counts.get(subcategory['id'], 0)
+        children.setdefault(category_id, []).append(subcategory)
+
+    return [
+        {**category, 'product_count': category_counts.get(category['id'], 0), 'subcategories': children.get(category['id'], [])}
+        for category in Category.objects.filter(active=True).order_by('title').values('id', 'title', 'slug')
+    ]
+
+
+_lock = threading.Lock()
+_navigation = None
+
+
+def get_navigation():
+    global _navigation
+    version = get_version(VERSION)
+    if _navigation is None or _navigation.version != version:
+        with _lock:
+            if _navigation is None or _navigation.version != version:
+                _navigation = Navigation(version, build_tree())
+    return _navigation
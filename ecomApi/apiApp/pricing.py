@@ -0,0 +1,98 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Max, Min, Q
+from django.utils.timezone import now
+
+from . import facets
+from .caching import invalidate
+from .models import Product, ProductOffer, FlashSale, ProductPrice
+
+# ===========================
+# Effective price engine
+# ===========================
+#
+# The best active ProductOffer/FlashSale discount of every product is
+# resolved ahead of time into a ProductPrice row. Each row records when it
+# stops being valid (the next start or end of one of the product's
+# promotions), so readers only ever do a PK join plus one indexed probe for
+# expired rows instead of scanning the promotion tables per request.
+
+CHUNK_SIZE = 500
+CENT = Decimal('0.01')
+
+
+def apply_discount(amount, discount_percentage):
+    # Promotions are validated to 0-100%; older rows are clamped.
+    discount_percentage = min(max(discount_percentage, 0), 100)
+    amount = Decimal(amount) * (100 - discount_percentage) / 100
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def variant_price(variant):
+    # Product pricing is eager-loaded alongside variants, so this is O(1).
+    pricing = getattr(variant.product, 'pricing', None)
+    discount = pricing.discount_percentage if pricing else 0
+    return apply_discount(variant.product.price + variant.additional_price, discount)
+
+
+def _promotions(model, product_ids, at):
+    # Best active discount and the next start/end boundary, per product.
+    active = Q(start_date__lte=at)
+    rows = (
+        model.objects
+        .filter(product_id__in=product_ids, end_date__gt=at)
+        .values('product_id')
+        .annotate(
+            best=Max('discount_percentage', filter=active),
+            next_end=Min('end_date', filter=active),
+            next_start=Min('start_date', filter=Q(start_date__gt=at)),
+        )
+    )
+    return {row['product_id']: row for row in rows}
+
+
+def _earliest(*values):
+    values = [value for value in values if value is not None]
+    return min(values) if values else None
+
+
+def refresh_prices(product_ids, at=None):
+    """Recompute and upsert the ProductPrice rows of `product_ids`."""
+    at = at or now()
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        chunk = product_ids[start:start + CHUNK_SIZE]
+        offers = _promotions(ProductOffer, chunk, at)
+        flash_sales = _promotions(FlashSale, chunk, at)
+
+        rows = []
+        for product_id, price in Product.objects.filter(pk__in=chunk).values_list('pk', 'price'):
+            promotions = [p for p in (offers.get(product_id), flash_sales.get(product_id)) if p]
+            discount = min(max([p['best'] or 0 for p in promotions], default=0), 100)
+            valid_until = _earliest(*(p[key] for p in promotions for key in ('next_end', 'next_start')))
+            rows.append(ProductPrice(
+                product_id=product_id,
+                discount_percentage=discount,
+                effective_price=apply_discount(price, discount),
+                computed_at=at,
+                valid_until=valid_until,
+            ))
+
+        ProductPrice.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['discount_percentage', 'effective_price', 'computed_at', 'valid_until'],
+        )
+    if product_ids:
+        facets.touch(product_ids)
+        invalidate('product', *product_ids)
+
+
+def refresh_expired_prices(at=None):
+    """Recompute rows whose promotion window has started or ended since."""
+    at = at or now()
+    expired = list(ProductPrice.objects.filter(valid_until__lte=at).values_list('product_id', flat=True))
+    if expired:
+        refresh_prices(expired, at)
+    return len(expired)
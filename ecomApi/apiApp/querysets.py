@@ -0,0 +1,97 @@
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+# ===========================
+# Serializer-driven eager loading
+# ===========================
+#
+# Walks a serializer's field tree and works out which relations it is going
+# to touch, so a viewset can fetch them up front instead of once per row:
+#   * nested serializers / related fields over a forward FK -> select_related
+#   * nested `many=True` serializers and to-many related fields -> Prefetch
+# PrimaryKeyRelatedField over a forward FK only reads `<field>_id`, so it is
+# left alone. Serializers whose methods reach through relations the walker
+# cannot see list them in `Meta.select_related`.
+
+
+def _relation(model, attr):
+    # Resolve an attribute name (forward field name or reverse accessor such
+    # as `cartproduct_set`) to its model field, or None for plain attributes.
+    for field in model._meta.get_fields():
+        if field.is_relation and field.auto_created and not field.concrete:
+            if field.get_accessor_name() == attr:
+                return field
+        elif field.name == attr:
+            return field
+    return None
+
+
+def _is_to_one(field):
+    return field.many_to_one or field.one_to_one
+
+
+def _to_one_path(model, parts):
+    # Follow a dotted source such as `product.pricing.effective_price` through
+    # to-one relations and return the select_related path and its end model.
+    path = []
+    for attr in parts:
+        relation = _relation(model, attr)
+        if relation is None or not relation.is_relation or not _is_to_one(relation):
+            break
+        path.append(attr)
+        model = relation.related_model
+    return '__'.join(path), model
+
+
+def _plan(serializer, model):
+    select, prefetch = [], []
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        parts = field.source.split('.')
+        relation = _relation(model, parts[0])
+        if relation is None or not relation.is_relation:
+            continue
+        attr = parts[0]
+        related_model = relation.related_model
+
+        if isinstance(field, serializers.ListSerializer) or isinstance(field, serializers.ManyRelatedField):
+            if _is_to_one(relation):
+                continue
+            child = field.child if isinstance(field, serializers.ListSerializer) else None
+            queryset = related_model._default_manager.all()
+            if child is not None:
+                queryset = eager_load(queryset, child)
+            prefetch.append(Prefetch(attr, queryset=queryset))
+        elif _is_to_one(relation):
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and len(parts) == 1:
+                continue
+            path, related_model = _to_one_path(model, parts)
+            select.append(path)
+            if isinstance(field, serializers.BaseSerializer):
+                nested_select, nested_prefetch = _plan(field, related_model)
+                select.extend(f'{path}__{nested}' for nested in nested_select)
+                for lookup in nested_prefetch:
+                    lookup.add_prefix(path)
+                    prefetch.append(lookup)
+
+    # Relations read by methods/properties the walker cannot see.
+    select.extend(getattr(getattr(serializer, 'Meta', None), 'select_related', ()))
+    return select, prefetch
+
+
+def eager_load(queryset, serializer):
+    """
+    Return `queryset` with the select_related/prefetch_related calls needed
+    to render it through `serializer` in a constant number of queries.
+    """
+    select, prefetch = _plan(serializer, queryset.model)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
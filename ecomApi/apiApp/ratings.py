@@ -0,0 +1,89 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.lookups import GreaterThan
+
+from .caching import invalidate
+from .models import Product, ProductRating, ProductReview
+
+# ===========================
+# Product rating aggregates
+# ===========================
+#
+# Every product with approved reviews has a ProductRating row holding their
+# count, rating total, average and 1-5 star histogram. Review writes move
+# the row by the review's contribution with one F() UPDATE (apiApp.signals),
+# so showing or sorting by ratings never touches the reviews table.
+# Ratings outside 1-5 count towards the nearest star.
+# `manage.py reconcile_ratings` recomputes rows from the reviews.
+
+CHUNK_SIZE = 500
+CENT = Decimal('0.01')
+
+
+def star_field(rating):
+    return ProductRating.STAR_FIELDS[min(max(rating, 1), 5) - 1]
+
+
+def _average(count, total):
+    return Case(
+        When(GreaterThan(count, 0), then=total * Value(1.0) / count),
+        default=Value(0.0), output_field=FloatField(),
+    )
+
+
+def add_reviews(changes):
+    """Apply `[(product_id, rating, +1 or -1)]` review contributions."""
+    changes = [change for change in changes if change[0] is not None]
+    if not changes:
+        return
+    ProductRating.objects.bulk_create(
+        [ProductRating(product_id=product_id) for product_id in {change[0] for change in changes}],
+        ignore_conflicts=True,
+    )
+    for product_id, rating, sign in changes:
+        count = Greatest(F('count') + sign, 0)
+        total = Greatest(F('total') + sign * rating, 0)
+        star = star_field(rating)
+        ProductRating.objects.filter(pk=product_id).update(
+            count=count, total=total, average=_average(count, total),
+            **{star: Greatest(F(star) + sign, 0)},
+        )
+    invalidate('product', *{change[0] for change in changes})
+
+
+def refresh_ratings(product_ids):
+    """Recompute the ProductRating rows of `product_ids` from their approved reviews."""
+    product_ids = list(product_ids)
+    stars = {
+        field: Count('pk', filter=Q(rating__lte=1) if star == 1 else Q(rating__gte=5) if star == 5 else Q(rating=star))
+        for star, field in enumerate(ProductRating.STAR_FIELDS, start=1)
+    }
+    found = {
+        row.pop('product_id'): row for row in
+        ProductReview.objects.filter(product_id__in=product_ids, approved=True)
+        .values('product_id').annotate(count=Count('pk'), total=Sum('rating'), **stars)
+    }
+    rows = []
+    for product_id in product_ids:
+        row = found.get(product_id) or dict.fromkeys(('count', 'total', *ProductRating.STAR_FIELDS), 0)
+        average = (Decimal(row['total']) / row['count']).quantize(CENT, ROUND_HALF_UP) if row['count'] else 0
+        rows.append(ProductRating(product_id=product_id, average=average, **row))
+    ProductRating.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['product'],
+        update_fields=['count', 'total', 'average', *ProductRating.STAR_FIELDS],
+    )
+    invalidate('product', *product_ids)
+
+
+def reconcile_ratings(chunk_size=CHUNK_SIZE):
+    """Recompute every product's ratings, a chunk of products at a time. Returns the count."""
+    done = 0
+    ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+    after = 0
+    while chunk := list(ids.filter(pk__gt=after)[:chunk_size]):
+        refresh_ratings(chunk)
+        done += len(chunk)
+        after = chunk[-1]
+    return done
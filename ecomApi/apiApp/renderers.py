@@ -0,0 +1,24 @@
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encode = JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def ndjson_lines(rows):
+    """Encode rows lazily, one JSON document per line."""
+    for row in rows:
+        yield f'{_encode(row)}\n'.encode()
+
+
+# One JSON document per line. Streamed list responses write their rows
+# through ndjson_lines directly; this renders everything else (detail
+# pages, errors) as a single line so the media type negotiates everywhere.
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return b''.join(ndjson_lines(data if isinstance(data, list) else [data]))
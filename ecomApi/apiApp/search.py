@@ -0,0 +1,145 @@
+import re
+
+from django.db import connection
+from django.db.models import Count, Q
+
+from .models import Product
+
+# ===========================
+# Product full-text search
+# ===========================
+#
+# Active products are mirrored into an SQLite FTS5 table (created by
+# migration 0007) whose rowid is the product id. Queries are ranked with
+# BM25 and every term is prefix-matched, so "sne" finds "Sneakers". Facet
+# ids/titles are stored as UNINDEXED columns so facet counts over a result
+# set never touch the catalog tables. The index is maintained incrementally
+# by the signal handlers in apiApp.signals. Other databases have no index
+# and fall back to unranked icontains lookups on the catalog tables.
+
+TABLE = 'apiApp_productsearch'
+FACETS = ('brand', 'category', 'subcategory')
+MAX_RESULTS = 100
+
+# Column weights for bm25(): title, description, meta_keywords, brand,
+# category, subcategory (the UNINDEXED id columns get no weight).
+WEIGHTS = (10.0, 1.0, 4.0, 3.0, 2.0, 2.0)
+
+_INSERT_SQL = f'''
+INSERT INTO "{TABLE}" (
+    rowid, title, description, meta_keywords, brand, category, subcategory,
+    brand_id, category_id, subcategory_id
+)
+SELECT p.id, p.title, COALESCE(p.description, ''), COALESCE(p.meta_keywords, ''),
+       b.title, c.title, s.title, p.brand_id, p.category_id, p.subcategory_id
+FROM "apiApp_product" p
+JOIN "apiApp_brand" b ON b.id = p.brand_id
+JOIN "apiApp_category" c ON c.id = p.category_id
+JOIN "apiApp_subcategory" s ON s.id = p.subcategory_id
+WHERE p.active
+'''
+
+CHUNK_SIZE = 500
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def build_match(query):
+    """Turn free text into an FTS5 expression: every term quoted and prefixed."""
+    terms = _TERM.findall(query or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def rebuild_index():
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{TABLE}"')
+        cursor.execute(_INSERT_SQL)
+
+
+def index_products(product_ids):
+    """(Re)index `product_ids`; inactive or missing products are dropped."""
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(product_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM "{TABLE}" WHERE rowid IN ({placeholders})', chunk)
+            cursor.execute(f'{_INSERT_SQL} AND p.id IN ({placeholders})', chunk)
+
+
+def search(query, filters=None, limit=20):
+    """
+    Return `(ranked_product_ids, total, facets)` for `query`.
+
+    `filters` maps facet names to ids and narrows both the hits and the
+    facet counts. `facets` maps each facet name to a list of
+    `{'id', 'title', 'count'}` dicts, most frequent first.
+    """
+    match = build_match(query)
+    if not match:
+        return [], 0, {facet: [] for facet in FACETS}
+    for facet in filters or {}:
+        if facet not in FACETS:
+            raise ValueError(f'Unknown facet {facet!r}')
+    if not is_supported():
+        return _search_unindexed(query, filters, limit)
+
+    where, params = [f'"{TABLE}" MATCH %s'], [match]
+    for facet, value in (filters or {}).items():
+        where.append(f'{facet}_id = %s')
+        params.append(value)
+    where = ' AND '.join(where)
+    weights = ', '.join(str(weight) for weight in WEIGHTS)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM "{TABLE}" WHERE {where} ORDER BY bm25("{TABLE}", {weights}) LIMIT %s',
+            params + [min(limit, MAX_RESULTS)],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+        facets = {}
+        total = 0
+        for facet in FACETS:
+            cursor.execute(
+                f'SELECT {facet}_id, {facet}, COUNT(*) FROM "{TABLE}" WHERE {where} '
+                f'GROUP BY {facet}_id ORDER BY COUNT(*) DESC, {facet}',
+                params,
+            )
+            facets[facet] = [{'id': pk, 'title': title, 'count': count} for pk, title, count in cursor.fetchall()]
+            total = sum(bucket['count'] for bucket in facets[facet])
+    return ids, total, facets
+
+
+_SEARCHED = ('title', 'description', 'meta_keywords', 'brand__title', 'category__title', 'subcategory__title')
+
+
+def _search_unindexed(query, filters, limit):
+    matches = Product.objects.filter(active=True, **{f'{facet}_id': value for facet, value in (filters or {}).items()})
+    for term in _TERM.findall(query):
+        any_column = Q()
+        for column in _SEARCHED:
+            any_column |= Q(**{f'{column}__icontains': term})
+        matches = matches.filter(any_column)
+
+    ids = list(matches.order_by('title', 'pk').values_list('pk', flat=True)[:min(limit, MAX_RESULTS)])
+    facets = {
+        facet: [
+            {'id': row[f'{facet}_id'], 'title': row[f'{facet}__title'], 'count': row['count']}
+            for row in matches.order_by().values(f'{facet}_id', f'{facet}__title')
+            .annotate(count=Count('pk')).order_by('-count', f'{facet}__title')
+        ]
+        for facet in FACETS
+    }
+    return ids, sum(bucket['count'] for bucket in facets['brand']), facets
@@ -1,61 +1,230 @@
+from decimal import Decimal
+
+from django.conf import settings
+
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from .models import (
     Brand, Category, Subcategory, Product, ProductVariant, ProductImage, ProductReview, 
     Cart, CartProduct, Wishlist, Order, OrderProduct, Wallet, WalletTransaction, 
-    ProductOffer, FlashSale
+    ProductOffer, FlashSale, ProductRating, StockReservation
 )
+from .checkout import line_price
+from .pricing import variant_price
+
+
+def _query_list(request, name):
+    if request is None:
+        return set()
+    return {item.strip() for raw in request.query_params.getlist(name) for item in raw.split(',') if item.strip()}
+
+
+# Sparse fieldsets: `?fields=id,title` trims the top-level payload and
+# `?expand=product` swaps a compact nested representation for the full one
+# declared in `Meta.expandable_fields` (at any depth).
+class SparseFieldsetMixin:
+    def _is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+
+        expand = _query_list(request, 'expand')
+        for name, (serializer_class, kwargs) in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in expand:
+                fields[name] = serializer_class(**kwargs)
+
+        only = _query_list(request, 'fields')
+        if only and self._is_root():
+            fields = {name: field for name, field in fields.items() if name in only}
+        return fields
+
+
+class ModelSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    pass
+
+
+# Responsive versions of an image field (apiApp.images): the original's size
+# and a srcset per format, e.g.
+#   {"width": 2000, "height": 1500, "webp": "http://.../a-160w.webp 160w, ...", "jpeg": "..."}
+# Null until the derivatives of the current upload have been generated.
+class SrcsetField(serializers.Field):
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def _absolute(self, url):
+        # Host-relative storage URLs get the request's origin, built once.
+        if not url.startswith('/') or url.startswith('//'):
+            return url
+        if not hasattr(self, '_origin'):
+            request = self.context.get('request')
+            self._origin = request.build_absolute_uri('/')[:-1] if request is not None else ''
+        return self._origin + url
+
+    def to_representation(self, instance):
+        field_file = getattr(instance, self.image_field)
+        entry = instance.renditions.get(self.image_field)
+        if not field_file.name or not entry or entry.get('source') != field_file.name or 'derivatives' not in entry:
+            return None
+        srcsets = {}
+        for item in entry['derivatives']:
+            url = self._absolute(field_file.storage.url(item['name']))
+            srcsets.setdefault(item['format'], []).append(f"{url} {item['width']}w")
+        return {
+            'width': entry['width'], 'height': entry['height'],
+            **{fmt: ', '.join(candidates) for fmt, candidates in srcsets.items()},
+        }
 
 # ===========================
 # Core Serializers
 # ===========================
 
-class BrandSerializer(serializers.ModelSerializer):
+class BrandSerializer(ModelSerializer):
+    thumb_srcset = SrcsetField('thumb')
+    banner_srcset = SrcsetField('banner')
+
     class Meta:
         model = Brand
-        fields = '__all__'
+        exclude = ('renditions',)
+
 
+class CategorySerializer(ModelSerializer):
+    thumb_srcset = SrcsetField('thumb')
+    banner_srcset = SrcsetField('banner')
 
-class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ('renditions',)
 
 
-class SubcategorySerializer(serializers.ModelSerializer):
+class SubcategorySerializer(ModelSerializer):
+    thumb_srcset = SrcsetField('thumb')
+    banner_srcset = SrcsetField('banner')
+
     class Meta:
         model = Subcategory
-        fields = '__all__'
+        exclude = ('renditions',)
 
 
 # ===========================
 # Product and Inventory Serializers
 # ===========================
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ProductImageSerializer(ModelSerializer):
+    image_srcset = SrcsetField('image')
+
     class Meta:
         model = ProductImage
-        fields = '__all__'
+        exclude = ('renditions',)
 
 
-class ProductVariantSerializer(serializers.ModelSerializer):
+class ProductVariantSerializer(ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
+    effective_price = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductVariant
         fields = '__all__'
+        select_related = ('product__pricing',)
+
+    def get_effective_price(self, obj):
+        return str(variant_price(obj))
+
+    def update(self, instance, validated_data):
+        # Write only the columns the client sent, so saving e.g. a colour
+        # change never writes back a stale `stock` over a concurrent
+        # reservation.
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        if validated_data:
+            instance.save(update_fields=list(validated_data))
+        return instance
+
+
+class StockReservationSerializer(ModelSerializer):
+    class Meta:
+        model = StockReservation
+        exclude = ('settle_batch',)
+        read_only_fields = ('status', 'expires_at', 'created_at')
+
+
+# Inputs of the stock actions (apiApp.views), bounded so nothing
+# out of range reaches timedelta() or the database.
+MAX_BIGINT = 2**63 - 1
+MAX_STOCK = 2**31 - 1  # PositiveIntegerField
+
+
+class ReserveSerializer(serializers.Serializer):
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_STOCK, default=1)
+    hold_seconds = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_hold_seconds(self, value):
+        limit = getattr(settings, 'STOCK_HOLD_MAX_SECONDS', 86400)
+        if value > limit:
+            raise serializers.ValidationError(f'Ensure this value is less than or equal to {limit}.')
+        return value
+
 
+class RestockSerializer(serializers.Serializer):
+    delta = serializers.IntegerField(min_value=-MAX_STOCK, max_value=MAX_STOCK)
 
-class ProductSerializer(serializers.ModelSerializer):
+
+class ReleaseReservationsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1, max_value=MAX_BIGINT))
+
+
+# Approved-review aggregates (apiApp.ratings); null before a product's first review.
+class ProductRatingSerializer(ModelSerializer):
+    histogram = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProductRating
+        fields = ('count', 'average', 'histogram')
+
+    def get_histogram(self, obj):
+        return {str(star): getattr(obj, field) for star, field in enumerate(ProductRating.STAR_FIELDS, start=1)}
+
+
+class ProductSerializer(ModelSerializer):
     variants = ProductVariantSerializer(many=True, read_only=True)
+    rating = ProductRatingSerializer(read_only=True)
+    # Precomputed by apiApp.pricing from the best active offer/flash sale
+    effective_price = serializers.DecimalField(source='pricing.effective_price', max_digits=10, decimal_places=2, read_only=True)
+    discount_percentage = serializers.IntegerField(source='pricing.discount_percentage', read_only=True)
+    thumb_srcset = SrcsetField('thumb')
+    banner_srcset = SrcsetField('banner')
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ('renditions',)
+        read_only_fields = ('total_stock',)
 
 
-class ProductReviewSerializer(serializers.ModelSerializer):
-    user = serializers.StringRelatedField(read_only=True)  # Returns user's username
-    product = serializers.StringRelatedField(read_only=True)  # Returns product's title
+# Compact "card" used by product lists and wherever a product is nested.
+class ProductCardSerializer(ModelSerializer):
+    effective_price = serializers.DecimalField(source='pricing.effective_price', max_digits=10, decimal_places=2, read_only=True)
+    discount_percentage = serializers.IntegerField(source='pricing.discount_percentage', read_only=True)
+    rating = ProductRatingSerializer(read_only=True)
+    thumb_srcset = SrcsetField('thumb')
+
+    class Meta:
+        model = Product
+        fields = (
+            'id', 'title', 'slug', 'thumb', 'thumb_srcset', 'mrp', 'price', 'effective_price',
+            'discount_percentage', 'rating', 'brand', 'total_stock', 'active',
+        )
+        expandable_fields = {'variants': (ProductVariantSerializer, {'many': True, 'read_only': True})}
+
+
+class ProductReviewSerializer(ModelSerializer):
+    # Plain column reads through select_related joins (see apiApp.querysets).
+    user = serializers.CharField(source='user.username', read_only=True)
+    product = serializers.CharField(source='product.title', read_only=True)
 
     class Meta:
         model = ProductReview
@@ -66,15 +235,26 @@ class ProductReviewSerializer(serializers.ModelSerializer):
 # Cart and Wishlist Serializers
 # ===========================
 
-class CartProductSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)  # Embed product details
+class CartProductSerializer(ModelSerializer):
+    product = ProductCardSerializer(read_only=True)  # Embed product details
+    unit_price = serializers.SerializerMethodField()
+    line_total = serializers.SerializerMethodField()
 
     class Meta:
         model = CartProduct
         fields = '__all__'
+        expandable_fields = {'product': (ProductSerializer, {'read_only': True})}
+        select_related = ('variant',)
+
+    # The price checkout would charge right now
+    def get_unit_price(self, obj):
+        return str(line_price(obj))
+
+    def get_line_total(self, obj):
+        return str(line_price(obj) * obj.quantity)
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(ModelSerializer):
     products = CartProductSerializer(source='cartproduct_set', many=True, read_only=True)
 
     class Meta:
@@ -82,27 +262,29 @@ class CartSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class WishlistSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)  # Embed product details
+class WishlistSerializer(ModelSerializer):
+    product = ProductCardSerializer(read_only=True)  # Embed product details
 
     class Meta:
         model = Wishlist
         fields = '__all__'
+        expandable_fields = {'product': (ProductSerializer, {'read_only': True})}
 
 
 # ===========================
 # Order Serializers
 # ===========================
 
-class OrderProductSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)  # Embed product details
+class OrderProductSerializer(ModelSerializer):
+    product = ProductCardSerializer(read_only=True)  # Embed product details
 
     class Meta:
         model = OrderProduct
         fields = '__all__'
+        expandable_fields = {'product': (ProductSerializer, {'read_only': True})}
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(ModelSerializer):
     products = OrderProductSerializer(source='orderproduct_set', many=True, read_only=True)
 
     class Meta:
@@ -114,35 +296,56 @@ class OrderSerializer(serializers.ModelSerializer):
 # Wallet Serializers
 # ===========================
 
-class WalletTransactionSerializer(serializers.ModelSerializer):
+class WalletTransactionSerializer(ModelSerializer):
     class Meta:
         model = WalletTransaction
         fields = '__all__'
+        extra_kwargs = {'amount': {'min_value': Decimal('0.01')}}
 
 
-class WalletSerializer(serializers.ModelSerializer):
-    transactions = WalletTransactionSerializer(source='wallettransaction_set', many=True, read_only=True)
+# Wallet lists carry no history; the full history is paged from
+# /api/wallets/{id}/transactions/.
+class WalletSummarySerializer(ModelSerializer):
+    transactions_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Wallet
         fields = '__all__'
+        read_only_fields = ('balance',)  # moved only by posting transactions
+
+    def get_transactions_url(self, obj):
+        return reverse('wallet-transactions', kwargs={'pk': obj.pk}, request=self.context.get('request'))
+
+
+class WalletSerializer(WalletSummarySerializer):
+    # The newest few transactions: one LIMIT query down the (wallet,
+    # created_at, id) index, however long the history is.
+    recent_transactions = serializers.SerializerMethodField()
+
+    RECENT_TRANSACTIONS = 10
+
+    def get_recent_transactions(self, obj):
+        recent = obj.wallettransaction_set.order_by('-created_at', '-id')[:self.RECENT_TRANSACTIONS]
+        return WalletTransactionSerializer(recent, many=True, context=self.context).data
 
 
 # ===========================
 # Promotion Serializers
 # ===========================
 
-class ProductOfferSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)  # Embed product details
+class ProductOfferSerializer(ModelSerializer):
+    product = ProductCardSerializer(read_only=True)  # Embed product details
 
     class Meta:
         model = ProductOffer
         fields = '__all__'
+        expandable_fields = {'product': (ProductSerializer, {'read_only': True})}
 
 
-class FlashSaleSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)  # Embed product details
+class FlashSaleSerializer(ModelSerializer):
+    product = ProductCardSerializer(read_only=True)  # Embed product details
 
     class Meta:
         model = FlashSale
         fields = '__all__'
+        expandable_fields = {'product': (ProductSerializer, {'read_only': True})}
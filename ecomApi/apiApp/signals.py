@@ -0,0 +1,334 @@
+from collections import Counter
+
+from django.apps import apps
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .caching import bump_version, invalidate
+from .models import (
+    Brand, Category, Subcategory, Product, ProductVariant, ProductImage, ProductOffer, FlashSale,
+    ProductReview, CartProduct, OrderProduct, WalletTransaction
+)
+from .inventory import add_total_stock
+from .pricing import refresh_prices
+from .ratings import add_reviews
+from . import facets, images, storage, tasks
+
+# ===========================
+# Effective price invalidation
+# ===========================
+
+@receiver(post_save, sender=Product)
+def reprice_product(sender, instance, **kwargs):
+    refresh_prices([instance.pk])
+
+
+@receiver(post_save, sender=ProductOffer)
+@receiver(post_delete, sender=ProductOffer)
+@receiver(post_save, sender=FlashSale)
+@receiver(post_delete, sender=FlashSale)
+def reprice_promoted_product(sender, instance, **kwargs):
+    refresh_prices([instance.product_id])
+
+
+# ===========================
+# Denormalized Product.total_stock
+# ===========================
+#
+# Variant writes move their product's total_stock by the stock delta with a
+# single F() UPDATE. Deltas are taken against the stored row rather than the
+# (possibly stale) instance. Fixture loads (raw) carry their own totals.
+# `manage.py reconcile_total_stock` repairs any drift.
+
+STOCK_FIELDS = {'stock', 'product', 'product_id'}
+
+
+@receiver(pre_save, sender=ProductVariant)
+def remember_stored_stock(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._stored_stock = None
+    if raw or (update_fields is not None and not STOCK_FIELDS & set(update_fields)):
+        instance._stored_stock = False
+    elif not instance._state.adding:
+        instance._stored_stock = (
+            ProductVariant.objects.filter(pk=instance.pk).values_list('product_id', 'stock').first()
+        )
+
+
+@receiver(post_save, sender=ProductVariant)
+def add_variant_stock(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_stock', None)
+    if stored is False:
+        return
+    deltas = {instance.product_id: instance.stock}
+    if stored:
+        product_id, stock = stored
+        deltas[product_id] = deltas.get(product_id, 0) - stock
+    add_total_stock(deltas)
+
+
+@receiver(post_delete, sender=ProductVariant)
+def subtract_variant_stock(sender, instance, origin=None, **kwargs):
+    # Variants deleted along with their product have nothing left to adjust.
+    if isinstance(origin, Product) or getattr(origin, 'model', None) is Product:
+        return
+    add_total_stock({instance.product_id: -instance.stock})
+
+
+# ===========================
+# Product rating aggregates
+# ===========================
+#
+# A review contributes to its product's ProductRating while approved. Saves
+# take back the stored row's contribution and add the new one; fixture
+# loads are left to `manage.py reconcile_ratings`.
+
+@receiver(pre_save, sender=ProductReview)
+def remember_stored_review(sender, instance, raw=False, **kwargs):
+    instance._stored_review = None
+    if raw:
+        instance._stored_review = False
+    elif not instance._state.adding:
+        instance._stored_review = (
+            ProductReview.objects.filter(pk=instance.pk).values_list('product_id', 'rating', 'approved').first()
+        )
+
+
+@receiver(post_save, sender=ProductReview)
+def count_review(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_review', None)
+    if stored is False:
+        return
+    changes = []
+    if stored and stored[2]:
+        changes.append((stored[0], stored[1], -1))
+    if instance.approved:
+        changes.append((instance.product_id, instance.rating, 1))
+    if len(changes) == 2 and changes[0][:2] == changes[1][:2]:
+        return  # e.g. only the text changed
+    add_reviews(changes)
+
+
+@receiver(post_delete, sender=ProductReview)
+def uncount_review(sender, instance, origin=None, **kwargs):
+    # Reviews deleted along with their product take its rating row with them.
+    if isinstance(origin, Product) or getattr(origin, 'model', None) is Product:
+        return
+    if instance.approved:
+        add_reviews([(instance.product_id, instance.rating, -1)])
+
+
+# ===========================
+# Search index maintenance
+# ===========================
+#
+# Queued when TASKS_EAGER is off (see apiApp.tasks); index_products drops
+# deleted products, and a rename reindexes the group in worker batches.
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def index_product(sender, instance, **kwargs):
+    tasks.enqueue('search.index_products', [instance.pk])
+
+
+# Brand/category/subcategory titles are part of every product's document.
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Subcategory)
+def reindex_grouped_products(sender, instance, created, **kwargs):
+    if created:
+        return
+    field = sender._meta.model_name
+    tasks.enqueue('search.index_products', Product.objects.filter(**{field: instance}).values_list('pk', flat=True))
+
+
+# ===========================
+# Facet index invalidation
+# ===========================
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def touch_product_facets(sender, instance, **kwargs):
+    facets.touch([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def touch_variant_facets(sender, instance, **kwargs):
+    facets.touch([instance.product_id])
+
+
+# Titles are shared by many products: rebuild.
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Subcategory)
+def invalidate_facets(sender, instance, **kwargs):
+    bump_version('facets')
+
+
+# ===========================
+# Image derivatives
+# ===========================
+#
+# Uploads are resized by the background pool once the transaction that
+# stored them commits (see apiApp.images), or by a task worker when
+# TASKS_EAGER is off.
+
+def schedule_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and images.needs_rendering(instance):
+        tasks.schedule_renders(sender._meta.label, [instance.pk])
+
+
+for model in images.image_models():
+    post_save.connect(schedule_image_derivatives, sender=model, dispatch_uid=f'image_derivatives:{model._meta.label}')
+
+
+# ===========================
+# Media blob references
+# ===========================
+#
+# Rows naming a content-addressed blob count towards its MediaBlob.refs
+# (see apiApp.storage). Replaced and deleted uploads release theirs, and
+# the blob goes once nothing else names it.
+
+def remember_stored_files(sender, instance, update_fields=None, **kwargs):
+    instance._stored_files = None
+    if instance._state.adding:
+        instance._stored_files = {}
+    elif update_fields is None or set(sender.IMAGE_FIELDS) & set(update_fields):
+        row = sender.objects.filter(pk=instance.pk).values_list(*sender.IMAGE_FIELDS).first()
+        instance._stored_files = dict(zip(sender.IMAGE_FIELDS, row or ()))
+
+
+def count_file_references(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_files', None)
+    if stored is None:
+        return
+    deltas, released = Counter(), []
+    for field in sender.IMAGE_FIELDS:
+        old, new = stored.get(field) or None, getattr(instance, field).name or None
+        if old != new:
+            deltas[new] += 1
+            deltas[old] -= 1
+            released.append((field, [old]))
+    storage.add_references(deltas)
+    for field, names in released:
+        storage.release(sender._meta.get_field(field).storage, names)
+
+
+def remember_stored_renditions(sender, instance, **kwargs):
+    # Derivatives are recorded by UPDATE, so an instance loaded earlier may
+    # not know about them (cascades load fresh rows and skip the query).
+    instance._stored_renditions = instance.renditions
+    if images.needs_rendering(instance):
+        stored = sender.objects.filter(pk=instance.pk).values_list('renditions', flat=True).first()
+        instance._stored_renditions = stored if stored is not None else instance.renditions
+
+
+def release_file_references(sender, instance, **kwargs):
+    renditions = getattr(instance, '_stored_renditions', instance.renditions)
+    deltas, released = Counter(), []
+    for field in sender.IMAGE_FIELDS:
+        entry = renditions.get(field) or {}
+        names = [getattr(instance, field).name, *(item['name'] for item in entry.get('derivatives', ()))]
+        names = [name for name in names if name]
+        deltas.subtract(names)
+        released.append((field, names))
+    storage.add_references(deltas)
+    for field, names in released:
+        storage.release(sender._meta.get_field(field).storage, names)
+
+
+for model in images.image_models():
+    uid = f'media_references:{model._meta.label}'
+    pre_save.connect(remember_stored_files, sender=model, dispatch_uid=uid)
+    post_save.connect(count_file_references, sender=model, dispatch_uid=uid)
+    pre_delete.connect(remember_stored_renditions, sender=model, dispatch_uid=uid)
+    post_delete.connect(release_file_references, sender=model, dispatch_uid=uid)
+
+
+# ===========================
+# Navigation tree invalidation
+# ===========================
+#
+# The menu shows active categories/subcategories and their active product
+# counts, so product saves only matter when they change one of those.
+
+NAVIGATION_FIELDS = ('active', 'category_id', 'subcategory_id')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Subcategory)
+@receiver(post_delete, sender=Subcategory)
+def invalidate_navigation(sender, instance, **kwargs):
+    bump_version('navigation')
+
+
+@receiver(pre_save, sender=Product)
+def remember_stored_placement(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._stored_placement = None
+    if not instance._state.adding and not raw and (
+        update_fields is None or {'active', 'category', 'subcategory'} & set(update_fields)
+    ):
+        instance._stored_placement = (
+            Product.objects.filter(pk=instance.pk).values_list(*NAVIGATION_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product_navigation(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_placement', None)
+    placement = tuple(getattr(instance, field) for field in NAVIGATION_FIELDS)
+    if created or (stored is not None and stored != placement):
+        bump_version('navigation')
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product_navigation(sender, instance, **kwargs):
+    bump_version('navigation')
+
+
+# ===========================
+# Version keys (ETags / response cache)
+# ===========================
+
+def invalidate_row(sender, instance, **kwargs):
+    invalidate(sender._meta.model_name, instance.pk)
+
+
+for model in apps.get_app_config('apiApp').get_models():
+    post_save.connect(invalidate_row, sender=model, dispatch_uid=f'invalidate_row:{model._meta.label}')
+    post_delete.connect(invalidate_row, sender=model, dispatch_uid=f'invalidate_row:{model._meta.label}')
+
+
+# Child rows are rendered inside their parent's payload.
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_variant_product(sender, instance, **kwargs):
+    invalidate('product', instance.product_id)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_image_product(sender, instance, **kwargs):
+    product_id = ProductVariant.objects.filter(pk=instance.product_variant_id).values_list('product_id', flat=True).first()
+    if product_id is not None:
+        invalidate('product', product_id)
+
+
+@receiver(post_save, sender=CartProduct)
+@receiver(post_delete, sender=CartProduct)
+def invalidate_cart(sender, instance, **kwargs):
+    invalidate('cart', instance.cart_id)
+
+
+@receiver(post_save, sender=OrderProduct)
+@receiver(post_delete, sender=OrderProduct)
+def invalidate_order(sender, instance, **kwargs):
+    invalidate('order', instance.order_id)
+
+
+@receiver(post_save, sender=WalletTransaction)
+@receiver(post_delete, sender=WalletTransaction)
+def invalidate_wallet(sender, instance, **kwargs):
+    invalidate('wallet', instance.wallet_id)
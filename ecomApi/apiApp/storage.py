@@ -0,0 +1,184 @@
+import hashlib
+import os
+import re
+import time
+from collections import Counter
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .inventory import per_row
+from .models import MediaBlob
+
+# ===========================
+# Content-addressed media storage
+# ===========================
+#
+# Uploads are stored once per content: the SHA-256 of the bytes names the
+# file (`blobs/ab/cd/<digest>.jpg`), so the same product shot uploaded for
+# every size of a variant is one file on disk. Identical uploads return the
+# existing name. A blob's bytes never change under its name, so media is
+# served with immutable, year-long cache headers (views.media).
+#
+# MediaBlob.refs counts the rows naming a blob: file fields (kept by the
+# signals in apiApp.signals) and image derivatives (apiApp.images). A
+# blob's file is only deleted once nothing references it and it hasn't
+# been uploaded again for MEDIA_BLOB_GRACE seconds. The grace period covers
+# uploads whose row hasn't been saved yet. `manage.py reconcile_media`
+# recounts references and, with --collect, removes what is unreferenced.
+#
+# Names outside `blobs/` (uploads from before this storage) are served and
+# deleted as plain files and never reference-counted.
+
+DIRECTORY = 'blobs'
+BLOB_NAME = re.compile(r'blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]{1,10})?')
+CHUNK_SIZE = 1000
+
+
+def digest_of(name):
+    """The digest a blob name was stored under, or None for other names."""
+    match = BLOB_NAME.fullmatch(name or '')
+    return match and match.group(1)
+
+
+def blob_name(digest, name):
+    extension = os.path.splitext(name or '')[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', extension):
+        extension = ''
+    return f'{DIRECTORY}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def grace_cutoff():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'MEDIA_BLOB_GRACE', 3600))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        digest = sha.hexdigest()
+
+        # Touching uploaded_at first keeps a concurrent delete off the blob.
+        if MediaBlob.objects.filter(digest=digest).update(uploaded_at=timezone.now()):
+            stored = MediaBlob.objects.filter(digest=digest).values_list('name', flat=True).first()
+            if stored is not None and self.exists(stored):
+                return stored
+        target = blob_name(digest, name)
+        self._write(target, content)
+        MediaBlob.objects.bulk_create([MediaBlob(digest=digest, name=target, size=content.size)], ignore_conflicts=True)
+        stored = MediaBlob.objects.filter(digest=digest).values_list('name', flat=True).get()
+        if stored != target:
+            # An identical upload with another extension got there first.
+            if not self.exists(stored):
+                self._write(stored, content)
+            super().delete(target)
+        return stored
+
+    def _write(self, name, content):
+        # Written under a temporary name and moved into place, so a blob
+        # name never shows a partial file.
+        temporary = self._save(f'{DIRECTORY}/tmp/{os.path.basename(name)}', content)
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        os.replace(self.path(temporary), self.path(name))
+
+    def delete(self, name):
+        if digest_of(name) is None:
+            super().delete(name)
+        else:
+            self.collect(name)
+
+    def collect(self, name):
+        """Delete a blob unless it is referenced or within its grace period; True when deleted."""
+        if MediaBlob.objects.filter(digest=digest_of(name), refs__lte=0, uploaded_at__lt=grace_cutoff()).delete()[0]:
+            super().delete(name)
+            return True
+        return False
+
+
+# ---- reference counting ----
+
+def add_references(deltas):
+    """Apply `{name: delta}` to the refs of the blobs named; other names are ignored."""
+    changes = Counter()
+    for name, delta in deltas.items():
+        digest = digest_of(name)
+        if digest:
+            changes[digest] += delta
+    changes = {digest: delta for digest, delta in changes.items() if delta}
+    if changes:
+        MediaBlob.objects.filter(pk__in=changes).update(refs=F('refs') + per_row(changes))
+
+
+def release(storage, names):
+    """Delete the blobs among `names` that are no longer referenced, once the transaction commits."""
+    names = [name for name in names if digest_of(name)]
+    if names and isinstance(storage, ContentAddressedStorage):
+        transaction.on_commit(lambda: [storage.delete(name) for name in names])
+
+
+def referenced_names():
+    """Counter of every blob name in file fields and image derivatives."""
+    from .images import image_models
+
+    names = Counter()
+    for model in image_models():
+        for *files, renditions in model.objects.values_list(*model.IMAGE_FIELDS, 'renditions').iterator(chunk_size=2000):
+            names.update(name for name in files if digest_of(name))
+            names.update(
+                item['name'] for entry in renditions.values() for item in entry.get('derivatives', ())
+                if digest_of(item['name'])
+            )
+    return names
+
+
+def reconcile_media(storage, collect=False):
+    """
+    Recount MediaBlob.refs from the rows naming each blob. With `collect`,
+    also delete unreferenced blobs past the grace period and files under
+    `blobs/` that have no MediaBlob row. Returns (blobs, collected, bytes freed).
+    """
+    names = referenced_names()
+    with transaction.atomic():
+        MediaBlob.objects.exclude(refs=0).update(refs=0)
+        counts = {digest_of(name): count for name, count in names.items()}
+        items = iter(counts.items())
+        while chunk := dict(islice(items, CHUNK_SIZE)):
+            MediaBlob.objects.filter(pk__in=chunk).update(refs=per_row(chunk))
+        blobs = MediaBlob.objects.count()
+    if not collect:
+        return blobs, 0, 0
+
+    collected = freed = 0
+    unreferenced = MediaBlob.objects.filter(refs__lte=0, uploaded_at__lt=grace_cutoff()).order_by('pk')
+    # Deleted blobs drop out of the queryset, and so do any a concurrent upload revived.
+    while batch := list(unreferenced.values_list('name', 'size')[:CHUNK_SIZE]):
+        for name, size in batch:
+            if storage.collect(name):
+                collected += 1
+                freed += size
+
+    # Files left by uploads whose transaction rolled back, and stray temporaries.
+    root = storage.path(DIRECTORY)
+    cutoff = time.time() - getattr(settings, 'MEDIA_BLOB_GRACE', 3600)
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+            digest = digest_of(name)
+            if os.path.getmtime(path) >= cutoff or (digest and MediaBlob.objects.filter(pk=digest).exists()):
+                continue
+            freed += os.path.getsize(path)
+            os.remove(path)
+            collected += 1
+    return blobs, collected, freed
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import QueuedTask
+from . import images, search
+
+# ===========================
+# Background tasks
+# ===========================
+#
+# Side effects of writes go through enqueue(): search indexing and image
+# derivatives today. With TASKS_EAGER (the default, and what a deployment
+# without worker processes needs) they run in the request as before.
+# Otherwise enqueue() inserts QueuedTask rows in the writer's transaction,
+# so a task exists exactly when the write that needs it commits, and
+# `manage.py run_workers` runs them. The table is the queue; there is no broker.
+#
+# - Dedup: a payload already pending for a task isn't queued again, so a
+#   product saved ten times before a worker gets to it is indexed once.
+# - Batching: a worker claims up to `batch` due tasks of one name and hands
+#   their payloads to the handler in a single call.
+# - Retries: a failed batch runs again after TASK_RETRY_DELAY * 2**(attempts - 1)
+#   seconds and is marked failed, traceback kept, after TASK_MAX_ATTEMPTS.
+# - Claims are conditional UPDATEs, so two workers never run the same row.
+#   Rows held by a worker that died are reclaimed after TASK_LEASE seconds.
+#
+# Finished tasks are deleted.
+
+Task = namedtuple('Task', 'func batch')
+TASKS = {}
+CHUNK_SIZE = 500
+
+
+def task(name, batch=1):
+    """Register `func(payloads)` as task `name`; a worker passes it up to `batch` payloads at a time."""
+    def register(func):
+        TASKS[name] = Task(func, batch)
+        return func
+    return register
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def eager():
+    return _setting('TASKS_EAGER', True)
+
+
+def dedup_key(name, payload):
+    key = f"{name}:{json.dumps(payload, sort_keys=True, separators=(',', ':'))}"
+    if len(key) > 255:
+        key = f"{name}:{hashlib.sha256(key.encode()).hexdigest()}"
+    return key
+
+
+def enqueue(name, payloads, dedup=True):
+    """Run task `name` on `payloads` (JSON values): right away when eager, otherwise from a worker."""
+    handler = TASKS[name]
+    payloads = list(payloads)
+    if not payloads:
+        return
+    if eager():
+        handler.func(payloads)
+        return
+    QueuedTask.objects.bulk_create([
+        QueuedTask(name=name, payload=payload, dedup_key=dedup_key(name, payload) if dedup else None)
+        for payload in payloads
+    ], batch_size=CHUNK_SIZE, ignore_conflicts=True)
+
+
+# ---- workers ----
+
+def worker_name():
+    return f'{socket.gethostname()[:60]}:{os.getpid()}'
+
+
+def claim(worker):
+    """Claim the oldest due task plus due tasks of the same name, up to its batch size."""
+    now = timezone.now()
+    expired = Q(state=QueuedTask.RUNNING, claimed_at__lt=now - timedelta(seconds=_setting('TASK_LEASE', 300)))
+    max_attempts = _setting('TASK_MAX_ATTEMPTS', 5)
+    # A task that keeps taking its worker down stops being reclaimed.
+    QueuedTask.objects.filter(expired, attempts__gte=max_attempts).update(
+        state=QueuedTask.FAILED, last_error='Lease expired: the worker running it stopped.',
+    )
+    due = QueuedTask.objects.filter(Q(state=QueuedTask.PENDING, run_after__lte=now) | expired)
+
+    name = due.order_by('run_after', 'pk').values_list('name', flat=True).first()
+    if name is None:
+        return []
+    batch = TASKS[name].batch if name in TASKS else 1
+    ids = list(due.filter(name=name).order_by('run_after', 'pk').values_list('pk', flat=True)[:batch])
+    token = f'{worker}:{uuid.uuid4().hex[:12]}'
+    # Rows another worker claimed in the meantime no longer match `due`.
+    due.filter(pk__in=ids).update(
+        state=QueuedTask.RUNNING, claimed_by=token, claimed_at=now, attempts=F('attempts') + 1,
+    )
+    return list(QueuedTask.objects.filter(claimed_by=token).order_by('pk'))
+
+
+def _retry(rows, error):
+    now = timezone.now()
+    delay = _setting('TASK_RETRY_DELAY', 10)
+    claimed = QueuedTask.objects.filter(pk__in=[row.pk for row in rows], claimed_by=rows[0].claimed_by)
+    with transaction.atomic():
+        claimed.filter(attempts__gte=_setting('TASK_MAX_ATTEMPTS', 5)).update(
+            state=QueuedTask.FAILED, last_error=error,
+        )
+        retried = claimed.filter(state=QueuedTask.RUNNING)
+        # A copy queued since the claim already covers these.
+        pending = QueuedTask.objects.filter(state=QueuedTask.PENDING, dedup_key__isnull=False)
+        retried.filter(dedup_key__in=pending.values('dedup_key')).delete()
+        for attempts in {row.attempts for row in rows}:
+            retried.filter(attempts=attempts).update(
+                state=QueuedTask.PENDING, run_after=now + timedelta(seconds=delay * 2 ** (attempts - 1)),
+                claimed_by='', claimed_at=None, last_error=error,
+            )
+
+
+def run_next(worker):
+    """Claim and run one batch; returns the number of tasks it held."""
+    rows = claim(worker)
+    if not rows:
+        return 0
+    name = rows[0].name
+    try:
+        if name not in TASKS:
+            raise LookupError(f'No task registered as {name!r}')
+        TASKS[name].func([row.payload for row in rows])
+    except Exception:
+        _retry(rows, traceback.format_exc())
+    else:
+        QueuedTask.objects.filter(pk__in=[row.pk for row in rows], claimed_by=rows[0].claimed_by).delete()
+    return len(rows)
+
+
+def run_worker(stop=None, poll=1.0, once=False):
+    """
+    Run due tasks until `stop` (a threading.Event) is set or, with `once`,
+    until none are due. Returns the number of tasks run.
+    """
+    worker, count = worker_name(), 0
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        try:
+            ran = run_next(worker)
+        except DatabaseError:
+            # e.g. SQLite's "database is locked" while another process writes.
+            if once:
+                raise
+            ran = 0
+        count += ran
+        if not ran:
+            if once:
+                break
+            if stop is not None:
+                stop.wait(poll)
+            else:
+                time.sleep(poll)
+    return count
+
+
+def _serve(poll):
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    run_worker(stop, poll)
+
+
+def serve(processes=1, poll=1.0):
+    """
+    Run `processes` worker processes until SIGINT/SIGTERM. Each finishes
+    the batch it is running before it exits; dead workers are replaced.
+    """
+    if processes <= 1:
+        _serve(poll)
+        return
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    # Forked workers must open their own database connections.
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    workers = []
+    while not stop.is_set():
+        workers = [worker for worker in workers if worker.is_alive()]
+        while len(workers) < processes:
+            worker = context.Process(target=_serve, args=(poll,), daemon=True)
+            worker.start()
+            workers.append(worker)
+        stop.wait(1)
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+
+
+# ---- tasks ----
+
+@task('search.index_products', batch=CHUNK_SIZE)
+def index_products(product_ids):
+    search.index_products(product_ids)
+
+
+@task('images.render')
+def render_images(payloads):
+    for model_label, pk in payloads:
+        images.process(model_label, pk)
+
+
+def schedule_renders(model_label, pks):
+    """Render derivatives of `pks`: on the image pool once the write commits when eager, otherwise as tasks."""
+    pks = list(pks)
+    if not pks:
+        return
+    if eager():
+        def submit():
+            for pk in pks:
+                images.schedule(model_label, pk)
+        transaction.on_commit(submit)
+    else:
+        enqueue('images.render', [[model_label, pk] for pk in pks])
@@ -1,3 +1,1692 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from .models import (
+    Brand, Category, Subcategory, Product, ProductVariant, ProductImage,
+    Cart, CartProduct, Wishlist, Order, OrderProduct, Wallet, WalletTransaction,
+    ProductOffer, FlashSale, ProductReview, ProductPrice, ProductRating, StockReservation, WalletSnapshot, MediaBlob,
+    QueuedTask,
+)
+from . import caching, facets, identifiers, images, inventory, ledger, search, tasks
+from .compiled import compile_serializer
+from .ingest import ingest_products
+from .pricing import refresh_expired_prices
+from .querysets import eager_load
+from .serializers import FlashSaleSerializer, ProductCardSerializer, ProductOfferSerializer
+from .urls import router
+
+User = get_user_model()
+
+
+class CatalogFixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='secret')
+        cls.brand = Brand.objects.create(title='Acme')
+        cls.category = Category.objects.create(title='Shoes')
+        cls.subcategory = Subcategory.objects.create(title='Sneakers', category=cls.category)
+
+    @classmethod
+    def make_product(cls, n, variants=2, images=2, **kwargs):
+        fields = dict(
+            title=f'Product {n}', mrp=120, price=100, cost_price=60,
+            brand=cls.brand, category=cls.category, subcategory=cls.subcategory,
+        )
+        fields.update(kwargs)
+        product = Product.objects.create(**fields)
+        for v in range(variants):
+            variant = ProductVariant.objects.create(product=product, color=f'c{v}', size=f's{v}', stock=5)
+            for i in range(images):
+                ProductImage.objects.create(product_variant=variant, image=f'product_variant_images/{n}-{v}-{i}.png')
+        return product
+
+
+# ===========================
+# Eager loading
+# ===========================
+
+class EagerLoadingTests(CatalogFixtureMixin, APITestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_product_list_query_count_is_constant(self):
+        self.make_product(0)
+        urls = ('/api/products/', '/api/products/?expand=variants')
+        baselines = [self.count_queries(url) for url in urls]
+        for n in range(1, 10):
+            self.make_product(n)
+        self.assertEqual([self.count_queries(url) for url in urls], baselines)
+        # expired-price probe, products (+ pricing join), then variants and images
+        self.assertEqual(baselines, [2, 4])
+
+    def test_nested_product_payloads_query_count_is_constant(self):
+        cart = Cart.objects.create(user=self.user)
+        order = Order.objects.create(user=self.user, status='placed')
+        CartProduct.objects.create(cart=cart, product=self.make_product(0), quantity=1)
+        OrderProduct.objects.create(order=order, product=self.make_product(1), quantity=1)
+        baselines = {url: self.count_queries(url) for url in ('/api/carts/', '/api/orders/?expand=product')}
+
+        for n in range(2, 8):
+            CartProduct.objects.create(cart=cart, product=self.make_product(n), quantity=1)
+            OrderProduct.objects.create(order=order, product=self.make_product(n + 10), quantity=1)
+        for url, baseline in baselines.items():
+            self.assertEqual(self.count_queries(url), baseline, url)
+
+
+# ===========================
+# Keyset pagination
+# ===========================
+
+class KeysetPaginationTests(CatalogFixtureMixin, APITestCase):
+    def walk(self, url, key):
+        pages, seen = 0, []
+        with CaptureQueriesContext(connection) as ctx:
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                seen.extend(row['id'] for row in response.data['results'])
+                url = response.data[key]
+                pages += 1
+        for query in ctx.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'].upper())
+        return pages, seen
+
+    def test_orders_page_forward_and_back_on_order_date_and_id(self):
+        orders = [Order.objects.create(user=self.user, status='placed') for _ in range(7)]
+        # Force ties on order_date so the id tie-breaker is exercised.
+        Order.objects.filter(pk__in=[o.pk for o in orders[:4]]).update(order_date=orders[0].order_date)
+        expected = list(Order.objects.order_by('-order_date', '-id').values_list('id', flat=True))
+
+        pages, seen = self.walk('/api/orders/?page_size=2', 'next')
+        self.assertEqual((pages, seen), (4, expected))
+
+        last = self.client.get('/api/orders/?page_size=2')
+        while last.data['next']:
+            last = self.client.get(last.data['next'])
+        _, back = self.walk(last.data['previous'], 'previous')
+        self.assertEqual(back, [i for chunk in [expected[4:6], expected[2:4], expected[0:2]] for i in chunk])
+
+    def test_wallet_transactions_are_paginated(self):
+        wallet = Wallet.objects.create(user=self.user)
+        for n in range(5):
+            WalletTransaction.objects.create(wallet=wallet, amount=n, transaction_type='Deposit')
+        response = self.client.get('/api/wallet-transactions/?page_size=3')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNone(response.data['previous'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get('/api/products/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_must_parse_as_their_columns(self):
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps({'p': position, 'r': 0}).encode()).decode()
+
+        for url, position in [
+            ('/api/products/', ['abc']),
+            ('/api/products/', [{'id': 1}]),
+            ('/api/products/', [None]),
+            ('/api/orders/', ['notadate', 1]),
+            ('/api/orders/', [{}, 1]),
+        ]:
+            with self.subTest(url=url, position=position):
+                self.assertEqual(self.client.get(url, {'cursor': cursor(position)}).status_code, 404)
+        self.assertEqual(self.client.get('/api/products/', {'cursor': cursor(['12'])}).status_code, 200)
+
+
+# ===========================
+# Streaming lists
+# ===========================
+
+class StreamingListTests(CatalogFixtureMixin, APITestCase):
+    def stream(self, url, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, **headers)
+            self.assertTrue(response.streaming)
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return response, [json.loads(line) for line in body.splitlines()], len(ctx.captured_queries)
+
+    def test_variants_stream_every_row_with_a_fixed_number_of_queries(self):
+        for n in range(3):
+            self.make_product(n)
+        _, rows, queries = self.stream('/api/product-variants/?stream=1')
+        paged = self.client.get('/api/product-variants/?page_size=200').json()['results']
+        self.assertEqual(rows, paged)
+
+        for n in range(3, 9):
+            self.make_product(n)
+        _, rows, more_queries = self.stream('/api/product-variants/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual((len(rows), more_queries), (18, queries))
+
+        _, rows, _ = self.stream('/api/product-variants/?stream=1&color=c1')
+        self.assertEqual({row['color'] for row in rows}, {'c1'})
+
+    def test_orders_stream_in_keyset_order_with_their_own_etag(self):
+        orders = [Order.objects.create(user=self.user, status='placed') for _ in range(4)]
+        OrderProduct.objects.create(order=orders[0], product=self.make_product(0), quantity=2)
+        response, rows, _ = self.stream('/api/orders/?stream=true')
+        self.assertEqual([row['id'] for row in rows], [o.pk for o in reversed(orders)])
+        self.assertEqual(rows[-1]['products'][0]['quantity'], 2)
+
+        json_etag = self.client.get('/api/orders/')['ETag']
+        self.assertNotEqual(response['ETag'], json_etag)
+        cached = self.client.get('/api/orders/?stream=true', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+
+# ===========================
+# Indexes
+# ===========================
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is checked in SQLite format')
+class IndexUsageTests(TestCase):
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan)
+
+    def test_hot_lookup_paths_use_their_indexes(self):
+        now = timezone.now()
+        cases = [
+            (Product.objects.filter(active=True, category_id=1), 'product_active_category_idx'),
+            (Product.objects.filter(active=True, subcategory_id=1), 'product_active_subcat_idx'),
+            (Product.objects.filter(active=True, brand_id=1), 'product_active_brand_idx'),
+            (ProductOffer.objects.filter(start_date__lte=now, end_date__gte=now), 'offer_window_idx'),
+            (ProductOffer.objects.filter(product_id=1, start_date__lte=now, end_date__gte=now), 'offer_product_window_idx'),
+            (FlashSale.objects.filter(start_date__lte=now, end_date__gte=now), 'flashsale_window_idx'),
+            (FlashSale.objects.filter(product_id=1, end_date__gte=now), 'flashsale_product_window_idx'),
+            (Order.objects.filter(user_id=1).order_by('-order_date', '-id'), 'order_user_date_idx'),
+            (Order.objects.order_by('-order_date', '-id')[:50], 'order_date_idx'),
+            (WalletTransaction.objects.filter(wallet_id=1).order_by('-created_at', '-id'), 'wallettxn_wallet_created_idx'),
+            (WalletTransaction.objects.order_by('-created_at', '-id')[:50], 'wallettxn_created_idx'),
+            (ProductReview.objects.filter(product_id=1, approved=True), 'review_product_approved_idx'),
+        ]
+        for queryset, index_name in cases:
+            with self.subTest(index_name):
+                self.assertUsesIndex(queryset, index_name)
+
+
+# ===========================
+# Effective prices
+# ===========================
+
+class PricingTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.product = self.make_product(0, variants=1, images=0)
+
+    def pricing(self):
+        return ProductPrice.objects.get(product=self.product)
+
+    def test_best_active_promotion_wins(self):
+        self.assertEqual(self.pricing().effective_price, Decimal('100.00'))
+        ProductOffer.objects.create(product=self.product, discount_percentage=10,
+                                    start_date=self.now - timedelta(hours=1), end_date=self.now + timedelta(hours=1))
+        FlashSale.objects.create(product=self.product, discount_percentage=25,
+                                 start_date=self.now - timedelta(hours=1), end_date=self.now + timedelta(minutes=5))
+        # Not started yet
+        ProductOffer.objects.create(product=self.product, discount_percentage=50,
+                                    start_date=self.now + timedelta(minutes=2), end_date=self.now + timedelta(hours=2))
+        pricing = self.pricing()
+        self.assertEqual((pricing.discount_percentage, pricing.effective_price), (25, Decimal('75.00')))
+        self.assertEqual(pricing.valid_until, self.now + timedelta(minutes=2))
+
+    def test_rows_are_refreshed_when_a_window_opens_or_closes(self):
+        ProductOffer.objects.create(product=self.product, discount_percentage=20,
+                                    start_date=self.now + timedelta(minutes=1), end_date=self.now + timedelta(minutes=10))
+        self.assertEqual(self.pricing().effective_price, Decimal('100.00'))
+
+        self.assertEqual(refresh_expired_prices(at=self.now + timedelta(minutes=5)), 1)
+        self.assertEqual(self.pricing().effective_price, Decimal('80.00'))
+        self.assertEqual(refresh_expired_prices(at=self.now + timedelta(minutes=6)), 0)
+
+        refresh_expired_prices(at=self.now + timedelta(minutes=10))
+        pricing = self.pricing()
+        self.assertEqual((pricing.effective_price, pricing.valid_until), (Decimal('100.00'), None))
+
+    def test_migration_backfills_existing_products(self):
+        from django.apps import apps
+        migration = import_module('apiApp.migrations.0006_productprice')
+
+        FlashSale.objects.create(product=self.product, discount_percentage=30,
+                                 start_date=self.now - timedelta(hours=1), end_date=self.now + timedelta(hours=1))
+        before = self.pricing()
+        ProductPrice.objects.all().delete()
+        migration.backfill_prices(apps, None)
+        pricing = self.pricing()
+        self.assertEqual(
+            (pricing.discount_percentage, pricing.effective_price, pricing.valid_until),
+            (before.discount_percentage, before.effective_price, before.valid_until),
+        )
+
+    def test_product_and_cart_payloads_expose_effective_prices(self):
+        FlashSale.objects.create(product=self.product, discount_percentage=10,
+                                 start_date=self.now - timedelta(hours=1), end_date=self.now + timedelta(hours=1))
+        self.product.variants.update(additional_price=20)
+        cart = Cart.objects.create(user=self.user)
+        CartProduct.objects.create(cart=cart, product=self.product, quantity=3)
+
+        product = self.client.get(f'/api/products/{self.product.pk}/').json()
+        self.assertEqual(product['effective_price'], '90.00')
+        self.assertEqual(product['variants'][0]['effective_price'], '108.00')
+
+        line = self.client.get(f'/api/carts/{cart.pk}/').data['products'][0]
+        self.assertEqual((line['unit_price'], line['line_total']), ('90.00', '270.00'))
+
+
+# ===========================
+# Search
+# ===========================
+
+@skipUnless(connection.vendor == 'sqlite', 'Search is backed by SQLite FTS5')
+class ProductSearchTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.other_brand = Brand.objects.create(title='Zenith')
+        self.runner = self.make_product(0, variants=0, title='Trail Runner', meta_keywords='running shoe')
+        self.court = self.make_product(1, variants=0, title='Court Classic', description='A runner-up design')
+        self.boot = self.make_product(2, variants=0, title='Winter Boot', brand=self.other_brand)
+
+    def get(self, **params):
+        response = self.client.get('/api/products/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_prefix_match_ranks_title_hits_first(self):
+        data = self.get(q='runn')
+        self.assertEqual([p['id'] for p in data['results']], [self.runner.pk, self.court.pk])
+        self.assertEqual(data['count'], 2)
+
+    def test_brand_and_category_titles_are_searchable_with_facets(self):
+        data = self.get(q='sneak')
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['facets']['brand'], [
+            {'id': self.brand.pk, 'title': 'Acme', 'count': 2},
+            {'id': self.other_brand.pk, 'title': 'Zenith', 'count': 1},
+        ])
+        filtered = self.get(q='sneak', brand=self.other_brand.pk)
+        self.assertEqual([p['id'] for p in filtered['results']], [self.boot.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.boot.title = 'Winter Runner'
+        self.boot.save()
+        self.assertEqual(self.get(q='runner')['count'], 3)
+
+        self.boot.active = False
+        self.boot.save()
+        self.court.delete()
+        self.assertEqual([p['id'] for p in self.get(q='runner')['results']], [self.runner.pk])
+
+        self.brand.title = 'Apex'
+        self.brand.save()
+        self.assertEqual([p['id'] for p in self.get(q='apex')['results']], [self.runner.pk])
+
+    def test_blank_query_returns_nothing(self):
+        self.assertEqual(self.get(q='  ')['results'], [])
+
+    def test_facet_ids_and_limit_are_bounded(self):
+        for params in ({'brand': '9' * 23}, {'category': '0'}, {'subcategory': 'x'}, {'limit': 'ten'}):
+            with self.subTest(params):
+                response = self.client.get('/api/products/search/', {'q': 'runn', **params})
+                self.assertEqual(response.status_code, 400)
+        with mock.patch.object(search, 'search', wraps=search.search) as searched:
+            self.get(q='runn', limit=10**30)
+        self.assertEqual(searched.call_args.args[2], search.MAX_RESULTS)
+
+    def test_other_databases_fall_back_to_icontains(self):
+        with mock.patch.object(search, 'is_supported', return_value=False):
+            data = self.get(q='runn')
+            self.assertEqual([p['id'] for p in data['results']], [self.court.pk, self.runner.pk])
+            self.assertEqual(data['count'], 2)
+            self.assertEqual(data['facets']['brand'], [{'id': self.brand.pk, 'title': 'Acme', 'count': 2}])
+            self.assertEqual([p['id'] for p in self.get(q='sneak', brand=self.other_brand.pk)['results']], [self.boot.pk])
+
+
+# ===========================
+# Faceted browsing
+# ===========================
+
+class FacetedBrowseTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.zenith = Brand.objects.create(title='Zenith')
+        self.cheap = self.make_product(0, variants=0, price=50)
+        self.mid = self.make_product(1, variants=0, price=700, brand=self.zenith)
+        self.pricey = self.make_product(2, variants=0, price=3000)
+        ProductVariant.objects.create(product=self.cheap, color='red', size='M')
+        ProductVariant.objects.create(product=self.mid, color='red', size='L')
+        ProductVariant.objects.create(product=self.pricey, color='blue', size='M')
+
+    def browse(self, query=''):
+        response = self.client.get(f'/api/products/browse/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def counts(self, data, facet):
+        return {bucket.get('title', bucket.get('value')): bucket['count'] for bucket in data['facets'][facet]}
+
+    def test_combined_filters_and_disjunctive_counts(self):
+        data = self.browse('color=red&size=M')
+        self.assertEqual([p['id'] for p in data['results']], [self.cheap.pk])
+        # Counts for a facet ignore that facet's own selection.
+        self.assertEqual(self.counts(data, 'color'), {'red': 1, 'blue': 1})
+        self.assertEqual(self.counts(data, 'size'), {'M': 1, 'L': 1})
+        self.assertEqual(self.counts(data, 'brand'), {'Acme': 1})
+
+        data = self.browse(f'brand={self.brand.pk},{self.zenith.pk}&price_min=100')
+        self.assertEqual([p['id'] for p in data['results']], [self.pricey.pk, self.mid.pk])
+        self.assertEqual([b['count'] for b in data['facets']['price']][:4], [1, 1, 0, 1])
+
+    def test_non_finite_prices_are_rejected(self):
+        for query in ('price_min=NaN', 'price_max=Infinity', 'price_min=-inf', 'price_max=sNaN', 'price_min=cheap'):
+            with self.subTest(query):
+                self.assertEqual(self.client.get(f'/api/products/browse/?{query}').status_code, 400)
+
+    def test_pages_newest_first_and_follows_writes(self):
+        first = self.browse('page_size=2')
+        self.assertEqual([p['id'] for p in first['results']], [self.pricey.pk, self.mid.pk])
+        second = self.client.get(first['next']).data
+        self.assertEqual([p['id'] for p in second['results']], [self.cheap.pk])
+        self.assertIsNone(second['next'])
+
+        self.mid.active = False
+        self.mid.save()
+        self.make_product(3, variants=0)
+        self.assertEqual(self.browse()['count'], 3)
+        self.assertEqual(self.counts(self.browse(), 'brand'), {'Acme': 3})
+
+    def test_product_writes_patch_the_index_instead_of_rebuilding(self):
+        self.browse()
+        now = timezone.now()
+        with mock.patch.object(facets, 'build_index', wraps=facets.build_index) as build:
+            self.pricey.active = False
+            self.pricey.save()
+            self.make_product(3, variants=1, images=0, price=700)
+            ProductVariant.objects.create(product=self.cheap, color='green', size='S')
+            FlashSale.objects.create(product=self.mid, discount_percentage=50,
+                                     start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1))
+            data = self.browse('page_size=2')
+            build.assert_not_called()
+
+            index, fresh = facets.get_index(), facets.build_index()
+            self.assertEqual(data['facets'], fresh.counts({}))
+            self.assertEqual(index.ids_after(index.all), fresh.ids_after(fresh.all))
+            self.assertEqual(self.counts(self.browse('price_max=400'), 'color'), {'red': 2, 'green': 1})
+
+            self.zenith.title = 'Zenit'
+            self.zenith.save()
+            self.assertEqual(self.counts(self.browse(), 'brand'), {'Acme': 2, 'Zenit': 1})
+        self.assertEqual(build.call_count, 2)
+
+    def test_product_variants_filter_by_color_and_size(self):
+        response = self.client.get('/api/product-variants/?color=red&size=L,XL')
+        self.assertEqual([v['product'] for v in response.data['results']], [self.mid.pk])
+        response = self.client.get(f'/api/product-variants/?product={self.cheap.pk},{self.mid.pk}&color=red')
+        self.assertEqual(len(response.data['results']), 2)
+        for product in ('abc', '0', str(2**63)):
+            with self.subTest(product):
+                self.assertEqual(self.client.get(f'/api/product-variants/?product={product}').status_code, 400)
+
+
+# ===========================
+# Sparse fieldsets
+# ===========================
+
+class SparseFieldsetTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.product = self.make_product(0)
+        self.cart = Cart.objects.create(user=self.user)
+        CartProduct.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+    def test_lists_and_nested_products_render_cards(self):
+        card = self.client.get('/api/products/').json()['results'][0]
+        self.assertNotIn('variants', card)
+        self.assertEqual(card['effective_price'], '100.00')
+        line = self.client.get(f'/api/carts/{self.cart.pk}/').data['products'][0]
+        self.assertEqual(set(line['product']), set(card))
+
+        full = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertIn('variants', full.json())
+        self.assertLess(len(self.client.get('/api/products/').content), len(full.content))
+
+    def test_expand_swaps_in_full_representation(self):
+        card = self.client.get('/api/products/?expand=variants').json()['results'][0]
+        self.assertEqual(len(card['variants']), 2)
+        line = self.client.get(f'/api/carts/{self.cart.pk}/?expand=product').data['products'][0]
+        self.assertIn('description', line['product'])
+
+    def test_fields_trims_top_level_payload(self):
+        data = self.client.get('/api/products/?fields=id,title').json()['results']
+        self.assertEqual(data, [{'id': self.product.pk, 'title': 'Product 0'}])
+        cart = self.client.get(f'/api/carts/{self.cart.pk}/?fields=id,products').data
+        self.assertEqual(set(cart), {'id', 'products'})
+        self.assertIn('quantity', cart['products'][0])
+
+
+# ===========================
+# Compiled serializers
+# ===========================
+
+class CompiledSerializerParityTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        now = timezone.now()
+        products = [self.make_product(n, thumb=f'product_thumbnails/{n}.png' if n else None) for n in range(3)]
+        ProductOffer.objects.create(product=products[0], discount_percentage=15,
+                                    start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+        FlashSale.objects.create(product=products[1], discount_percentage=30,
+                                 start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+        ProductReview.objects.create(product=products[0], user=self.user, rating=4, review='Nice', approved=True)
+        cart = Cart.objects.create(user=self.user)
+        order = Order.objects.create(user=self.user, status='placed')
+        wallet = Wallet.objects.create(user=self.user, balance='12.50')
+        for product in products:
+            CartProduct.objects.create(cart=cart, product=product, quantity=2)
+            OrderProduct.objects.create(order=order, product=product, quantity=1)
+            Wishlist.objects.create(user=self.user, product=product)
+        WalletTransaction.objects.create(wallet=wallet, amount='12.50', transaction_type='Deposit')
+        # Names the URL fast path must hand back to DRF
+        variant = products[0].variants.first()
+        for name in ('product_variant_images/été photo.png', 'product_variant_images/../x.png', '/abs.png'):
+            ProductImage.objects.create(product_variant=variant, image=name)
+
+    def assertParity(self, serializer_class, queryset, path):
+        request = Request(APIRequestFactory().get(path))
+        serializer = serializer_class(eager_load(queryset, serializer_class(context={'request': request})),
+                                      many=True, context={'request': request})
+        compiled = compile_serializer(serializer_class(many=True, context={'request': request}))
+        expected = JSONRenderer().render(serializer.data)
+        self.assertEqual(JSONRenderer().render(compiled(serializer.instance)), expected)
+
+    def test_every_registered_serializer_renders_identically(self):
+        for prefix, viewset, _ in router.registry:
+            for query in ('', '?expand=product,variants', '?fields=id,product,products'):
+                with self.subTest(prefix=prefix, query=query):
+                    self.assertParity(viewset.serializer_class, viewset.queryset.all(), f'/api/{prefix}/{query}')
+        self.assertParity(ProductCardSerializer, Product.objects.all(), '/api/products/')
+
+    def test_list_endpoints_match_detail_rendering(self):
+        listed = self.client.get('/api/products/?expand=variants').json()['results']
+        for row in listed:
+            detail = self.client.get(f"/api/products/{row['id']}/?expand=variants&fields={','.join(row)}").json()
+            self.assertEqual(row, detail)
+
+
+# ===========================
+# Response cache
+# ===========================
+
+class ResponseCacheTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = self.make_product(0)
+        self.other = self.make_product(1)
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, headers=headers)
+        return response, len(ctx.captured_queries)
+
+    def test_versions_are_bumped_again_on_commit(self):
+        key = f'product:{self.product.pk}'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Renamed'
+            self.product.save()
+            # What a concurrent reader could have cached pre-commit rows under.
+            during = caching.get_version(key)
+        self.assertNotEqual(caching.get_version(key), during)
+
+    def test_versions_are_shared_between_processes(self):
+        before = caching.get_version('shared')
+        subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c', "from apiApp import caching; caching.bump_version('shared')"],
+            cwd=settings.BASE_DIR, check=True, capture_output=True,
+        )
+        self.assertNotEqual(caching.get_version('shared'), before)
+
+    def assertServedFromCache(self, url):
+        response, queries = self.get(url)
+        self.assertEqual((response['X-Cache'], queries), ('HIT', 1))  # only the expired-price probe
+        return response
+
+    def test_hits_skip_the_database_and_honour_validators(self):
+        url = f'/api/products/{self.product.pk}/'
+        first, _ = self.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.assertServedFromCache(url)
+        self.assertEqual((second.content, second['ETag']), (first.content, first['ETag']))
+
+        not_modified, _ = self.get(url, if_none_match=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        not_modified, _ = self.get(url, if_modified_since=first['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        response, queries = self.get('/api/brands/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(self.get('/api/brands/')[1], 0)
+
+    def test_variant_and_image_changes_invalidate_only_their_product(self):
+        urls = [f'/api/products/{self.product.pk}/', f'/api/products/{self.other.pk}/', '/api/products/']
+        for url in urls:
+            self.get(url)
+
+        image = ProductImage.objects.filter(product_variant__product=self.product).first()
+        image.image = 'product_variant_images/replaced.png'
+        image.save()
+        response, _ = self.get(urls[0])
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(b'replaced.png', response.content)
+        self.assertServedFromCache(urls[1])
+        self.assertEqual(self.get(urls[2])[0]['X-Cache'], 'MISS')
+
+        self.product.variants.first().delete()
+        self.assertEqual(len(self.get(urls[0])[0].json()['variants']), 1)
+        self.assertServedFromCache(urls[1])
+
+    def test_promotion_changes_invalidate_product_pages(self):
+        url = f'/api/products/{self.product.pk}/'
+        self.get(url)
+        now = timezone.now()
+        FlashSale.objects.create(product=self.product, discount_percentage=50,
+                                 start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1))
+        self.assertEqual(self.get(url)[0].json()['effective_price'], '50.00')
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.mkdtemp(prefix='apiApp-cache-'),
+    }})
+    def test_file_based_backend(self):
+        cache.clear()
+        url = f'/api/products/{self.product.pk}/'
+        self.assertEqual(self.get(url)[0]['X-Cache'], 'MISS')
+        self.assertServedFromCache(url)
+        self.product.title = 'Renamed'
+        self.product.save()
+        self.assertEqual(self.get(url)[0].json()['title'], 'Renamed')
+
+
+# ===========================
+# Conditional GET
+# ===========================
+
+class ConditionalGetTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.product = self.make_product(0, variants=1, images=0)
+        self.cart = Cart.objects.create(user=self.user)
+        self.line = CartProduct.objects.create(cart=self.cart, product=self.product, quantity=1)
+        self.wallet = Wallet.objects.create(user=self.user)
+
+    def revalidate(self, url, etag):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, headers={'if-none-match': etag})
+        return response.status_code, len(ctx.captured_queries)
+
+    def test_matching_etag_skips_queries_and_serialization(self):
+        for url, queries in ((f'/api/carts/{self.cart.pk}/', 1), ('/api/carts/', 1), (f'/api/wallets/{self.wallet.pk}/', 0)):
+            with self.subTest(url):
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.revalidate(url, etag), (304, queries))
+                self.assertEqual(self.revalidate(url + '?fields=id', etag)[0], 200)
+
+    def test_writes_to_embedded_rows_change_the_etag(self):
+        cart_url, wallet_url = f'/api/carts/{self.cart.pk}/', f'/api/wallets/{self.wallet.pk}/'
+        etag = self.client.get(cart_url)['ETag']
+        self.line.quantity = 3
+        self.line.save()
+        self.assertEqual(self.revalidate(cart_url, etag)[0], 200)
+
+        etag = self.client.get(cart_url)['ETag']
+        self.product.title = 'Renamed'
+        self.product.save()
+        self.assertEqual(self.revalidate(cart_url, etag)[0], 200)
+
+        etag = self.client.get(wallet_url)['ETag']
+        WalletTransaction.objects.create(wallet=self.wallet, amount=5, transaction_type='Deposit')
+        self.assertEqual(self.revalidate(wallet_url, etag)[0], 200)
+
+    def test_non_canonical_lookups_share_the_row_version(self):
+        url = f'/api/products/0{self.product.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.product.title = 'Renamed'
+        self.product.save()
+        self.assertEqual(self.revalidate(url, etag)[0], 200)
+        self.assertEqual(self.client.get('/api/products/abc/').status_code, 404)
+
+    def test_other_rows_keep_their_etag(self):
+        other = Cart.objects.create(user=User.objects.create_user(username='other'))
+        url = f'/api/carts/{other.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.line.quantity = 5
+        self.line.save()
+        self.assertEqual(self.revalidate(url, etag)[0], 304)
+
+
+class StockReservationTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.variant = self.make_product(0, variants=1, images=0).variants.get()
+        self.variant.stock = 5
+        self.variant.save()
+
+    def stock(self):
+        return ProductVariant.objects.values_list('stock', flat=True).get(pk=self.variant.pk)
+
+    def test_reserve_takes_stock_and_refuses_to_oversell(self):
+        url = f'/api/product-variants/{self.variant.pk}/reserve/'
+        response = self.client.post(url, {'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], StockReservation.HELD)
+        self.assertEqual(self.client.post(url, {'quantity': 3}, format='json').status_code, 409)
+        self.assertEqual(self.stock(), 2)
+
+    def test_release_and_consume_settle_each_hold_once(self):
+        held = inventory.reserve(self.variant.pk, 2)
+        sold = inventory.reserve(self.variant.pk, 1)
+        self.assertEqual(self.client.post(f'/api/stock-reservations/{held.pk}/release/').data, {'released': 1})
+        self.assertEqual(inventory.consume([sold.pk, held.pk]), 1)
+        self.assertEqual(self.client.post('/api/stock-reservations/release/', {'ids': [held.pk, sold.pk]}, format='json').data,
+                         {'released': 0})
+        self.assertEqual(self.stock(), 4)
+
+    def test_stock_action_inputs_are_bounded(self):
+        reserve = f'/api/product-variants/{self.variant.pk}/reserve/'
+        restock = f'/api/product-variants/{self.variant.pk}/restock/'
+        for url, body in [
+            (reserve, {'quantity': 1, 'hold_seconds': -60}),
+            (reserve, {'quantity': 1, 'hold_seconds': 10**20}),
+            (reserve, {'quantity': 10**20}),
+            (restock, {'delta': 10**20}),
+            (restock, {}),
+            ('/api/stock-reservations/release/', {'ids': [10**20]}),
+            ('/api/stock-reservations/release/', {'ids': 'all'}),
+        ]:
+            self.assertEqual(self.client.post(url, body, format='json').status_code, 400, body)
+        self.assertEqual(self.stock(), 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_settling_changes_the_reservation_etag(self):
+        held = inventory.reserve(self.variant.pk, 2)
+        url = f'/api/stock-reservations/{held.pk}/'
+        detail, listing = self.client.get(url), self.client.get('/api/stock-reservations/')
+        self.client.post(f'{url}release/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual((response.status_code, response.data['status']), (200, StockReservation.RELEASED))
+        self.assertEqual(self.client.get('/api/stock-reservations/', HTTP_IF_NONE_MATCH=listing['ETag']).status_code, 200)
+
+    def test_expired_holds_are_released_in_batches(self):
+        past = timezone.now() - timedelta(hours=1)
+        for _ in range(5):
+            inventory.reserve(self.variant.pk, 1, hold=timedelta(minutes=1), at=past)
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(inventory.release_expired(batch_size=2), 5)
+        self.assertEqual(self.stock(), 5)
+        self.assertFalse(StockReservation.objects.filter(status=StockReservation.HELD).exists())
+
+    def test_out_of_stock_reserve_reclaims_expired_holds(self):
+        inventory.reserve(self.variant.pk, 5, hold=timedelta(minutes=1), at=timezone.now() - timedelta(hours=1))
+        inventory.reserve(self.variant.pk, 4)
+        self.assertEqual(self.stock(), 1)
+
+    def test_variant_updates_do_not_overwrite_stock(self):
+        stale = ProductVariant.objects.get(pk=self.variant.pk)
+        inventory.reserve(self.variant.pk, 2)
+        response = self.client.patch(f'/api/product-variants/{stale.pk}/', {'color': 'teal'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), 3)
+
+    def test_restock_is_atomic_and_bounded(self):
+        url = f'/api/product-variants/{self.variant.pk}/restock/'
+        self.assertEqual(self.client.post(url, {'delta': 4}, format='json').data['stock'], 9)
+        self.assertEqual(self.client.post(url, {'delta': -10}, format='json').status_code, 409)
+        self.assertEqual(self.stock(), 9)
+
+
+class TotalStockTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.product = self.make_product(0, variants=2, images=0)
+        self.other = self.make_product(1, variants=0, images=0)
+
+    def total(self, product):
+        return Product.objects.values_list('total_stock', flat=True).get(pk=product.pk)
+
+    def test_variant_writes_move_total_stock(self):
+        self.assertEqual(self.total(self.product), 10)
+        variant = self.product.variants.first()
+        variant.stock = 8
+        variant.save()
+        self.assertEqual(self.total(self.product), 13)
+
+        variant.product = self.other
+        variant.save()
+        self.assertEqual((self.total(self.product), self.total(self.other)), (5, 8))
+
+        variant.delete()
+        self.assertEqual(self.total(self.other), 0)
+
+    def test_stale_instances_and_reservations_keep_totals_exact(self):
+        stale = self.product.variants.first()
+        inventory.reserve(stale.pk, 3)
+        self.assertEqual(self.total(self.product), 7)
+        stale.stock = 4  # stored row holds 2, not the 5 this instance loaded
+        stale.save()
+        self.assertEqual(self.total(self.product), 9)
+
+        self.product.title = 'Renamed'  # loaded total_stock (10) is not written back
+        self.product.save()
+        self.assertEqual(self.total(self.product), 9)
+
+    def test_in_stock_filter(self):
+        response = self.client.get('/api/products/?in_stock=true')
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.product.pk])
+        response = self.client.get('/api/products/?in_stock=false')
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.other.pk])
+
+    def test_reconcile_repairs_drift_in_chunks(self):
+        Product.objects.filter(pk=self.product.pk).update(total_stock=99)
+        Product.objects.filter(pk=self.other.pk).update(total_stock=4)
+        self.assertEqual(inventory.reconcile_total_stock(chunk_size=1), 2)
+        self.assertEqual((self.total(self.product), self.total(self.other)), (10, 0))
+        self.assertEqual(inventory.reconcile_total_stock(), 0)
+
+
+class CheckoutTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.wallet = Wallet.objects.create(user=self.user, balance=1000)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill(self, lines, start=0):
+        for n in range(start, start + lines):
+            variant = self.make_product(n, variants=1, images=0).variants.get()
+            CartProduct.objects.create(cart=self.cart, product_id=variant.product_id, variant=variant, quantity=2)
+
+    def checkout(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/carts/{self.cart.pk}/checkout/')
+        return response, len(ctx.captured_queries)
+
+    def test_checkout_converts_cart_in_constant_queries(self):
+        self.fill(1)
+        small, small_queries = self.checkout()
+        self.assertEqual(small.status_code, 201)
+        self.fill(3, start=1)
+        large, large_queries = self.checkout()
+        self.assertEqual(large.status_code, 201)
+        self.assertEqual(small_queries, large_queries)
+
+        order = Order.objects.get(pk=large.data['id'])
+        self.assertEqual((order.total, order.status), (Decimal('600.00'), 'Placed'))
+        self.assertEqual(len(large.data['products']), 3)
+        self.assertEqual(set(order.orderproduct_set.values_list('unit_price', flat=True)), {Decimal('100.00')})
+        self.assertFalse(CartProduct.objects.filter(cart=self.cart).exists())
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).balance, Decimal('200.00'))
+        self.assertEqual(self.wallet.wallettransaction_set.count(), 2)
+        self.assertEqual(set(ProductVariant.objects.values_list('stock', flat=True)), {3})
+        self.assertEqual(set(Product.objects.values_list('total_stock', flat=True)), {3})
+
+    def test_large_carts_take_the_same_queries(self):
+        self.fill(1)
+        small_queries = self.checkout()[1]
+        self.fill(120, start=1)
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=100000)
+        large, large_queries = self.checkout()
+        self.assertEqual(large.status_code, 201)
+        self.assertEqual(small_queries, large_queries)
+        self.assertFalse(CartProduct.objects.filter(cart=self.cart).exists())
+
+    def test_checkout_changes_the_cart_etag(self):
+        self.fill(1)
+        url = f'/api/carts/{self.cart.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.checkout()[0].status_code, 201)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['products']), (200, []))
+
+    def test_free_orders_skip_the_wallet_debit(self):
+        self.fill(1)
+        Product.objects.update(price=0)
+        response, _ = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.get().total, 0)
+        self.assertFalse(self.wallet.wallettransaction_set.exists())
+
+    def test_discounts_are_bounded(self):
+        for serializer_class in (ProductOfferSerializer, FlashSaleSerializer):
+            serializer = serializer_class(data={
+                'discount_percentage': 150, 'start_date': timezone.now(), 'end_date': timezone.now(),
+            })
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('discount_percentage', serializer.errors)
+        product = self.make_product(0, variants=0)
+        ProductOffer.objects.create(product=product, discount_percentage=150,  # from before validation
+                                    start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1))
+        self.assertEqual(ProductPrice.objects.get(product=product).effective_price, 0)
+
+    def test_shortfalls_roll_everything_back(self):
+        self.fill(2)
+        line = CartProduct.objects.filter(cart=self.cart).last()
+        line.quantity = 6
+        line.save()
+        self.assertEqual(self.checkout()[0].status_code, 409)
+        line.quantity = 1
+        line.save()
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=10)
+        self.assertEqual(self.checkout()[0].status_code, 409)
+
+        self.assertEqual(CartProduct.objects.filter(cart=self.cart).count(), 2)
+        self.assertEqual(set(ProductVariant.objects.values_list('stock', flat=True)), {5})
+        self.assertEqual(set(Product.objects.values_list('total_stock', flat=True)), {5})
+        self.assertFalse(Order.objects.exists())
+
+    def test_lines_need_a_variant(self):
+        CartProduct.objects.create(cart=self.cart, product=self.make_product(0, images=0), quantity=1)
+        self.assertEqual(self.checkout()[0].status_code, 400)
+        self.cart.cartproduct_set.all().delete()
+        self.assertEqual(self.checkout()[0].status_code, 400)
+
+
+class WalletLedgerTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.wallet = Wallet.objects.create(user=self.user)
+
+    def post(self, amount, transaction_type):
+        return self.client.post('/api/wallet-transactions/', {
+            'wallet': self.wallet.pk, 'amount': amount, 'transaction_type': transaction_type,
+        }, format='json')
+
+    def test_postings_move_the_balance_and_history_is_append_only(self):
+        self.assertEqual(self.post('50.00', 'Deposit').status_code, 201)
+        self.assertEqual(self.post('20.00', 'Withdrawal').status_code, 201)
+        self.assertEqual(self.post('40.00', 'Purchase').status_code, 409)
+        self.assertEqual(self.post('-5.00', 'Deposit').status_code, 400)
+        # Only the known types post; anything else would be taken for a credit.
+        self.assertEqual(self.post('50.00', 'withdrawal').status_code, 400)
+        self.assertEqual(self.post('50.00', 'Refund?').status_code, 400)
+        with self.assertRaises(ValueError):
+            ledger.post_transaction(self.wallet.pk, 50, 'Bonus')
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).balance, Decimal('30.00'))
+        self.assertTrue(ledger.verify_balance(self.wallet.pk))
+
+        posted = self.wallet.wallettransaction_set.first()
+        url = f'/api/wallet-transactions/{posted.pk}/'
+        self.assertEqual(self.client.patch(url, {'amount': '1.00'}, format='json').status_code, 405)
+        self.assertEqual(self.client.delete(url).status_code, 405)
+        self.client.patch(f'/api/wallets/{self.wallet.pk}/', {'balance': '999.00'}, format='json')
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).balance, Decimal('30.00'))
+
+    def test_point_in_time_balance_uses_last_snapshot_and_tail(self):
+        start = timezone.now() - timedelta(days=10)
+        for day in range(10):
+            posted = ledger.post_transaction(self.wallet.pk, 10, 'Withdrawal' if day % 3 == 2 else 'Deposit')
+            WalletTransaction.objects.filter(pk=posted.pk).update(created_at=start + timedelta(days=day))
+        expected = {day: Decimal(10 * sum(-1 if d % 3 == 2 else 1 for d in range(day + 1))) for day in range(10)}
+        before = [ledger.balance_at(self.wallet.pk, start + timedelta(days=day, hours=1)) for day in range(1, 10)]
+
+        self.assertEqual(ledger.snapshot_wallets(as_of=start + timedelta(days=4, hours=12)), 1)
+        self.assertEqual(ledger.snapshot_wallets(as_of=start + timedelta(days=4, hours=12)), 0)
+        ledger.take_snapshot(self.wallet.pk, start + timedelta(days=7, hours=12))
+        self.assertEqual(WalletSnapshot.objects.count(), 2)
+        with CaptureQueriesContext(connection) as ctx:
+            after = [ledger.balance_at(self.wallet.pk, start + timedelta(days=day, hours=1)) for day in range(1, 10)]
+        self.assertEqual(len(ctx.captured_queries), 18)
+        self.assertEqual(before, after)
+        self.assertEqual(after, [expected[day] for day in range(1, 10)])
+
+        response = self.client.get(f'/api/wallets/{self.wallet.pk}/balance/', {'at': (start + timedelta(days=8, hours=1)).isoformat()})
+        self.assertEqual(Decimal(response.data['balance']), expected[8])
+
+    def test_snapshots_lag_behind_recent_postings(self):
+        ledger.post_transaction(self.wallet.pk, 10, 'Deposit')
+        snapshot = ledger.take_snapshot(self.wallet.pk)
+        self.assertLessEqual(snapshot.as_of, timezone.now() - ledger.SNAPSHOT_LAG)
+        self.assertEqual(snapshot.balance, 0)
+        self.assertEqual(ledger.balance_at(self.wallet.pk), Decimal('10.00'))
+
+    def test_migration_posts_opening_balances(self):
+        from django.apps import apps
+        migration = import_module('apiApp.migrations.0018_wallet_opening_balances')
+
+        WalletTransaction.objects.create(wallet=self.wallet, amount=20, transaction_type='Deposit')
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=70)
+        untouched = Wallet.objects.create(user=User.objects.create_user(username='empty'))
+        migration.post_opening_balances(apps, None)
+
+        opening = self.wallet.wallettransaction_set.order_by('-id').first()
+        self.assertEqual((opening.transaction_type, opening.amount), ('Deposit', Decimal('50.00')))
+        self.assertTrue(ledger.verify_balance(self.wallet.pk))
+        self.assertFalse(untouched.wallettransaction_set.exists())
+
+
+class WalletHistoryTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        self.wallet = Wallet.objects.create(user=self.user)
+        self.start = timezone.now() - timedelta(days=30)
+        self.post(30)
+
+    def post(self, days, start_day=0):
+        WalletTransaction.objects.bulk_create([
+            WalletTransaction(wallet=self.wallet, amount=day + 1, transaction_type='Withdrawal' if day % 2 else 'Deposit')
+            for day in range(start_day, start_day + days)
+        ])
+        for day in range(start_day, start_day + days):
+            WalletTransaction.objects.filter(amount=day + 1).update(created_at=self.start + timedelta(days=day))
+
+    def test_wallet_reads_are_bounded_by_the_recent_slice(self):
+        url = f'/api/wallets/{self.wallet.pk}/'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        recent = response.data['recent_transactions']
+        self.assertEqual(len(recent), 10)
+        self.assertEqual([row['amount'] for row in recent[:2]], ['30.00', '29.00'])
+        self.assertTrue(response.data['transactions_url'].endswith(f'/api/wallets/{self.wallet.pk}/transactions/'))
+
+        listed = self.client.get('/api/wallets/').data['results'][0]
+        self.assertNotIn('recent_transactions', listed)
+
+    def test_history_is_keyset_paginated_and_filtered(self):
+        url = f'/api/wallets/{self.wallet.pk}/transactions/'
+        seen, page = [], self.client.get(url, {'page_size': 7})
+        while True:
+            seen += [row['amount'] for row in page.data['results']]
+            if not page.data['next']:
+                break
+            page = self.client.get(page.data['next'])
+        self.assertEqual(seen, [f'{amount}.00' for amount in range(30, 0, -1)])
+
+        response = self.client.get(url, {
+            'since': (self.start + timedelta(days=10)).isoformat(),
+            'until': (self.start + timedelta(days=20)).isoformat(),
+            'type': 'Deposit',
+        })
+        self.assertEqual([row['amount'] for row in response.data['results']],
+                         [f'{day + 1}.00' for day in range(18, 9, -2)])
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+
+    def test_history_etag_follows_the_wallet(self):
+        url = f'/api/wallets/{self.wallet.pk}/transactions/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        ledger.post_transaction(self.wallet.pk, 5, 'Deposit')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class BulkIngestTests(CatalogFixtureMixin, APITestCase):
+    def row(self, n, **kwargs):
+        row = {
+            'title': f'Bulk shoe {n}', 'mrp': '120.00', 'price': '100.00', 'cost_price': '60.00',
+            'brand': 'acme', 'category': str(self.category.pk), 'subcategory': 'sneakers',
+            'variants': [
+                {'color': 'red', 'size': 'M', 'stock': 3, 'images': [f'product_variant_images/{n}-red.png']},
+                {'color': 'blue', 'size': 'L', 'stock': 4},
+            ],
+        }
+        row.update(kwargs)
+        return row
+
+    def test_bulk_create_uses_a_fixed_number_of_queries_per_batch(self):
+        def ingest(rows):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post('/api/products/bulk/', rows, format='json')
+            self.assertEqual(response.status_code, 200)
+            return response.data, len(ctx.captured_queries)
+
+        small, small_queries = ingest([self.row(0)])
+        large, large_queries = ingest([self.row(n) for n in range(1, 40)])
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual((large['created'], large['errors']), (39, []))
+
+        product = Product.objects.get(pk=large['results'][0]['id'])
+        self.assertEqual((product.slug, product.brand_id, product.total_stock), ('bulk-shoe-1', self.brand.pk, 7))
+        self.assertTrue(product.sku.startswith(f'{self.brand.pk}-'))
+        self.assertEqual(ProductImage.objects.filter(product_variant__product=product).count(), 1)
+        self.assertEqual(ProductPrice.objects.filter(product=product).count(), 1)
+
+    def test_upsert_by_sku_and_per_row_errors(self):
+        first = ingest_products([self.row(0, sku='SKU-0', title='Runner')])
+        self.assertEqual(first['created'], 1)
+        rows = [
+            self.row(0, sku='SKU-0', title='Runner v2', variants=[{'color': 'red', 'size': 'M', 'stock': 10}]),
+            self.row(1, brand='no-such-brand'),
+            self.row(2, price='cheap'),
+            self.row(3, title='Runner', slug='runner'),   # explicit slug already taken
+            self.row(4, title='Runner'),                  # generated slug gets a suffix
+            'not an object',
+        ]
+        response = self.client.post('/api/products/bulk/', rows, format='json')
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3, 5])
+        self.assertIn('brand', response.data['errors'][0]['errors'])
+
+        updated = Product.objects.get(sku='SKU-0')
+        self.assertEqual((updated.title, updated.slug, updated.total_stock), ('Runner v2', 'runner', 14))
+        suffixed = Product.objects.get(pk=response.data['results'][1]['id'])
+        self.assertRegex(suffixed.slug, r'^runner-\d+$')
+
+    def test_variant_bulk_accepts_ndjson(self):
+        product = self.make_product(0, variants=1, images=0)
+        body = '\n'.join([
+            '{"product": "%s", "color": "c0", "size": "s0", "stock": 9}' % product.sku,
+            '{"product": "%s", "color": "green", "size": "XL", "images": ["product_variant_images/g.png"]}' % product.pk,
+            '{"product": "missing", "color": "x", "size": "y"}',
+            '',
+        ])
+        response = self.client.post('/api/product-variants/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual([error['index'] for error in response.data['errors']], [2])
+        self.assertEqual(Product.objects.get(pk=product.pk).total_stock, 9)
+        self.assertEqual(self.client.post('/api/product-variants/bulk/', '{"x": 1}\n{oops',
+                                          content_type='application/x-ndjson').status_code, 400)
+
+    def test_ingested_images_get_derivatives_queued(self):
+        with mock.patch.object(images, 'schedule') as schedule, self.captureOnCommitCallbacks(execute=True):
+            ingest_products([self.row(0)])
+        image = ProductImage.objects.get()
+        schedule.assert_called_once_with('apiApp.ProductImage', image.pk)
+
+        with self.settings(TASKS_EAGER=False):
+            ingest_products([self.row(1)])
+        queued = QueuedTask.objects.get(name='images.render')
+        self.assertEqual(queued.payload, ['apiApp.ProductImage', ProductImage.objects.latest('pk').pk])
+
+
+class CatalogExchangeTests(CatalogFixtureMixin, TestCase):
+    def snapshot(self):
+        return sorted(
+            (product.sku, product.slug, product.title, str(product.price), product.total_stock,
+             sorted((v.color, v.size, v.stock, sorted(i.image.name for i in v.images.all())) for v in product.variants.all()))
+            for product in Product.objects.prefetch_related('variants__images')
+        )
+
+    def round_trip(self, name):
+        for n in range(5):
+            self.make_product(n, variants=n % 3, description=f'Line one\nline "{n}"')
+        before = self.snapshot()
+        path = f'{tempfile.mkdtemp()}/{name}'
+        err = StringIO()
+        call_command('export_catalog', path, chunk_size=2, stderr=err)
+        self.assertIn('Exported 5 products (17 rows)', err.getvalue())
+
+        Product.objects.all().delete()
+        out = StringIO()
+        call_command('import_catalog', path, batch_size=2, stdout=out, stderr=StringIO())
+        self.assertIn('Imported 5 new and 0 updated products (17 rows)', out.getvalue())
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+        return path
+
+    def test_ndjson_round_trip(self):
+        self.round_trip('catalog.ndjson')
+
+    def test_csv_round_trip(self):
+        self.round_trip('catalog.csv')
+
+    def test_import_resumes_from_checkpoint(self):
+        path = self.round_trip('catalog.ndjson')
+        with open(path) as fh:
+            skus = [json.loads(line)['sku'] for line in fh]
+        Product.objects.filter(sku__in=skus[3:]).delete()
+        with open(f'{path}.checkpoint', 'w') as fh:
+            json.dump({'size': os.path.getsize(path), 'records': 3}, fh)
+
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out)
+        self.assertIn('Resuming after record 3', out.getvalue())
+        self.assertIn('Imported 2 new and 0 updated', out.getvalue())
+        self.assertEqual(Product.objects.count(), 5)
+
+        with open(f'{path}.checkpoint', 'w') as fh:
+            json.dump({'size': 1, 'records': 3}, fh)
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', path, stdout=StringIO())
+
+
+class IdentifierTests(CatalogFixtureMixin, TestCase):
+    def test_same_titles_get_numbered_slugs_skipping_taken_ones(self):
+        self.make_product(0, variants=0, title='Twin', slug='twin-3')
+        slugs = [self.make_product(n, variants=0, title='Twin').slug for n in range(1, 4)]
+        self.assertEqual(slugs, ['twin', 'twin-2', 'twin-4'])
+        self.assertEqual([Brand.objects.create(title=title).slug for title in ('Café', 'Cafe', '!!!')],
+                         ['cafe', 'cafe-2', 'brand'])
+
+    def test_skus_follow_a_per_brand_sequence(self):
+        other = Brand.objects.create(title='Other')
+        self.make_product(0, variants=0, sku=f'{self.brand.pk}-000002')
+        skus = [self.make_product(n, variants=0, brand=brand).sku for n, brand in
+                enumerate((self.brand, self.brand, other), start=1)]
+        self.assertEqual(skus, [f'{self.brand.pk}-000001', f'{self.brand.pk}-000003', f'{other.pk}-000001'])
+
+    def test_bulk_allocation_uses_a_fixed_number_of_queries(self):
+        def count(titles):
+            with CaptureQueriesContext(connection) as ctx:
+                slugs = identifiers.unique_slugs(Product, titles)
+            return slugs, len(ctx.captured_queries)
+
+        _, few = count(['Solo'])
+        slugs, many = count(['Crowd'] * 50 + [f'Item {n}' for n in range(50)])
+        self.assertEqual(few, many)
+        self.assertEqual(slugs[:3] + slugs[50:51], ['crowd', 'crowd-2', 'crowd-3', 'item-0'])
+        self.assertEqual(len(set(slugs)), 100)
+
+
+class RatingTests(CatalogFixtureMixin, APITestCase):
+    def rating(self, product):
+        return self.client.get(f'/api/products/{product.pk}/?fields=rating').json()['rating']
+
+    def test_aggregates_follow_review_writes(self):
+        product = self.make_product(0, variants=0)
+        other = User.objects.create_user(username='critic')
+        self.assertIsNone(self.rating(product))
+
+        liked = ProductReview.objects.create(product=product, user=self.user, rating=5, approved=True)
+        pending = ProductReview.objects.create(product=product, user=other, rating=2)
+        self.assertEqual(self.rating(product), {'count': 1, 'average': '5.00', 'histogram': {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1}})
+
+        pending.approved = True
+        pending.save()
+        liked.rating = 4
+        liked.review = 'Good, not great'
+        liked.save()
+        self.assertEqual(self.rating(product), {'count': 2, 'average': '3.00', 'histogram': {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0}})
+
+        pending.delete()
+        self.assertEqual(self.rating(product)['histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0})
+        ProductRating.objects.filter(pk=product.pk).update(count=9)
+        call_command('reconcile_ratings', stdout=StringIO())
+        self.assertEqual(ProductRating.objects.get(pk=product.pk).count, 1)
+
+    def test_products_sort_by_rating_across_keyset_pages(self):
+        products = [self.make_product(n, variants=0) for n in range(5)]
+        for product, stars in zip(products, (3, 5, None, 3, 1)):
+            if stars:
+                ProductReview.objects.create(product=product, user=self.user, rating=stars, approved=True)
+        seen, url = [], '/api/products/?ordering=-rating&page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(seen, [products[n].pk for n in (1, 3, 0, 4, 2)])
+        self.assertEqual(self.client.get('/api/products/?ordering=price').status_code, 400)
+
+    def test_review_list_is_query_constant(self):
+        def count():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get('/api/product-reviews/')
+            return response.json()['results'], len(ctx.captured_queries)
+
+        product = self.make_product(0, variants=0)
+        ProductReview.objects.create(product=product, user=self.user, rating=4)
+        rows, baseline = count()
+        for n in range(5):
+            ProductReview.objects.create(product=product, user=User.objects.create_user(username=f'u{n}'), rating=3)
+        more_rows, queries = count()
+        self.assertEqual((len(more_rows), queries), (6, baseline))
+        self.assertEqual((rows[0]['user'], rows[0]['product']), ('shopper', 'Product 0'))
+
+
+class NavigationTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_tree_lists_active_groups_with_product_counts(self):
+        Subcategory.objects.create(title='Boots', category=self.category, active=False)
+        running = Subcategory.objects.create(title='Running', category=self.category)
+        hidden = Category.objects.create(title='Hidden', active=False)
+        Subcategory.objects.create(title='Hidden child', category=hidden)
+        self.make_product(0, variants=0)
+        self.make_product(1, variants=0, subcategory=running)
+        self.make_product(2, variants=0, active=False)
+
+        response = self.client.get('/api/navigation/')
+        self.assertEqual(response.json(), [{
+            'id': self.category.pk, 'title': 'Shoes', 'slug': 'shoes', 'product_count': 2,
+            'subcategories': [
+                {'id': running.pk, 'title': 'Running', 'slug': 'running', 'product_count': 1},
+                {'id': self.subcategory.pk, 'title': 'Sneakers', 'slug': 'sneakers', 'product_count': 1},
+            ],
+        }])
+
+    def test_served_from_memory_until_navigation_changes(self):
+        product = self.make_product(0, variants=0)
+        etag = self.client.get('/api/navigation/')['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/navigation/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get('/api/navigation/').status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        product.price = 90
+        product.save()
+        self.assertEqual(self.client.get('/api/navigation/')['ETag'], etag)
+
+        product.active = False
+        product.save()
+        response = self.client.get('/api/navigation/')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['product_count'], 0)
+
+        Category.objects.create(title='Bags')
+        self.assertEqual([row['title'] for row in self.client.get('/api/navigation/').json()], ['Bags', 'Shoes'])
+
+
+def png_upload(name, size, mode='RGB'):
+    buffer = BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageDerivativeTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, IMAGE_DERIVATIVE_WORKERS=0, MEDIA_BLOB_GRACE=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+        cache.clear()
+
+    def upload(self, instance, field, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            getattr(instance, field).save(upload.name, upload)
+        instance.refresh_from_db()
+
+    def test_upload_is_resized_to_responsive_widths(self):
+        product = self.make_product(0, variants=0)
+        self.upload(product, 'thumb', png_upload('shoe.png', (800, 400), 'RGBA'))
+
+        entry = product.renditions['thumb']
+        self.assertEqual((entry['source'], entry['width'], entry['height']), (product.thumb.name, 800, 400))
+        self.assertEqual(
+            [(item['format'], item['width'], item['height']) for item in entry['derivatives']],
+            [(fmt, width, width // 2) for width in (160, 320, 640, 800) for fmt in ('webp', 'jpeg')],
+        )
+        for item in entry['derivatives']:
+            self.assertEqual(os.path.getsize(os.path.join(self.media, item['name'])), item['bytes'])
+
+        card = self.client.get('/api/products/').json()['results'][0]['thumb_srcset']
+        detail = self.client.get(f'/api/products/{product.pk}/').json()
+        self.assertEqual(card, detail['thumb_srcset'])
+        self.assertIsNone(detail['banner_srcset'])
+        self.assertNotIn('renditions', detail)
+        self.assertEqual((card['width'], card['height']), (800, 400))
+        self.assertRegex(card['webp'].split(', ')[0], r'^http://testserver/media/blobs/[0-9a-f/]{6}[0-9a-f]{64}\.webp 160w$')
+        self.assertTrue(card['jpeg'].endswith('.jpg 800w'))
+
+    def test_replaced_upload_drops_stale_derivatives(self):
+        brand = Brand.objects.create(title='Nimbus')
+        self.upload(brand, 'banner', png_upload('old.png', (200, 100)))
+        old = [item['name'] for item in brand.renditions['banner']['derivatives']]
+        self.assertEqual(len(old), 4)  # 160w and the original 200w
+
+        # Until the new upload is processed the old srcset isn't served for it.
+        brand.banner.save('new.png', png_upload('new.png', (100, 50)))
+        self.assertIsNone(self.client.get(f'/api/brands/{brand.pk}/').json()['banner_srcset'])
+        self.upload(brand, 'banner', png_upload('new.png', (100, 50)))
+
+        self.assertEqual([item['width'] for item in brand.renditions['banner']['derivatives']], [100, 100])  # never upscaled
+        for name in old:
+            self.assertFalse(os.path.exists(os.path.join(self.media, name)))
+        self.assertEqual(self.client.get(f'/api/brands/{brand.pk}/').json()['banner_srcset']['width'], 100)
+
+    def test_saves_of_stale_instances_keep_renditions(self):
+        product = self.make_product(0, variants=0)
+        upload = png_upload('shoe.png', (400, 300))
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.thumb.save(upload.name, upload)
+        stale = Product.objects.get(pk=product.pk)  # loaded before the derivatives exist
+        for callback in callbacks:
+            callback()
+        stale.price = 90
+        stale.save()
+        product.refresh_from_db()
+        self.assertEqual(product.price, 90)
+        self.assertEqual(len(product.renditions['thumb']['derivatives']), 6)
+
+        with mock.patch.object(images, 'schedule') as schedule, self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        schedule.assert_not_called()
+
+    def test_unreadable_upload_is_recorded_not_retried(self):
+        variant = ProductVariant.objects.create(product=self.make_product(0, variants=0), color='red', size='m')
+        image = ProductImage(product_variant=variant)
+        image.image.save('broken.png', SimpleUploadedFile('broken.png', b'not an image'), save=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+        self.assertIn('error', image.renditions['image'])
+        self.assertIsNone(self.client.get(f'/api/product-images/{image.pk}/').json()['image_srcset'])
+        with mock.patch.object(images, 'schedule') as schedule, self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        schedule.assert_not_called()
+
+    def test_backfill_command_renders_missing_rows(self):
+        category = Category.objects.create(title='Bags')
+        category.thumb.save('bag.png', png_upload('bag.png', (300, 300)))  # no on_commit in TestCase
+        self.assertEqual(Category.objects.get(pk=category.pk).renditions, {})
+        out = StringIO()
+        call_command('generate_image_derivatives', stdout=out)
+        self.assertIn('for 1 rows', out.getvalue())
+        self.assertEqual(len(Category.objects.get(pk=category.pk).renditions['thumb']['derivatives']), 4)  # 160w, 300w
+
+
+class ContentAddressedStorageTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, IMAGE_DERIVATIVE_WORKERS=0, MEDIA_BLOB_GRACE=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+        self.variant = ProductVariant.objects.create(product=self.make_product(0, variants=0), color='red', size='m')
+
+    def add_image(self, name, size=(20, 10), variant=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product_variant=variant or self.variant, image=png_upload(name, size))
+
+    def refs(self, image):
+        return MediaBlob.objects.get(name=image.image.name).refs
+
+    def test_identical_uploads_share_one_blob(self):
+        other = ProductVariant.objects.create(product=self.variant.product, color='red', size='l')
+        first, second = self.add_image('front.png'), self.add_image('front-copy.png', variant=other)
+        third = self.add_image('back.png', size=(30, 10))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertNotEqual(first.image.name, third.image.name)
+        self.assertEqual((self.refs(first), self.refs(third)), (2, 1))
+        # The second row reuses the first one's derivatives.
+        self.assertEqual(ProductImage.objects.get(pk=second.pk).renditions, ProductImage.objects.get(pk=first.pk).renditions)
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        first, second = self.add_image('front.png'), self.add_image('front-copy.png')
+        path = os.path.join(self.media, first.image.name)
+        derivative = os.path.join(self.media, ProductImage.objects.get(pk=first.pk).renditions['image']['derivatives'][0]['name'])
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.refs(second), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(derivative))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_replaced_upload_is_released_after_grace_period(self):
+        image = self.add_image('front.png')
+        old = image.image.name
+        with override_settings(MEDIA_BLOB_GRACE=3600), self.captureOnCommitCallbacks(execute=True):
+            image.image = png_upload('back.png', (30, 10))
+            image.save()
+        self.assertTrue(os.path.exists(os.path.join(self.media, old)))  # recently uploaded
+        self.assertEqual((MediaBlob.objects.get(name=old).refs, self.refs(image)), (0, 1))
+
+        out = StringIO()
+        call_command('reconcile_media', '--collect', stdout=out)
+        self.assertFalse(os.path.exists(os.path.join(self.media, old)))
+        self.assertTrue(os.path.exists(os.path.join(self.media, image.image.name)))
+        self.assertIn('collected', out.getvalue())
+
+    def test_reconcile_recounts_references(self):
+        image = self.add_image('front.png')
+        ingest_products([{
+            'title': 'Copy', 'mrp': '10', 'price': '10', 'cost_price': '5', 'brand': 'acme', 'category': 'shoes',
+            'subcategory': 'sneakers', 'variants': [{'color': 'red', 'size': 'm', 'images': [image.image.name]}],
+        }])
+        self.assertEqual(self.refs(image), 2)
+        MediaBlob.objects.update(refs=7)
+        call_command('reconcile_media', stdout=StringIO())
+        self.assertEqual(self.refs(image), 2)
+        derivatives = ProductImage.objects.get(pk=image.pk).renditions['image']['derivatives']
+        self.assertEqual(MediaBlob.objects.get(name=derivatives[0]['name']).refs, 1)
+
+    def test_media_is_served_with_immutable_cache_headers(self):
+        image = self.add_image('front.png')
+        response = self.client.get(f'/media/{image.image.name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], f'"{image.image.name.rsplit("/", 1)[1][:64]}"')
+        self.assertEqual(b''.join(response.streaming_content), image.image.open('rb').read())
+
+        response = self.client.get(f'/media/{image.image.name}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        os.makedirs(os.path.join(self.media, 'legacy'))
+        with open(os.path.join(self.media, 'legacy', 'a.png'), 'wb') as fh:
+            fh.write(b'png')
+        self.assertEqual(self.client.get('/media/legacy/a.png')['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(self.client.get('/media/legacy/missing.png').status_code, 404)
+
+
+class AsyncReadPathTests(CatalogFixtureMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def assertSamePayload(self, path):
+        sync = self.client.get(f'/api/{path}')
+        response = self.client.get(f'/api/async/{path}')
+        self.assertEqual(response.status_code, sync.status_code, path)
+        # Links point back at the endpoint they came from.
+        self.assertEqual(json.loads(response.content.replace(b'/api/async/', b'/api/')), sync.json(), path)
+        return response
+
+    def test_payloads_match_sync_endpoints(self):
+        for n in range(3):
+            self.make_product(n)
+        product = Product.objects.first()
+        ProductReview.objects.create(product=product, user=self.user, rating=5, approved=True)
+        offer = ProductOffer.objects.create(
+            product=product, discount_percentage=10,
+            start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1),
+        )
+        paths = [
+            'products/', 'products/?ordering=-rating&in_stock=true', 'products/?fields=id,title',
+            'products/?expand=variants', f'products/{product.pk}/', f'products/{product.pk}/?fields=id,variants',
+            'categories/', f'categories/{self.category.pk}/', 'brands/', f'brands/{self.brand.pk}/',
+            'product-offers/', f'product-offers/{offer.pk}/', 'products/999999/', 'products/?ordering=bogus',
+        ]
+        for path in paths:
+            self.assertSamePayload(path)
+
+        page = self.assertSamePayload('products/?page_size=2').json()
+        self.assertTrue(page['next'].startswith('http://testserver/api/async/products/'))
+        following = self.client.get(page['next']).json()
+        self.assertEqual([row['id'] for row in following['results']], [product.pk])
+        self.assertSamePayload(f"products/?{following['previous'].split('?', 1)[1]}")
+
+    def test_detail_fans_out_variant_tree(self):
+        product = self.make_product(0, variants=3, images=2)
+        with CaptureQueriesContext(connection) as ctx:
+            detail = self.client.get(f'/api/async/products/{product.pk}/').json()
+        self.assertEqual([len(variant['images']) for variant in detail['variants']], [2, 2, 2])
+        # Prices, versions, the product with its rating, variants, images.
+        self.assertLessEqual(len([q for q in ctx.captured_queries if 'apiapp_product' in q['sql']]), 4)
+        self.assertEqual(self.client.get('/api/async/products/0/').json(), {'detail': 'No Product matches the given query.'})
+
+    def test_conditional_get_and_response_cache(self):
+        product = self.make_product(0)
+        first = self.client.get('/api/async/products/')
+        self.assertEqual((first['X-Cache'], self.client.get('/api/async/products/')['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(self.client.get('/api/async/products/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        product.title = 'Renamed'
+        product.save()
+        response = self.client.get('/api/async/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((response.status_code, response.json()['results'][0]['title']), (200, 'Renamed'))
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    async def test_served_by_the_asgi_handler(self):
+        product = await sync_to_async(self.make_product)(0)
+        response = await self.async_client.get(f'/api/async/products/{product.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['id'], product.pk)
+
+
+@override_settings(TASKS_EAGER=False, TASK_MAX_ATTEMPTS=2, TASK_RETRY_DELAY=60)
+class TaskQueueTests(CatalogFixtureMixin, APITestCase):
+    def search(self, q):
+        return [p['id'] for p in self.client.get('/api/products/search/', {'q': q}).data['results']]
+
+    def test_side_effects_wait_for_a_worker(self):
+        product = self.make_product(0, variants=0, title='Trail Runner')
+        product.title = 'Trail Runner Pro'
+        product.save()
+        self.brand.title = 'Apex'
+        self.brand.save()
+        self.assertEqual(self.search('runner'), [])
+        self.assertEqual(list(QueuedTask.objects.values_list('name', 'payload')), [('search.index_products', product.pk)])
+
+        out = StringIO()
+        call_command('run_workers', '--once', stdout=out)
+        self.assertIn('Ran 1 tasks', out.getvalue())
+        self.assertEqual(self.search('apex runner'), [product.pk])
+        self.assertFalse(QueuedTask.objects.exists())
+
+    def test_same_type_tasks_run_in_batches(self):
+        calls = []
+        with mock.patch.dict(tasks.TASKS, {'test.collect': tasks.Task(calls.append, 2)}):
+            tasks.enqueue('test.collect', [1, 2, 2, 3])
+            tasks.enqueue('test.collect', [3])
+            self.assertEqual(QueuedTask.objects.count(), 3)
+            self.assertEqual(tasks.run_worker(once=True), 3)
+        self.assertEqual(calls, [[1, 2], [3]])
+
+    def test_failures_back_off_then_fail(self):
+        def fail(payloads):
+            raise ValueError('boom')
+
+        with mock.patch.dict(tasks.TASKS, {'test.fail': tasks.Task(fail, 1)}):
+            tasks.enqueue('test.fail', ['x'])
+            self.assertEqual(tasks.run_worker(once=True), 1)
+            row = QueuedTask.objects.get()
+            self.assertEqual((row.state, row.attempts), (QueuedTask.PENDING, 1))
+            self.assertGreater(row.run_after, timezone.now() + timedelta(seconds=50))
+            self.assertIn('ValueError: boom', row.last_error)
+            self.assertEqual(tasks.run_worker(once=True), 0)
+
+            QueuedTask.objects.update(run_after=timezone.now())
+            tasks.run_worker(once=True)
+            row.refresh_from_db()
+            self.assertEqual((row.state, row.attempts), (QueuedTask.FAILED, 2))
+            # A failed row doesn't block queuing the work again.
+            tasks.enqueue('test.fail', ['x'])
+            self.assertEqual(QueuedTask.objects.filter(state=QueuedTask.PENDING).count(), 1)
+
+    def test_tasks_of_a_stopped_worker_are_reclaimed(self):
+        calls = []
+        with mock.patch.dict(tasks.TASKS, {'test.collect': tasks.Task(calls.append, 10)}):
+            tasks.enqueue('test.collect', ['a'])
+            self.assertEqual([row.payload for row in tasks.claim('gone:1')], ['a'])
+            self.assertEqual(tasks.run_worker(once=True), 0)
+
+            QueuedTask.objects.update(claimed_at=timezone.now() - timedelta(seconds=301))
+            self.assertEqual(tasks.run_worker(once=True), 1)
+        self.assertEqual(calls, [['a']])
+
+
+def run_concurrently(func, threads, calls):
+    """
+    Call `func(thread_index)` `calls` times on each of `threads` threads, each
+    with its own connection. SQLite serialises writers, so a call that hits
+    the lock is retried (for up to 30s, then raised rather than dropped);
+    other backends never raise OperationalError here.
+    """
+    def worker(index):
+        try:
+            for _ in range(calls):
+                deadline = time.monotonic() + 30
+                while True:
+                    try:
+                        func(index)
+                    except OperationalError:
+                        if time.monotonic() > deadline:
+                            raise
+                        time.sleep(0.005)
+                        continue
+                    break
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+
+class ConcurrentReservationTests(CatalogFixtureMixin, TransactionTestCase):
+    def test_concurrent_buyers_never_oversell(self):
+        self.setUpTestData()
+        variant = self.make_product(0, variants=1, images=0).variants.get()
+        ProductVariant.objects.filter(pk=variant.pk).update(stock=20)
+        outcomes = []
+
+        def buyer(index):
+            try:
+                inventory.reserve(variant.pk, 1)
+                outcomes.append(True)
+            except inventory.InsufficientStock:
+                outcomes.append(False)
+
+        run_concurrently(buyer, threads=8, calls=5)
+
+        self.assertEqual(outcomes.count(True), 20)
+        self.assertEqual(len(outcomes), 40)
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).stock, 0)
+        self.assertEqual(StockReservation.objects.filter(variant=variant).count(), 20)
+
+
+class ConcurrentIdentifierTests(TransactionTestCase):
+    def test_concurrent_allocators_never_share_a_sku(self):
+        allocated = []
+        run_concurrently(lambda index: allocated.extend(identifiers.unique_skus([7] * 20)), threads=8, calls=10)
+        self.assertEqual(sorted(allocated), [f'7-{n:06d}' for n in range(1, 1601)])
+
+
+class ConcurrentLedgerTests(CatalogFixtureMixin, TransactionTestCase):
+    def test_concurrent_postings_never_lose_updates(self):
+        self.setUpTestData()
+        wallet = Wallet.objects.create(user=self.user)
+        ledger.post_transaction(wallet.pk, 100, 'Deposit')
+        refused = []
+
+        def client(index):
+            transaction_type = ('Deposit', 'Withdrawal')[index % 2]
+            try:
+                ledger.post_transaction(wallet.pk, 10, transaction_type)
+            except ledger.InsufficientFunds:
+                refused.append(transaction_type)
+
+        run_concurrently(client, threads=8, calls=10)
+
+        self.assertNotIn('Deposit', refused)
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal(100 + 400 - 10 * (40 - len(refused))))
+        self.assertGreaterEqual(wallet.balance, 0)
+        self.assertTrue(ledger.verify_balance(wallet.pk))
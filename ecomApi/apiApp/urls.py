@@ -1,13 +1,15 @@
-from django.urls import path, include
+import re
+
+from django.urls import path, include, re_path
 from django.conf import settings  # Add this import
-from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     BrandViewSet, CategoryViewSet, SubcategoryViewSet, ProductViewSet, 
     ProductImageViewSet, ProductVariantViewSet, ProductReviewViewSet, 
     CartViewSet, CartProductViewSet, WishlistViewSet, OrderViewSet, 
     OrderProductViewSet, WalletViewSet, WalletTransactionViewSet, 
-    ProductOfferViewSet, FlashSaleViewSet
+    ProductOfferViewSet, FlashSaleViewSet, StockReservationViewSet, NavigationView, media
 )
 
 # Initialize router
@@ -30,12 +32,21 @@ router.register(r'wallets', WalletViewSet)
 router.register(r'wallet-transactions', WalletTransactionViewSet)
 router.register(r'product-offers', ProductOfferViewSet)
 router.register(r'flash-sales', FlashSaleViewSet)
+router.register(r'stock-reservations', StockReservationViewSet)
 
 # Define urlpatterns
 urlpatterns = [
+    path('api/navigation/', NavigationView.as_view(), name='navigation'),
+    # Async read path for ASGI deployments (see apiApp.async_views)
+    path('api/async/products/', async_views.products.list, name='async-product-list'),
+    path('api/async/products/<int:pk>/', async_views.products.retrieve, name='async-product-detail'),
+    path('api/async/categories/', async_views.categories.list, name='async-category-list'),
+    path('api/async/categories/<int:pk>/', async_views.categories.retrieve, name='async-category-detail'),
+    path('api/async/brands/', async_views.brands.list, name='async-brand-list'),
+    path('api/async/brands/<int:pk>/', async_views.brands.retrieve, name='async-brand-detail'),
+    path('api/async/product-offers/', async_views.product_offers.list, name='async-productoffer-list'),
+    path('api/async/product-offers/<int:pk>/', async_views.product_offers.retrieve, name='async-productoffer-detail'),
     path('api/', include(router.urls)),
+    # Media with long-lived cache headers (see views.media)
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', media, name='media'),
 ]
-
-# Serve media files during development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,93 +1,570 @@
-from rest_framework import viewsets
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import DecimalField, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views import static
+from datetime import timedelta
+
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 from .models import (
     Brand, Category, Subcategory, Product, ProductImage, ProductVariant, 
     ProductReview, Cart, CartProduct, Wishlist, Order, OrderProduct, 
-    Wallet, WalletTransaction, ProductOffer, FlashSale
+    Wallet, WalletTransaction, ProductOffer, FlashSale, StockReservation
 )
 from .serializers import (
-    BrandSerializer, CategorySerializer, SubcategorySerializer, ProductSerializer, 
+    BrandSerializer, CategorySerializer, SubcategorySerializer, ProductSerializer, ProductCardSerializer,
     ProductImageSerializer, ProductVariantSerializer, ProductReviewSerializer, 
     CartSerializer, CartProductSerializer, WishlistSerializer, OrderSerializer, 
-    OrderProductSerializer, WalletSerializer, WalletTransactionSerializer, 
-    ProductOfferSerializer, FlashSaleSerializer
+    OrderProductSerializer, WalletSerializer, WalletSummarySerializer, WalletTransactionSerializer, 
+    ProductOfferSerializer, FlashSaleSerializer, StockReservationSerializer,
+    ReserveSerializer, RestockSerializer, ReleaseReservationsSerializer, MAX_BIGINT,
 )
+from .querysets import eager_load
+from .compiled import compile_serializer
+from .navigation import get_navigation
+from .pricing import refresh_expired_prices
+from . import caching, checkout, facets, ingest, inventory, ledger, search, storage
+from .pagination import KeysetPagination
+from .parsers import NDJSONParser
+from .renderers import NDJSONRenderer, ndjson_lines
+
+
+def _parse(cast, value, name):
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (ValueError, ArithmeticError):
+        raise ValidationError({name: f'Invalid value {value!r}.'})
+
+
+def _parse_id(value, name):
+    # Out of the bigint range the database driver raises, not the lookup.
+    parsed = _parse(int, value, name)
+    if parsed is not None and not 1 <= parsed <= MAX_BIGINT:
+        raise ValidationError({name: f'Invalid value {value!r}.'})
+    return parsed
+
+
+def _validated(serializer_class, request):
+    serializer = serializer_class(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+def _bulk_rows(request):
+    if not isinstance(request.data, list):
+        raise ValidationError({'detail': 'Expected a JSON array or NDJSON rows.'})
+    return request.data
+
+
+def _parse_decimal(value, name):
+    # Decimal() accepts NaN and Infinity, which don't compare with prices.
+    parsed = _parse(Decimal, value, name)
+    if parsed is not None and not parsed.is_finite():
+        raise ValidationError({name: f'Invalid value {value!r}.'})
+    return parsed
+
+
+def _parse_datetime(value, name):
+    parsed = _parse(parse_datetime, value, name)
+    if parsed is None:
+        raise ValidationError({name: f'Invalid value {value!r}.'})
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+# Builds every viewset's queryset from its serializer tree so nested
+# relations are fetched with a fixed number of queries.
+class EagerLoadingMixin:
+    def get_queryset(self):
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return eager_load(super().get_queryset(), serializer)
+
+
+# Renders list responses through a serializer compiled once per request
+# (see apiApp.compiled); the JSON is identical to the DRF path.
+class CompiledListMixin:
+    def render_many(self, objects):
+        return compile_serializer(self.get_serializer(many=True))(objects)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.render_many(page))
+        return Response(self.render_many(queryset))
+
+
+# Conditional GET for list/retrieve: the ETag is computed from version keys
+# (see apiApp.caching) before the handler runs, so a matching If-None-Match
+# is answered with 304 without querying or serializing anything. Lists use
+# the model's collection version, detail pages their row version, plus the
+# collections in `etag_dependencies` whose rows are embedded in the payload.
+class ConditionalGetMixin:
+    etag_dependencies = ()
+
+    def etag_versions(self):
+        model_name = self.queryset.model._meta.model_name
+        own = self.row_version() if self.action == 'retrieve' else model_name
+        return [own, *self.etag_dependencies]
+
+    def row_version(self):
+        # Writes bump `<model>:<pk>`, so `/01/` has to read the key of `/1/`.
+        opts = self.queryset.model._meta
+        field = opts.pk if self.lookup_field == 'pk' else opts.get_field(self.lookup_field)
+        try:
+            value = field.to_python(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except DjangoValidationError:
+            raise NotFound()
+        return f'{opts.model_name}:{value}'
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
+
+    def conditional_response(self, request, render):
+        versions = caching.get_versions(self.etag_versions())
+        etag = caching.version_etag(request, request.accepted_renderer.format, versions)
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = self.render_response(request, etag, render)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+        return response
+
+    def render_response(self, request, etag, render):
+        return render()
+
+
+# Opt-in streaming for large list endpoints: `?stream=1` or `Accept:
+# application/x-ndjson` sends every matching row (filters apply, pagination
+# doesn't) as NDJSON in the paginator's ordering. Rows are fetched from a
+# server-side cursor `stream_chunk_size` at a time, with prefetches per
+# chunk, and rendered by the compiled serializer as the response is sent,
+# so memory stays flat however many rows match.
+class StreamingListMixin:
+    stream_chunk_size = 500
+
+    def get_renderers(self):
+        return [*super().get_renderers(), NDJSONRenderer()]
+
+    def perform_content_negotiation(self, request, force=False):
+        if self.action == 'list' and request.query_params.get('stream') in ('1', 'true'):
+            return NDJSONRenderer(), NDJSONRenderer.media_type
+        return super().perform_content_negotiation(request, force)
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != NDJSONRenderer.format:
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(request, self.stream_list)
+
+    def stream_list(self):
+        ordering = KeysetPagination().get_ordering(self)
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*ordering)
+        render = compile_serializer(self.get_serializer())
+        rows = queryset.iterator(chunk_size=self.stream_chunk_size)
+        return StreamingHttpResponse(ndjson_lines(map(render, rows)), content_type=NDJSONRenderer.media_type)
+
+
+class ModelViewSet(EagerLoadingMixin, ConditionalGetMixin, CompiledListMixin, viewsets.ModelViewSet):
+    pass
+
+
+class ReadOnlyModelViewSet(EagerLoadingMixin, ConditionalGetMixin, CompiledListMixin, viewsets.ReadOnlyModelViewSet):
+    pass
+
+
+# For viewsets whose payloads embed product prices: brings precomputed prices
+# whose promotion window has since opened or closed up to date first.
+class PricedMixin:
+    etag_dependencies = ('product',)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            refresh_expired_prices()
+
+
+# Serves list/retrieve from rendered bytes cached under their version ETag.
+class ResponseCacheMixin:
+    def render_response(self, request, etag, render):
+        # Browsable API pages carry per-user markup; only JSON is shared.
+        if request.accepted_renderer.format != 'json':
+            return render()
+
+        entry = caching.get_response(etag)
+        if entry is None:
+            response = self.finalize_response(request, render())
+            if response.status_code != 200:
+                return response
+            return cached_response(request, caching.store_response(etag, response.render()), 'MISS')
+        return cached_response(request, entry, 'HIT')
+
+
+def cached_response(request, entry, cache_status):
+    """The response for a rendered cache entry, honouring If-Modified-Since."""
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+    if 'If-None-Match' not in request.headers and if_modified_since and if_modified_since >= entry['last_modified']:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    response['X-Cache'] = cache_status
+    return response
+
 
 # Brand ViewSet
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(ResponseCacheMixin, ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
 
 # Category ViewSet
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ResponseCacheMixin, ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 # Subcategory ViewSet
-class SubcategoryViewSet(viewsets.ModelViewSet):
+class SubcategoryViewSet(ResponseCacheMixin, ModelViewSet):
     queryset = Subcategory.objects.all()
     serializer_class = SubcategorySerializer
 
 # Product Image ViewSet
-class ProductImageViewSet(viewsets.ModelViewSet):
+class ProductImageViewSet(ModelViewSet):
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSerializer
 
 # Product Variant ViewSet
-class ProductVariantViewSet(viewsets.ModelViewSet):
+class ProductVariantViewSet(StreamingListMixin, PricedMixin, ModelViewSet):
     queryset = ProductVariant.objects.all()
     serializer_class = ProductVariantSerializer
+    filter_params = ('product', 'color', 'size')
+
+    # POST a JSON array or NDJSON of variants (product id or SKU, color, size, ...);
+    # upserts by (product, color, size) and reports errors per row index.
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        return Response(ingest.ingest_variants(_bulk_rows(request)))
+
+    # POST {"quantity": n, "hold_seconds": s} -> a time-limited stock hold, or 409
+    @action(detail=True, methods=['post'])
+    def reserve(self, request, pk=None):
+        data = _validated(ReserveSerializer, request)
+        hold = timedelta(seconds=data['hold_seconds']) if 'hold_seconds' in data else inventory.DEFAULT_HOLD
+        try:
+            reservation = inventory.reserve(self.get_object().pk, data['quantity'], hold)
+        except inventory.InsufficientStock as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(StockReservationSerializer(reservation, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
+
+    # POST {"delta": n} -> atomic stock += n (n may be negative), or 409
+    @action(detail=True, methods=['post'])
+    def restock(self, request, pk=None):
+        delta = _validated(RestockSerializer, request)['delta']
+        variant = self.get_object()
+        try:
+            inventory.adjust_stock(variant.pk, delta)
+        except inventory.InsufficientStock as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        variant.refresh_from_db(fields=['stock'])
+        return Response({'id': variant.pk, 'stock': variant.stock})
+
+    # ?product=<id>&color=red,blue&size=M
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        for field in self.filter_params:
+            values = [value for raw in self.request.query_params.getlist(field) for value in raw.split(',') if value]
+            if field == 'product':
+                values = [_parse_id(value, field) for value in values]
+            if values:
+                queryset = queryset.filter(**{f'{field}__in': values})
+        return queryset
 
 # Product ViewSet
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(PricedMixin, ResponseCacheMixin, ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    etag_dependencies = ()  # variants, images and prices bump the product itself
+
+    # Lists render compact cards; `?expand=variants` adds the variant tree.
+    def get_serializer_class(self):
+        if self.action in ('list', 'search', 'browse'):
+            return ProductCardSerializer
+        return super().get_serializer_class()
+
+    # POST a JSON array or NDJSON of products (with nested variants/images);
+    # upserts by SKU and reports errors per row index. See apiApp.ingest.
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        return Response(ingest.ingest_products(_bulk_rows(request)))
+
+    # ?ordering=[-]rating|[-]reviews sorts by the precomputed rating aggregates
+    # (unreviewed products count as 0), keyset-paginated on (value, id).
+    sort_keys = {
+        'rating': ('sort_rating', Coalesce('rating__average', Value(Decimal('0.00')), output_field=DecimalField(max_digits=3, decimal_places=2))),
+        'reviews': ('sort_reviews', Coalesce('rating__count', Value(0))),
+    }
+
+    # ?in_stock=true|false reads the denormalized total_stock column
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        params = self.request.query_params
+        sort = params.get('ordering')
+        if sort is not None:
+            key = self.sort_keys.get(sort.lstrip('-'))
+            if key is None:
+                raise ValidationError({'ordering': f"Must be one of {', '.join(self.sort_keys)}, optionally prefixed with -."})
+            name, expression = key
+            queryset = queryset.annotate(**{name: expression})
+            self.ordering = (f'-{name}', '-id') if sort.startswith('-') else (name, 'id')
+
+        in_stock = params.get('in_stock')
+        if in_stock is None:
+            return queryset
+        if in_stock.lower() in ('true', '1'):
+            return queryset.filter(total_stock__gt=0)
+        if in_stock.lower() in ('false', '0'):
+            return queryset.filter(total_stock=0)
+        raise ValidationError({'in_stock': 'Must be true or false.'})
+
+    # /api/products/search/?q=<text>[&brand=<id>&category=<id>&subcategory=<id>&limit=<n>]
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        filters = {}
+        for facet in search.FACETS:
+            value = request.query_params.get(facet)
+            if value is not None:
+                try:
+                    filters[facet] = int(value)
+                except ValueError:
+                    raise ValidationError({facet: 'Must be an integer id.'})
+                if not 1 <= filters[facet] <= MAX_BIGINT:
+                    raise ValidationError({facet: 'Must be an integer id.'})
+        try:
+            limit = min(max(1, int(request.query_params.get('limit', 20))), search.MAX_RESULTS)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+
+        ids, total, facet_counts = search.search(request.query_params.get('q', ''), filters, limit)
+        products = self.get_queryset().in_bulk(ids)
+        results = self.render_many([products[pk] for pk in ids if pk in products])
+        return Response({'count': total, 'results': results, 'facets': facet_counts})
+
+    # /api/products/browse/?brand=1,2&color=red&size=M&price_min=100&price_max=500[&after=<id>]
+    # Combined facet filters with facet counts from the in-memory bitmap index.
+    @action(detail=False, methods=['get'])
+    def browse(self, request):
+        params = request.query_params
+        index = facets.get_index()
+        filters = {}
+        for facet in facets.FACETS:
+            values = [value for raw in params.getlist(facet) for value in raw.split(',') if value]
+            if facet in facets.TITLED_FACETS:
+                values = [_parse(int, value, facet) for value in values]
+            filters[facet] = values
+        price_min = _parse_decimal(params.get('price_min'), 'price_min')
+        price_max = _parse_decimal(params.get('price_max'), 'price_max')
+        after = _parse(int, params.get('after'), 'after')
+
+        masks = index.filter_masks(filters, price_min, price_max)
+        matched = index.match(masks)
+        page_size = KeysetPagination().get_page_size(request)
+        ids = index.ids_after(matched, after, page_size + 1)
+        page_ids = ids[:page_size]
+
+        products = self.get_queryset().in_bulk(page_ids)
+        results = self.render_many([products[pk] for pk in page_ids if pk in products])
+        next_link = None
+        if len(ids) > page_size:
+            next_link = replace_query_param(request.build_absolute_uri(), 'after', page_ids[-1])
+        return Response({
+            'count': matched.bit_count(),
+            'next': next_link,
+            'results': results,
+            'facets': index.counts(masks),
+        })
 
 # Product Review ViewSet
-class ProductReviewViewSet(viewsets.ModelViewSet):
+class ProductReviewViewSet(ModelViewSet):
     queryset = ProductReview.objects.all()
     serializer_class = ProductReviewSerializer
+    etag_dependencies = ('product',)
 
 # Cart Product ViewSet
-class CartProductViewSet(viewsets.ModelViewSet):
+class CartProductViewSet(PricedMixin, ModelViewSet):
     queryset = CartProduct.objects.all()
     serializer_class = CartProductSerializer
 
 # Cart ViewSet
-class CartViewSet(viewsets.ModelViewSet):
+class CartViewSet(PricedMixin, ModelViewSet):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
 
+    # POST -> 201 with the new Order; 409 when stock or wallet balance fall short
+    @action(detail=True, methods=['post'])
+    def checkout(self, request, pk=None):
+        try:
+            order = checkout.checkout(self.get_object())
+        except (inventory.InsufficientStock, ledger.InsufficientFunds) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        except checkout.CheckoutError as exc:
+            raise ValidationError({'detail': str(exc)})
+        order = eager_load(Order.objects.filter(pk=order.pk), OrderSerializer()).get()
+        return Response(OrderSerializer(order, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
+
 # Wishlist ViewSet
-class WishlistViewSet(viewsets.ModelViewSet):
+class WishlistViewSet(PricedMixin, ModelViewSet):
     queryset = Wishlist.objects.all()
     serializer_class = WishlistSerializer
 
 # Order Product ViewSet
-class OrderProductViewSet(viewsets.ModelViewSet):
+class OrderProductViewSet(PricedMixin, ModelViewSet):
     queryset = OrderProduct.objects.all()
     serializer_class = OrderProductSerializer
 
 # Order ViewSet
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(StreamingListMixin, PricedMixin, ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    ordering = ('-order_date', '-id')
 
-# Wallet Transaction ViewSet
-class WalletTransactionViewSet(viewsets.ModelViewSet):
+# Wallet Transaction ViewSet (append-only ledger, see apiApp.ledger)
+class WalletTransactionViewSet(ModelViewSet):
     queryset = WalletTransaction.objects.all()
     serializer_class = WalletTransactionSerializer
+    ordering = ('-created_at', '-id')
+    http_method_names = ['get', 'post', 'head', 'options']
+
+    # Posting applies the amount to the wallet balance atomically; 409 when a debit isn't covered
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            posted = ledger.post_transaction(data['wallet'].pk, data['amount'], data['transaction_type'])
+        except ledger.InsufficientFunds as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(posted).data, status=status.HTTP_201_CREATED)
 
 # Wallet ViewSet
-class WalletViewSet(viewsets.ModelViewSet):
+class WalletViewSet(ModelViewSet):
     queryset = Wallet.objects.all()
     serializer_class = WalletSerializer
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return WalletSummarySerializer
+        return super().get_serializer_class()
+
+    def etag_versions(self):
+        if self.action == 'transactions':
+            return [self.row_version()]
+        return super().etag_versions()
+
+    # /api/wallets/{id}/transactions/?since=<datetime>&until=<datetime>&type=Deposit,Purchase[&cursor=...]
+    # Newest first, keyset-paginated down the (wallet, created_at, id) index.
+    @action(detail=True, methods=['get'])
+    def transactions(self, request, pk=None):
+        return self.conditional_response(request, lambda: self.render_transactions(request))
+
+    def render_transactions(self, request):
+        params = request.query_params
+        queryset = WalletTransaction.objects.filter(wallet=self.get_object())
+        for name, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            if params.get(name) is not None:
+                queryset = queryset.filter(**{lookup: _parse_datetime(params[name], name)})
+        types = [value for raw in params.getlist('type') for value in raw.split(',') if value]
+        if types:
+            queryset = queryset.filter(transaction_type__in=types)
+
+        paginator = KeysetPagination()
+        paginator.ordering = WalletTransactionViewSet.ordering
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = WalletTransactionSerializer(many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(compile_serializer(serializer)(page))
+
+    # /api/wallets/{id}/balance/?at=<ISO 8601 datetime> -> balance from the last snapshot plus its tail
+    @action(detail=True, methods=['get'])
+    def balance(self, request, pk=None):
+        wallet = self.get_object()
+        at = request.query_params.get('at')
+        if at is None:
+            return Response({'wallet': wallet.pk, 'at': None, 'balance': str(wallet.balance)})
+        parsed = _parse_datetime(at, 'at')
+        return Response({'wallet': wallet.pk, 'at': parsed, 'balance': str(ledger.balance_at(wallet.pk, parsed))})
+
 # Product Offer ViewSet
-class ProductOfferViewSet(viewsets.ModelViewSet):
+class ProductOfferViewSet(PricedMixin, ModelViewSet):
     queryset = ProductOffer.objects.all()
     serializer_class = ProductOfferSerializer
 
 # Flash Sale ViewSet
-class FlashSaleViewSet(viewsets.ModelViewSet):
+class FlashSaleViewSet(PricedMixin, ModelViewSet):
     queryset = FlashSale.objects.all()
     serializer_class = FlashSaleSerializer
+
+# Stock Reservation ViewSet (holds are created via /product-variants/{id}/reserve/)
+class StockReservationViewSet(ReadOnlyModelViewSet):
+    queryset = StockReservation.objects.all()
+    serializer_class = StockReservationSerializer
+
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        released = inventory.release([self.get_object().pk])
+        return Response({'released': released})
+
+    # POST {"ids": [...]} releases many holds in one batch
+    @action(detail=False, methods=['post'], url_path='release')
+    def release_many(self, request):
+        ids = _validated(ReleaseReservationsSerializer, request)['ids']
+        return Response({'released': inventory.release(ids)})
+
+# /api/navigation/ -> active categories with their active subcategories and product
+# counts, as pre-rendered JSON from the per-process tree (see apiApp.navigation)
+class NavigationView(APIView):
+    def get(self, request):
+        navigation = get_navigation()
+        if navigation.etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(navigation.content, content_type='application/json')
+        response['ETag'] = navigation.etag
+        return response
+
+
+# /media/<path> -> uploaded files. Content-addressed blobs (see apiApp.storage)
+# never change under their name, so they are cacheable for a year and their
+# digest is the ETag; other names get a short max-age.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def media(request, path):
+    digest = storage.digest_of(path)
+    etag = f'"{digest}"' if digest else None
+    if etag and etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        response = static.serve(request, path, document_root=settings.MEDIA_ROOT)
+    if etag:
+        response['ETag'] = etag
+        response['Cache-Control'] = IMMUTABLE
+    else:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'MEDIA_MAX_AGE', 3600))
+    return response
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -84,6 +86,18 @@ DATABASES = {
     }
 }
 
+# Version keys, ETags and rendered responses (apiApp.caching) must be seen
+# by every worker process, so they live on disk rather than in per-process
+# memory. Files also stay outside database transactions, so a version bump
+# is visible to other workers as soon as it is made.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'ecomApi-cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -126,9 +140,39 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-STATICFILES_DIRS =os.path.join((BASE_DIR, 'media'))
+STATICFILES_DIRS = (os.path.join(BASE_DIR, 'media'),)
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles_build','static')
 
 
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'apiApp.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+}
+
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Uploads are stored once per content and reference-counted (apiApp.storage).
+STORAGES = {
+    'default': {'BACKEND': 'apiApp.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# Seconds an unreferenced blob is kept after its last upload.
+MEDIA_BLOB_GRACE = 3600
+# Cache lifetime of media outside content-addressed storage.
+MEDIA_MAX_AGE = 3600
+
+# Threads per process resizing uploads into derivatives (apiApp.images); 0 runs inline.
+IMAGE_DERIVATIVE_WORKERS = 2
+
+# Post-write side effects (apiApp.tasks) run in the request; set False to
+# queue them for `manage.py run_workers`.
+TASKS_EAGER = True
+# Attempts before a task is marked failed; retries back off from TASK_RETRY_DELAY seconds.
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 10
+# Seconds before a task claimed by a worker that stopped is run again.
+TASK_LEASE = 300
+# Longest stock hold a client may ask for (POST /api/product-variants/{id}/reserve/).
+STOCK_HOLD_MAX_SECONDS = 86400